@@ -0,0 +1,387 @@
+import os
+import numpy as np
+import pandas as pd
+
+from datos import RUTA_PARQUET, leer_datos, version_datos
+
+
+DIRECTORIO_AGREGADOS = "agregados"
+COLUMNAS_ARTISTAS = ("artist_name", "popularity", "genre", "year")
+COLUMNAS_GRAFICAS = ("year", "genre", "popularity", "energy", "valence", "loudness", "tempo", "danceability")
+
+# Anchura de los intervalos de los histogramas precalculados
+ANCHURA_POPULARIDAD = 5
+ANCHURA_VOLUMEN = 1
+ANCHURA_TEMPO = 5
+
+# Rango de cada variable de la gráfica de distribuciones, en el orden del notebook. Los intervalos
+# son fijos para que los agregados de distintas versiones se puedan sumar; los valores fuera del
+# rango van al primer o al último intervalo
+RANGOS_DISTRIBUCION = {
+    "popularity": (0, 100),
+    "energy": (0, 1),
+    "danceability": (0, 1),
+    "loudness": (-60, 6),
+    "speechiness": (0, 1),
+    "acousticness": (0, 1),
+    "instrumentalness": (0, 1),
+    "liveness": (0, 1),
+    "valence": (0, 1),
+    "tempo": (0, 250),
+}
+INTERVALOS_DISTRIBUCION = 20
+# Intervalos del histograma conjunto de tempo y bailabilidad
+INTERVALOS_TEMPO = 25
+INTERVALOS_BAILABILIDAD = 20
+COLUMNAS_FIGURAS = ("year", "genre", "popularity", "key", "mode") + tuple(columna for columna in RANGOS_DISTRIBUCION if columna != "popularity")
+
+
+def construir_agregados_artistas(df:pd.DataFrame)->dict:
+    """
+    Función para construir el cubo de agregados por artista. Se guardan sumas y recuentos
+    para poder combinar los agregados sin volver a recorrer los datos.
+
+    Args:
+    - df (pd.Dataframe): dataframe con las columnas artist_name, popularity, genre y year
+
+    Returns:
+    - agregados (dict): tablas "artistas", "artistas_anio" y "artistas_genero"
+    """
+    artistas = df.groupby('artist_name', observed=True, sort=False).agg(
+        popularity_sum=('popularity', 'sum'),
+        song_count=('popularity', 'size'),
+        genre=('genre', 'first') # Primer género encontrado para cada artista
+    ).reset_index()
+    artistas['average_popularity'] = artistas['popularity_sum'] / artistas['song_count']
+
+    artistas_anio = df.groupby(['artist_name', 'year'], observed=True).agg(
+        popularity_sum=('popularity', 'sum'),
+        song_count=('popularity', 'size')
+    ).reset_index()
+
+    artistas_genero = df.groupby(['artist_name', 'genre'], observed=True).size().reset_index(name='song_count')
+
+    artistas['genre_mode'] = genero_mas_frecuente(artistas['artist_name'], artistas_genero)
+    return {"artistas": artistas, "artistas_anio": artistas_anio, "artistas_genero": artistas_genero}
+
+
+def genero_mas_frecuente(artistas:pd.Series, artistas_genero:pd.DataFrame)->pd.Series:
+    """
+    Función para obtener el género con más canciones de cada artista.
+
+    Args:
+    - artistas (pd.Series): nombres de los artistas
+    - artistas_genero (pd.Dataframe): tabla "artistas_genero" de los agregados
+
+    Returns:
+    - generos (pd.Series): género con más canciones de cada artista
+    """
+    moda = artistas_genero.sort_values('song_count', ascending=False, kind='stable').drop_duplicates('artist_name')
+    return artistas.map(moda.set_index('artist_name')['genre'])
+
+
+def agregar_por_intervalos(df:pd.DataFrame, columna:str, anchura:float, sumas:list)->pd.DataFrame:
+    """
+    Función para agrupar las canciones por año, género e intervalo de una columna,
+    guardando la suma de las columnas indicadas y el número de canciones.
+
+    Args:
+    - df (pd.Dataframe): dataframe
+    - columna (str): columna a discretizar
+    - anchura (float): anchura de los intervalos
+    - sumas (list): columnas de las que se guarda la suma
+
+    Returns:
+    - tabla (pd.Dataframe): tabla con year, genre, el intervalo, las sumas y song_count
+    """
+    intervalo = (np.floor(df[columna].to_numpy(dtype=np.float64) / anchura) * anchura).astype('float32')
+    tabla = df[['year', 'genre'] + sumas].assign(**{f"{columna}_bin": intervalo})
+    tabla = tabla.groupby(['year', 'genre', f"{columna}_bin"], observed=True).agg(
+        **{f"{suma}_sum": (suma, 'sum') for suma in sumas},
+        song_count=(sumas[0], 'size')
+    ).reset_index()
+    return tabla
+
+
+def construir_agregados_graficas(df:pd.DataFrame)->dict:
+    """
+    Función para construir los agregados por año y género de los que salen las gráficas
+    de popularidad por género, energía, positividad, volumen y tempo.
+
+    Args:
+    - df (pd.Dataframe): dataframe con las columnas de COLUMNAS_GRAFICAS
+
+    Returns:
+    - agregados (dict): tablas "genero_anio", "popularidad_anio", "volumen" y "tempo"
+    """
+    genero_anio = df.groupby(['year', 'genre'], observed=True).agg(
+        popularity_sum=('popularity', 'sum'),
+        song_count=('popularity', 'size')
+    ).reset_index()
+    return {
+        "genero_anio": genero_anio,
+        "popularidad_anio": agregar_por_intervalos(df, 'popularity', ANCHURA_POPULARIDAD, ['energy', 'valence']),
+        "volumen": agregar_por_intervalos(df, 'loudness', ANCHURA_VOLUMEN, ['energy']),
+        "tempo": agregar_por_intervalos(df, 'tempo', ANCHURA_TEMPO, ['danceability']),
+    }
+
+
+def intervalo_fijo(valores, minimo:float, maximo:float, intervalos:int)->np.ndarray:
+    """
+    Función para obtener el número del intervalo de cada valor, con intervalos iguales entre un mínimo y un máximo.
+
+    Args:
+    - valores (array): valores a discretizar
+    - minimo (float): inicio del primer intervalo
+    - maximo (float): final del último intervalo
+    - intervalos (int): número de intervalos
+
+    Returns:
+    - intervalo (np.ndarray): número del intervalo de cada valor, -1 en los nulos
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    intervalo = np.clip(np.floor((valores - minimo) / (maximo - minimo) * intervalos), 0, intervalos - 1)
+    return np.where(np.isnan(valores), -1, intervalo).astype('int8')
+
+
+def construir_agregados_figuras(df:pd.DataFrame)->dict:
+    """
+    Función para construir los agregados por año y género de las gráficas de la sección de
+    distribución de variables, la popularidad por modo y escala y el histograma conjunto de
+    tempo y bailabilidad, que antes eran imágenes generadas en el notebook.
+
+    Args:
+    - df (pd.Dataframe): dataframe con las columnas de COLUMNAS_FIGURAS
+
+    Returns:
+    - agregados (dict): tablas "distribuciones", "modo_escala" y "tempo_bailabilidad"
+    """
+    variables = pd.CategoricalDtype(list(RANGOS_DISTRIBUCION))
+    partes = []
+    for variable, (minimo, maximo) in RANGOS_DISTRIBUCION.items():
+        intervalo = intervalo_fijo(df[variable], minimo, maximo, INTERVALOS_DISTRIBUCION)
+        parte = df[['year', 'genre']].assign(bin=intervalo)[intervalo >= 0]
+        parte = parte.groupby(['year', 'genre', 'bin'], observed=True).size().reset_index(name='song_count')
+        partes.append(parte.assign(variable=pd.Categorical([variable] * len(parte), dtype=variables)))
+    distribuciones = pd.concat(partes)[['year', 'genre', 'variable', 'bin', 'song_count']].sort_values(['year', 'genre', 'variable', 'bin'], ignore_index=True)
+
+    modo_escala = df.groupby(['year', 'genre', 'key', 'mode'], observed=True).agg(
+        popularity_sum=('popularity', 'sum'),
+        song_count=('popularity', 'size')
+    ).reset_index()
+
+    tempo_bailabilidad = df[['year', 'genre', 'tempo']].assign(
+        tempo_bin=intervalo_fijo(df['tempo'], *RANGOS_DISTRIBUCION['tempo'], INTERVALOS_TEMPO),
+        danceability_bin=intervalo_fijo(df['danceability'], 0, 1, INTERVALOS_BAILABILIDAD))
+    tempo_bailabilidad = tempo_bailabilidad[(tempo_bailabilidad['tempo_bin'] >= 0) & (tempo_bailabilidad['danceability_bin'] >= 0)]
+    tempo_bailabilidad = tempo_bailabilidad.groupby(['year', 'genre', 'tempo_bin', 'danceability_bin'], observed=True).agg(
+        tempo_sum=('tempo', 'sum'),
+        song_count=('tempo', 'size')
+    ).reset_index()
+    return {"distribuciones": distribuciones, "modo_escala": modo_escala, "tempo_bailabilidad": tempo_bailabilidad}
+
+
+def ordenar_agregados(agregados:dict)->dict:
+    """
+    Función para añadir al cubo los índices ordenados por popularidad media y por número de canciones,
+    con los que el top n de artistas es un simple corte.
+
+    Args:
+    - agregados (dict): cubo de agregados por artista
+
+    Returns:
+    - agregados (dict): cubo con los índices "orden_popularidad" y "orden_canciones"
+    """
+    artistas = agregados["artistas"]
+    if 'average_popularity' in artistas:
+        agregados["orden_popularidad"] = np.argsort(-artistas['average_popularity'].to_numpy(), kind='stable')
+    agregados["orden_canciones"] = np.argsort(-artistas['song_count'].to_numpy(), kind='stable')
+    return agregados
+
+
+def cubo_artistas_filas(df:pd.DataFrame, filas:np.ndarray)->dict:
+    """
+    Función para construir la tabla "artistas" del cubo con sólo unas filas del dataframe (por
+    ejemplo las que cumplen los filtros), contando con bincount sobre los códigos de artista
+    en lugar de agrupar una copia filtrada. Los artistas quedan en el orden en que aparecen.
+
+    Args:
+    - df (pd.Dataframe): dataframe con artist_name categórica y, si están, popularity y genre
+    - filas (np.ndarray): posiciones de las filas a agregar, en orden
+
+    Returns:
+    - agregados (dict): cubo con la tabla "artistas" y sus índices ordenados
+    """
+    codigos = df['artist_name'].cat.codes.to_numpy()[filas]
+    validas = codigos >= 0
+    filas, codigos = filas[validas], codigos[validas]
+    numero_artistas = len(df['artist_name'].cat.categories)
+    artistas, primeras = np.unique(codigos, return_index=True)
+    orden = np.argsort(primeras, kind='stable')
+    artistas, primeras = artistas[orden], primeras[orden]
+    tabla = pd.DataFrame({'artist_name': pd.Categorical.from_codes(artistas, dtype=df['artist_name'].dtype)})
+    if 'popularity' in df:
+        sumas = np.bincount(codigos, weights=df['popularity'].to_numpy()[filas], minlength=numero_artistas)
+        tabla['popularity_sum'] = sumas[artistas].astype('int64')
+    tabla['song_count'] = np.bincount(codigos, minlength=numero_artistas)[artistas]
+    if 'genre' in df:
+        tabla['genre'] = pd.Categorical.from_codes(df['genre'].cat.codes.to_numpy()[filas[primeras]], dtype=df['genre'].dtype)
+    if 'popularity' in df:
+        tabla['average_popularity'] = tabla['popularity_sum'] / tabla['song_count']
+    return ordenar_agregados({"artistas": tabla})
+
+
+def guardar_agregados(agregados:dict, version:str, directorio:str=DIRECTORIO_AGREGADOS)->None:
+    """
+    Función para guardar las tablas de agregados en Parquet dentro de la carpeta de su versión.
+
+    Args:
+    - agregados (dict): tablas de agregados
+    - version (str): versión de los datos de los que salen los agregados
+    - directorio (str): carpeta donde se guardan los agregados
+    """
+    ruta = os.path.join(directorio, version)
+    os.makedirs(ruta, exist_ok=True)
+    for nombre, tabla in agregados.items():
+        if isinstance(tabla, pd.DataFrame):
+            tabla.to_parquet(os.path.join(ruta, f"{nombre}.parquet"), index=False)
+
+
+# Columnas por las que se agrupa cada tabla aditiva, el resto son sumas y recuentos
+CLAVES_TABLAS = {
+    "artistas_anio": ["artist_name", "year"],
+    "artistas_genero": ["artist_name", "genre"],
+    "genero_anio": ["year", "genre"],
+    "popularidad_anio": ["year", "genre", "popularity_bin"],
+    "volumen": ["year", "genre", "loudness_bin"],
+    "tempo": ["year", "genre", "tempo_bin"],
+    "distribuciones": ["year", "genre", "variable", "bin"],
+    "modo_escala": ["year", "genre", "key", "mode"],
+    "tempo_bailabilidad": ["year", "genre", "tempo_bin", "danceability_bin"],
+}
+
+
+def combinar_tabla(tabla:pd.DataFrame, nuevas:pd.DataFrame, quitadas:pd.DataFrame, claves:list, tipos:dict)->pd.DataFrame:
+    """
+    Función para actualizar una tabla aditiva sumando los agregados de las canciones nuevas y
+    restando los de las canciones quitadas, sin volver a recorrer el resto de los datos.
+
+    Args:
+    - tabla (pd.Dataframe): tabla de agregados actual
+    - nuevas (pd.Dataframe): la misma tabla calculada con las canciones nuevas
+    - quitadas (pd.Dataframe): la misma tabla calculada con las canciones quitadas
+    - claves (list): columnas por las que se agrupa
+    - tipos (dict): tipo de las columnas categóricas en los datos actualizados
+
+    Returns:
+    - tabla (pd.Dataframe): tabla actualizada, sin los grupos que se quedan sin canciones
+    """
+    valores = [columna for columna in tabla.columns if columna not in claves]
+    quitadas = quitadas.assign(**{columna: -quitadas[columna] for columna in valores})
+    tipos = {columna: tipo for columna, tipo in tipos.items() if columna in claves}
+    partes = [parte.astype(tipos) for parte in (tabla, nuevas, quitadas) if not parte.empty] or [tabla.astype(tipos)]
+    combinada = pd.concat(partes, ignore_index=True).groupby(claves, observed=True)[valores].sum().reset_index()
+    return combinada[combinada['song_count'] > 0].reset_index(drop=True)
+
+
+def actualizar_agregados(agregados:dict, nuevas:pd.DataFrame, quitadas:pd.DataFrame, familia:str, tipos:dict, primeros:pd.DataFrame=None)->dict:
+    """
+    Función para actualizar una familia de agregados con las canciones nuevas y quitadas.
+
+    En el cubo por artista la tabla "artistas" se rehace a partir de "artistas_anio" y
+    "artistas_genero", con los artistas en el orden en que aparecen en los datos y su
+    primer género, que se obtienen al reescribir el almacén.
+
+    Args:
+    - agregados (dict): tablas de la familia con los datos anteriores
+    - nuevas (pd.Dataframe): canciones añadidas o cambiadas, con sus valores nuevos
+    - quitadas (pd.Dataframe): canciones quitadas o cambiadas, con sus valores anteriores
+    - familia (str): "artistas", "graficas" o "figuras"
+    - tipos (dict): tipo de las columnas categóricas en los datos actualizados
+    - primeros (pd.Dataframe): artist_name y genre de la primera canción de cada artista, en orden de aparición
+
+    Returns:
+    - agregados (dict): tablas de la familia actualizadas
+    """
+    nombres, _, construir = FAMILIAS[familia]
+    de_nuevas, de_quitadas = construir(nuevas), construir(quitadas)
+    actualizados = {nombre: combinar_tabla(agregados[nombre], de_nuevas[nombre], de_quitadas[nombre], CLAVES_TABLAS[nombre], tipos)
+                    for nombre in nombres if nombre in CLAVES_TABLAS}
+    if familia == "artistas":
+        totales = actualizados["artistas_anio"].groupby('artist_name', observed=True)[['popularity_sum', 'song_count']].sum()
+        artistas = primeros.astype({'artist_name': tipos['artist_name'], 'genre': tipos['genre']})
+        artistas = artistas.join(totales, on='artist_name')[['artist_name', 'popularity_sum', 'song_count', 'genre']]
+        artistas['average_popularity'] = artistas['popularity_sum'] / artistas['song_count']
+        artistas['genre_mode'] = genero_mas_frecuente(artistas['artist_name'], actualizados["artistas_genero"])
+        actualizados["artistas"] = artistas.reset_index(drop=True)
+        actualizados = ordenar_agregados(actualizados)
+    return actualizados
+
+
+# Tablas de cada familia de agregados, las columnas que necesitan y la función que las construye
+FAMILIAS = {
+    "artistas": (["artistas", "artistas_anio", "artistas_genero"], COLUMNAS_ARTISTAS, construir_agregados_artistas),
+    "graficas": (["genero_anio", "popularidad_anio", "volumen", "tempo"], COLUMNAS_GRAFICAS, construir_agregados_graficas),
+    "figuras": (["distribuciones", "modo_escala", "tempo_bailabilidad"], COLUMNAS_FIGURAS, construir_agregados_figuras),
+}
+
+
+def cargar_agregados(version:str=None, directorio:str=DIRECTORIO_AGREGADOS, familia:str="artistas", ruta_parquet:str=RUTA_PARQUET)->dict:
+    """
+    Función para cargar una familia de agregados de una versión de los datos. Si no está
+    guardada se construye a partir de los datos y se guarda para los siguientes arranques.
+
+    Args:
+    - version (str): versión de los datos, la actual si es None
+    - directorio (str): carpeta donde se guardan los agregados
+    - familia (str): "artistas" para el cubo por artista, "graficas" para los agregados de las gráficas
+      o "figuras" para los de las gráficas que antes eran imágenes
+    - ruta_parquet (str): almacén del que se construyen los agregados si no están guardados
+
+    Returns:
+    - agregados (dict): tablas de la familia, con los índices ordenados en el caso del cubo por artista
+    """
+    version = version or version_datos(ruta_parquet)
+    ruta = os.path.join(directorio, version)
+    nombres, columnas, construir = FAMILIAS[familia]
+    if all(os.path.exists(os.path.join(ruta, f"{nombre}.parquet")) for nombre in nombres):
+        agregados = {nombre: pd.read_parquet(os.path.join(ruta, f"{nombre}.parquet")) for nombre in nombres}
+    else:
+        agregados = construir(leer_datos(columnas, ruta_parquet))
+        guardar_agregados(agregados, version, directorio)
+    return ordenar_agregados(agregados) if familia == "artistas" else agregados
+
+
+def top_artistas_popularidad(agregados:dict, numero_artistas:int)->pd.DataFrame:
+    """
+    Función para obtener los n artistas con la media más alta de popularidad a partir del cubo.
+
+    Args:
+    - agregados (dict): cubo de agregados por artista
+    - numero_artistas (int): número de artistas a mostrar
+
+    Returns:
+    - top_n_artists (pd.Dataframe): artistas con su popularidad media y su género
+    """
+    filas = agregados["orden_popularidad"][:numero_artistas]
+    return agregados["artistas"].iloc[filas][['artist_name', 'average_popularity', 'genre']]
+
+
+def top_artistas_canciones(agregados:dict, numero_artistas:int)->pd.DataFrame:
+    """
+    Función para obtener los n artistas con más canciones a partir del cubo.
+
+    Args:
+    - agregados (dict): cubo de agregados por artista
+    - numero_artistas (int): número de artistas a mostrar
+
+    Returns:
+    - top_50_artists (pd.Dataframe): artistas con su número de canciones
+    """
+    filas = agregados["orden_canciones"][:numero_artistas]
+    return agregados["artistas"].iloc[filas][['artist_name', 'song_count']]
+
+
+if __name__ == "__main__":
+    for familia in FAMILIAS:
+        cargar_agregados(familia=familia)
@@ -1,99 +1,411 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
-import urllib.request
+import urllib3
 import os
-import ssl
-import json
+import io
+from collections import deque
 import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import toml
+import requests
 import streamlit.components.v1 as components
+from datos import leer_datos, version_datos, COLUMNAS_POR_SECCION, ESCALAS, MODOS
+from agregados import cargar_agregados, cubo_artistas_filas, top_artistas_popularidad, top_artistas_canciones
+from seleccion import indice_popularidad, top_k, construir_indice_filtros, bitmap_filtros, mascara_bitmap, COLUMNAS_FILTROS
+from prediccion import PredictorLocal, PredictorAzure, ErrorPrediccion, RUTA_MODELO, COLUMNAS_MODELO, puntuar_csv
+from cliente_spotify import crear_cliente, CacheRespuestas, generos_disponibles, recomendaciones, URL_API, URL_TOKEN
+from similares import cargar_indice, buscar_similares
+from graficas import filtrar_agregado, figura_popularidad_generos, figura_media_por_popularidad, figura_volumen_energia, figura_tempo_bailabilidad
+from graficas import figura_distribuciones, figura_spearman, figura_popularidad_modo, figura_popularidad_escala, figura_densidad_tempo
+from graficas import indice_rangos, matriz_spearman, clave_filtros, CacheFiguras, COLUMNAS_SPEARMAN
+from perfilado import iniciar_perfil, terminar_perfil, tramo, contar, marcar, medir_cache, exportar_json, enviar_otlp, enviar_otlp_en_segundo_plano, servir_prometheus, URL_OTLP
 
 
 logo = 'imagenes/spotify.png'
 st.set_page_config(page_title="Spotify", page_icon=logo ,layout="wide") #Configuración de la página
 #Funciones
-@st.cache_data(ttl=3600)
-def cargar_datos():
-    df = pd.read_csv("spotify_data_cleaned.zip", low_memory=False)
-    return df
+# Usamos cache_resource para compartir el mismo dataframe entre sesiones sin copiarlo en cada rerun.
+# Las cachés van por versión del contenido de los datos: al cambiar se cargan de nuevo y las de
+# versiones anteriores se descartan al superar el máximo de entradas
+VERSIONES_EN_CACHE = 2
+# Errores de la API de Spotify con los que se usa el dataset local: respuestas de error, credenciales y red
+ERRORES_SPOTIFY = (spotipy.SpotifyException, spotipy.oauth2.SpotifyOauthError, requests.exceptions.RequestException)
+REPETICIONES_PANEL = 20 # Reruns por sección que se guardan para las medias del panel de rendimiento
+# medir_cache va por fuera de la caché para medir también los aciertos: dentro sólo se llega en un fallo
+
+@medir_cache("cargar_datos")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE * len(COLUMNAS_POR_SECCION))
+def cargar_datos(columnas: tuple, version: str)->pd.DataFrame:
+    """
+    Función para cargar los datos limpios con las columnas que necesita una sección.
+
+    Args:
+    - columnas (tuple): columnas a cargar
+    - version (str): versión de los datos
 
-@st.cache_data(ttl=3600)
-# 
-def calcular_top_artistas(df, numero_artistas: int)->pd.DataFrame:
+    Returns:
+    - df (pd.Dataframe): dataframe con las columnas pedidas
+    """
+    marcar(cache="fallo")
+    return leer_datos(columnas)
+
+# El cubo de agregados por artista se construye una vez por versión de los datos
+@medir_cache("cargar_cubo_artistas")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE)
+def cargar_cubo_artistas(version: str)->dict:
+    """
+    Función para cargar el cubo de agregados por artista de una versión de los datos.
+
+    Args:
+    - version (str): versión de los datos
+
+    Returns:
+    - agregados (dict): cubo de agregados por artista
+    """
+    marcar(cache="fallo")
+    return cargar_agregados(version)
+
+def calcular_top_artistas(numero_artistas: int, mascara: np.ndarray = None)->pd.DataFrame:
     """
     Función para calcular top n artistas de una canción con la media
     mas alta de popularidad.
     
     Args:
-    - df (pd.Dataframe): dataframe 
     - numero_artistas(int): numero de artistas a mostrar
+    - mascara (np.ndarray): canciones que cumplen los filtros, todas si es None
     
     Returns:
     - top_n_artists (pd.Dataframe): dataframe filtrado con los artistas
     """
-    artist_info = df.groupby('artist_name').agg({
-        'popularity': 'mean',
-        'genre': 'first'  # Tomar el primer género encontrado para cada artista
-    }).reset_index()
-    artist_info.rename(columns={'popularity': 'average_popularity'}, inplace=True)
-    top_n_artists = artist_info.sort_values(by='average_popularity', ascending=False).head(numero_artistas)
-    top_n_artists['genre'] = top_n_artists['genre'].apply(lambda x: x.capitalize())
-    return top_n_artists
+    if mascara is None:
+        cubo = cargar_cubo_artistas(version_datos())
+    else:
+        # Con filtros el cubo se calcula sólo con las canciones seleccionadas
+        cubo = cubo_artistas_filas(cargar_datos(COLUMNAS_POR_SECCION["Popularidad"], version_datos()), np.flatnonzero(mascara))
+    top_n_artists = top_artistas_popularidad(cubo, numero_artistas)
+    return top_n_artists.assign(artist_name=top_n_artists['artist_name'].astype(str), # Quitamos las categorías sin uso para el treemap
+                                genre=top_n_artists['genre'].astype(str).str.capitalize())
+
+@medir_cache("cargar_indice_popularidad")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE)
+def cargar_indice_popularidad(version: str)->np.ndarray:
+    """
+    Función para cargar el índice de canciones ordenado de mayor a menor popularidad.
 
-@st.cache_data(ttl=3600)
-def ordenar_por_popularidad(df, top):
-    df = df.sort_values(by='popularity', ascending=False).head(top)
-    return df
+    Args:
+    - version (str): versión de los datos
 
-@st.cache_data(ttl=3600)
-def artistas_con_mas_canciones(df, numero_artistas: int)->pd.DataFrame:
+    Returns:
+    - indice (np.ndarray): posiciones de las canciones ordenadas por popularidad
     """
-    Función para calcular los artistas con más canciones en el dataset.
+    marcar(cache="fallo")
+    return indice_popularidad(leer_datos(("popularity",)))
+
+def ordenar_por_popularidad(df, top: int, filtros: dict = None, mascara: np.ndarray = None)->pd.DataFrame:
+    """
+    Función para obtener las canciones más populares usando el índice ordenado por popularidad.
 
     Args:
     - df (pd.Dataframe): dataframe
+    - top (int): número de canciones a mostrar
+    - filtros (dict): filtros por columna (género, año, modo...)
+    - mascara (np.ndarray): canciones que cumplen los filtros de la barra lateral, todas si es None
+
+    Returns:
+    - df (pd.Dataframe): las canciones más populares
+    """
+    return top_k(df, top, filtros, indice=cargar_indice_popularidad(version_datos()), mascara=mascara)
+
+def artistas_con_mas_canciones(numero_artistas: int, mascara: np.ndarray = None)->pd.DataFrame:
+    """
+    Función para calcular los artistas con más canciones en el dataset.
+
+    Args:
     - numero_artistas (int): número de artistas a mostrar
+    - mascara (np.ndarray): canciones que cumplen los filtros, todas si es None
 
     Returns:
     - top_50_artists (pd.Dataframe): dataframe con los artistas con más canciones
     """
-    df_aux = df
-    songs_per_artist = df_aux.groupby('artist_name', as_index=False)['track_name'].count()
-    songs_per_artist.rename(columns={'track_name': 'song_count'}, inplace=True)
-    top_50_artists = songs_per_artist.sort_values(by='song_count', ascending=False).head(numero_artistas)
-    return top_50_artists
+    if mascara is None:
+        cubo = cargar_cubo_artistas(version_datos())
+    else:
+        cubo = cubo_artistas_filas(cargar_datos(COLUMNAS_POR_SECCION["Características de la canción"], version_datos()), np.flatnonzero(mascara))
+    top_50_artists = top_artistas_canciones(cubo, numero_artistas)
+    return top_50_artists.assign(artist_name=top_50_artists['artist_name'].astype(str)) # Quitamos las categorías sin uso para el treemap
+
+@medir_cache("cargar_agregados_graficas")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE)
+def cargar_agregados_graficas(version: str)->dict:
+    """
+    Función para cargar los agregados por año y género de los que salen las gráficas.
 
-@st.cache_data(ttl=3600)
-def cargar_html(ruta_archivo):
-    with open(ruta_archivo, "r", encoding="utf-8") as f:
-        html_content = f.read()
-    return html_content
+    Args:
+    - version (str): versión de los datos
 
-@st.cache_data(ttl=3600)
-def recommendations(_sp:spotipy.Spotify)->list:
-    return sp.recommendation_genre_seeds()["genres"]
+    Returns:
+    - agregados (dict): tablas de agregados de las gráficas
+    """
+    marcar(cache="fallo")
+    return cargar_agregados(version, familia="graficas")
 
-def clean_outliers(df_aux, columns: list)->pd.DataFrame:
+@medir_cache("cargar_agregados_figuras")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE)
+def cargar_agregados_figuras(version: str)->dict:
     """
-    Función para eliminar los outliers de un dataframe usando el rango intercuartílico.
-    
+    Función para cargar los agregados por año y género de las distribuciones, la popularidad por modo
+    y escala y el histograma conjunto de tempo y bailabilidad.
+
     Args:
-    - df_aux (pd.Dataframe): dataframe a limpiar
-    - columns(list): lista de columnas a limpiar
-    
+    - version (str): versión de los datos
+
+    Returns:
+    - agregados (dict): tablas de agregados de las figuras
+    """
+    marcar(cache="fallo")
+    return cargar_agregados(version, familia="figuras")
+
+@medir_cache("cargar_indice_rangos")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE)
+def cargar_indice_rangos(version: str)->dict:
+    """
+    Función para ordenar una vez por versión las columnas de la correlación de Spearman.
+
+    Args:
+    - version (str): versión de los datos
+
+    Returns:
+    - indice (dict): índice de rangos
+    """
+    marcar(cache="fallo")
+    return indice_rangos(leer_datos(COLUMNAS_SPEARMAN))
+
+@st.cache_resource
+def cargar_cache_figuras()->CacheFiguras:
+    """
+    Función para crear la caché de figuras compartida entre sesiones.
+
+    Returns:
+    - cache (CacheFiguras): caché LRU de figuras
+    """
+    return CacheFiguras()
+
+@medir_cache("cargar_indice_filtros")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE)
+def cargar_indice_filtros(version: str)->dict:
+    """
+    Función para cargar el índice de filas por género, año, escala y modo de los filtros.
+
+    Args:
+    - version (str): versión de los datos
+
     Returns:
-    - df_aux (pd.Dataframe): dataframe sin outliers
+    - indice (dict): índice de filtros
     """
-    for column in columns:
-        Q1 = df_aux[column].quantile(0.25)
-        Q3 = df_aux[column].quantile(0.75)
-        IQR = Q3 - Q1
-        df_aux = df_aux[(df_aux[column] >= Q1-1.5*IQR) & (df_aux[column] <= Q3 + 1.5*IQR)]
-    return df_aux
+    marcar(cache="fallo")
+    return construir_indice_filtros(leer_datos(COLUMNAS_FILTROS))
+
+def seleccionar_filtros(agregados: dict)->tuple:
+    """
+    Función para mostrar en la barra lateral los filtros de año, género, escala y modo.
+
+    Args:
+    - agregados (dict): tablas de agregados de las gráficas
+
+    Returns:
+    - filtros (dict): valores seleccionados de cada columna filtrada, sin las que no filtran
+    - combinar (str): "y" si se tienen que cumplir todos los filtros, "o" si basta con alguno
+    """
+    genero_anio = agregados["genero_anio"]
+    anio_min, anio_max = int(genero_anio['year'].min()), int(genero_anio['year'].max())
+    st.sidebar.markdown("### Filtros")
+    anios = st.sidebar.slider("Años", anio_min, anio_max, (anio_min, anio_max), key="anios")
+    generos = st.sidebar.multiselect("Géneros", sorted(genero_anio['genre'].astype(str).unique()), key="generos")
+    escalas = st.sidebar.multiselect("Escalas", ESCALAS, key="escalas", help="Sólo se aplica a los artistas, las canciones y la correlación, no a los histogramas")
+    modos = st.sidebar.multiselect("Modos", MODOS, key="modos", help="Sólo se aplica a los artistas, las canciones y la correlación, no a los histogramas")
+    combinar = st.sidebar.radio("Combinar filtros", ("Todos (Y)", "Alguno (O)"), horizontal=True, key="combinar")
+    filtros = {"year": anios if anios != (anio_min, anio_max) else None, "genre": generos, "key": escalas, "mode": modos}
+    return {columna: valor for columna, valor in filtros.items() if valor}, "y" if combinar == "Todos (Y)" else "o"
+
+def mascara_filtros_barra(filtros: dict, combinar: str)->np.ndarray:
+    """
+    Función para obtener las canciones que cumplen los filtros de la barra lateral con el índice de filtros.
+
+    Args:
+    - filtros (dict): valores seleccionados de cada columna filtrada
+    - combinar (str): "y" o "o"
+
+    Returns:
+    - mascara (np.ndarray): array booleano con las canciones seleccionadas, None si no hay filtros
+    """
+    if not filtros:
+        return None
+    indice = cargar_indice_filtros(version_datos())
+    return mascara_bitmap(indice, bitmap_filtros(indice, filtros, combinar))
+
+@medir_cache("cargar_cliente_spotify")
+@st.cache_resource
+def cargar_cliente_spotify()->spotipy.Spotify:
+    """
+    Función para crear el cliente de la API de Spotify, compartido entre sesiones para
+    reutilizar las conexiones y el token de acceso.
+
+    Returns:
+    - sp (spotipy.Spotify): cliente de la API
+    """
+    marcar(cache="fallo")
+    secretos = st.secrets["spotify"]
+    return crear_cliente(secretos["client_id"], secretos["client_secret"],
+                         url_api=secretos.get("url_api", URL_API), url_token=secretos.get("url_token", URL_TOKEN))
+
+@medir_cache("cargar_cache_spotify")
+@st.cache_resource
+def cargar_cache_spotify()->CacheRespuestas:
+    """
+    Función para abrir la caché en disco de las respuestas de la API de Spotify.
+
+    Returns:
+    - cache (CacheRespuestas): caché de respuestas
+    """
+    marcar(cache="fallo")
+    return CacheRespuestas()
+
+@medir_cache("cargar_indice_similares")
+@st.cache_resource(max_entries=VERSIONES_EN_CACHE)
+def cargar_indice_similares(version: str)->dict:
+    """
+    Función para cargar el índice de canciones similares del dataset local.
+
+    Args:
+    - version (str): versión de los datos
+
+    Returns:
+    - indice (dict): índice de canciones similares
+    """
+    marcar(cache="fallo")
+    return cargar_indice(version)
+
+@medir_cache("cargar_predictor")
+@st.cache_resource
+def cargar_predictor():
+    """
+    Función para crear el predictor de popularidad. Se usa el modelo local si está
+    entrenado y, si no, el endpoint de Azure Machine Learning.
+
+    Returns:
+    - predictor (PredictorLocal o PredictorAzure): predictor con el método predecir
+    """
+    marcar(cache="fallo")
+    if os.path.exists(RUTA_MODELO):
+        return PredictorLocal(RUTA_MODELO)
+    return PredictorAzure(st.secrets['azure']['url'], st.secrets['azure']['api_key'])
+
+def mostrar_figura(fig, nombre: str)->None:
+    """
+    Función para mostrar una figura de plotly midiendo lo que tarda en serializarse y enviarse.
+    Con el panel de rendimiento activo también cuenta los bytes de la figura.
+
+    Args:
+    - fig (plotly.graph_objects.Figure): figura a mostrar
+    - nombre (str): nombre de la figura en el perfil
+    """
+    with tramo("plotly_chart", figura=nombre):
+        if st.session_state.get("depurar"):
+            contar("bytes_figuras", len(fig.to_json()), etiqueta=nombre)
+        st.plotly_chart(fig)
+
+def figura_en_cache(nombre: str, construir, *parametros)->None:
+    """
+    Función para mostrar una figura de la caché de figuras, construyéndola sólo si no está para
+    la versión de los datos y los parámetros (filtros, número de artistas...).
+
+    Args:
+    - nombre (str): nombre de la figura en el perfil y en la clave de la caché
+    - construir (callable): función sin argumentos que construye la figura
+    - parametros: valores de los que depende la figura, tienen que ser hashables
+    """
+    with tramo("figura", figura=nombre):
+        fig, acierto = cargar_cache_figuras().obtener((version_datos(), nombre) + parametros, construir)
+        marcar(cache="acierto" if acierto else "fallo")
+        contar("cache_aciertos" if acierto else "cache_fallos", etiqueta="figuras")
+    mostrar_figura(fig, nombre)
+
+def mostrar_imagen(ruta: str, **kwargs)->None:
+    """
+    Función para mostrar una imagen midiendo lo que tarda y contando sus bytes.
+
+    Args:
+    - ruta (str): ruta de la imagen
+    - kwargs: argumentos de st.image
+    """
+    nombre = os.path.basename(ruta)
+    with tramo("imagen", imagen=nombre):
+        if os.path.exists(ruta):
+            contar("bytes_imagenes", os.path.getsize(ruta), etiqueta=nombre)
+        st.image(ruta, **kwargs)
+
+def llamar_spotify(cache: CacheRespuestas, llamada: str, funcion, *args, **kwargs):
+    """
+    Función para medir una llamada a la API de Spotify y si se ha respondido desde la caché.
+
+    Args:
+    - cache (CacheRespuestas): caché de respuestas que usa la llamada
+    - llamada (str): nombre de la llamada en el perfil
+    - funcion (callable): función que hace la llamada
+    - args, kwargs: argumentos de la función
+
+    Returns:
+    - respuesta: lo que devuelve la función
+    """
+    with tramo("spotify", llamada=llamada):
+        aciertos = cache.aciertos
+        respuesta = funcion(*args, **kwargs)
+        resultado = "acierto" if cache.aciertos > aciertos else "fallo"
+        marcar(cache=resultado)
+        contar(f"cache_{resultado}s", etiqueta=f"spotify_{llamada}")
+    return respuesta
+
+def configuracion_perfilado()->dict:
+    """
+    Función para leer la configuración del perfilado de los secretos de Streamlit ([perfilado]
+    con otlp_url y prometheus_puerto). Sin fichero de secretos no se exporta nada.
+
+    Returns:
+    - configuracion (dict): configuración del perfilado
+    """
+    # Sin fichero de secretos, st.secrets.get mostraría un error en la página en cada rerun
+    if not st.secrets.load_if_toml_exists():
+        return {}
+    return dict(st.secrets.get("perfilado", {}))
+
+def mostrar_panel_rendimiento(perfil, configuracion: dict)->None:
+    """
+    Función para mostrar el panel de rendimiento: los tramos del último rerun, los contadores
+    y la media de cada tramo en los últimos reruns de cada sección.
+
+    Args:
+    - perfil (Perfil): perfil terminado del rerun actual
+    - configuracion (dict): configuración del perfilado
+    """
+    with st.expander(f"Panel de rendimiento: {perfil.duracion * 1000:.1f} ms en «{perfil.nombre}»", expanded=True):
+        st.dataframe(pd.DataFrame(perfil.resumen()), hide_index=True, use_container_width=True)
+        if perfil.contadores:
+            st.dataframe(pd.DataFrame([{"contador": nombre, "etiqueta": etiqueta, "valor": valor}
+                                       for (nombre, etiqueta), valor in perfil.contadores.items()]), hide_index=True)
+        st.markdown("Media en ms de los últimos reruns de cada sección (un tramo incluye los que contiene)")
+        medias = {seccion: pd.DataFrame(list(tiempos)).mean() for seccion, tiempos in st.session_state["perfiles"].items()}
+        st.dataframe(pd.DataFrame(medias).round(2), use_container_width=True)
+        cols = st.columns(2)
+        with cols[0]:
+            st.download_button("Descargar los tramos (JSON)", exportar_json(perfil), file_name=f"perfil_{perfil.traza}.json", mime="application/json")
+        with cols[1]:
+            if st.button("Enviar a OTLP"):
+                try:
+                    enviar_otlp(perfil, configuracion.get("otlp_url", URL_OTLP))
+                    st.success("Tramos enviados")
+                except urllib3.exceptions.HTTPError as error:
+                    st.error(f"No se ha podido conectar con el colector: {error}")
 
-df = cargar_datos()
 
 # Centrar el título de la página
 st.markdown(
@@ -120,6 +432,9 @@ st.sidebar.markdown("""
 
 st.sidebar.title("Secciones")
 pestaña = st.sidebar.radio("Selecciona una opción:", ("Inicio", "Distribución variables", "Popularidad", "Características de la canción", "Informe", "Predicción de popularidad"))
+depurar = st.sidebar.toggle("Panel de rendimiento", key="depurar")
+# Medimos el rerun desde aquí: lo anterior es la configuración de la página
+perfil = iniciar_perfil(pestaña)
 
 if pestaña == "Inicio":
     cols = st.columns(2)
@@ -142,16 +457,24 @@ if pestaña == "Inicio":
         - **Predicción de Popularidad:** Predecir la popularidad de una canción en base a sus características.
     """)
     with cols[1]:
-        st.image('imagenes/inicio.png', caption="eyeofthehurricane.news",)
+        mostrar_imagen('imagenes/inicio.png', caption="eyeofthehurricane.news",)
 
 elif pestaña == "Distribución variables":
+    agregados_graficas = cargar_agregados_graficas(version_datos())
+    agregados_figuras = cargar_agregados_figuras(version_datos())
+    with tramo("filtros"):
+        filtros, combinar = seleccionar_filtros(agregados_graficas)
+    # Los histogramas sólo se pueden filtrar por año y género; la correlación usa todos los filtros
+    clave_agregados = clave_filtros(filtros, combinar, ("year", "genre"))
     tabsInicio = st.tabs(["Variables continuas", "Correlación de Spearman"])
     with tabsInicio[0]:
         # Distribución de las variables continuas
-        st.image('imagenes/distribucion.png')
+        figura_en_cache("distribuciones", lambda: figura_distribuciones(
+            filtrar_agregado(agregados_figuras["distribuciones"], filtros.get("year"), filtros.get("genre"), combinar)), clave_agregados)
     with tabsInicio[1]:
-        # Correlación de Spearman
-        st.image('imagenes/spearman.png')
+        # Correlación de Spearman con los rangos calculados una vez por versión
+        figura_en_cache("spearman", lambda: figura_spearman(
+            matriz_spearman(cargar_indice_rangos(version_datos()), mascara_filtros_barra(filtros, combinar))), clave_filtros(filtros, combinar))
 
 elif pestaña == "Popularidad":
     st.sidebar.divider()
@@ -159,88 +482,112 @@ elif pestaña == "Popularidad":
     # Número de artistas y canciones a mostrar en las gráficas interactivas
     numero_artistas = st.sidebar.slider("Número de artistas", 1, 50, 10, key="artistas")
     numero_canciones = st.sidebar.slider("Número de canciones", 1, 50, 10, key="canciones")
+    agregados_graficas = cargar_agregados_graficas(version_datos())
+    agregados_figuras = cargar_agregados_figuras(version_datos())
+    with tramo("filtros"):
+        filtros, combinar = seleccionar_filtros(agregados_graficas)
+        mascara = mascara_filtros_barra(filtros, combinar)
+    clave = clave_filtros(filtros, combinar)
+    clave_agregados = clave_filtros(filtros, combinar, ("year", "genre"))
+    top_canciones = {}
+    def calcular_top_canciones()->pd.DataFrame:
+        # Canciones más populares, las usan las gráficas de la primera y segunda pestaña si no están en la caché
+        if "df" not in top_canciones:
+            df = cargar_datos(COLUMNAS_POR_SECCION[pestaña], version_datos())
+            with tramo("top_canciones", canciones=numero_canciones):
+                top_canciones["df"] = ordenar_por_popularidad(df, numero_canciones, mascara=mascara)
+        return top_canciones["df"]
 
     tabsPopularidad = st.tabs([f"Top Artistas y Canciones", "Bailable", "Género", "Energía", "Positividad"])
     with tabsPopularidad[0]:
         # Gráfica top n artistas con la media más alta de popularidad
-        top_n_artists = calcular_top_artistas(df, numero_artistas)
-        fig = px.treemap(top_n_artists,  
-                        path=['artist_name'], 
-                        values='average_popularity',
-                        color='average_popularity', 
-                        color_continuous_scale='RdYlGn',
-                        title=f'Top {numero_artistas} Artistas con la media más alta de popularidad',
-                        custom_data=['genre'],
-                        labels={'average_popularity': 'Popularidad Media', 'artist_name': 'Artista', 'genre': 'Género'})
-        fig.update_traces(hovertemplate='Artista: %{label}<br>Popularidad Media: %{value:.2f}<br>Género(s): %{customdata[0]}')
-        st.plotly_chart(fig)
-
+        def figura_top_artistas():
+            with tramo("top_artistas", artistas=numero_artistas):
+                top_n_artists = calcular_top_artistas(numero_artistas, mascara)
+            fig = px.treemap(top_n_artists,  
+                            path=['artist_name'], 
+                            values='average_popularity',
+                            color='average_popularity', 
+                            color_continuous_scale='RdYlGn',
+                            title=f'Top {numero_artistas} Artistas con la media más alta de popularidad',
+                            custom_data=['genre'],
+                            labels={'average_popularity': 'Popularidad Media', 'artist_name': 'Artista', 'genre': 'Género'})
+            fig.update_traces(hovertemplate='Artista: %{label}<br>Popularidad Media: %{value:.2f}<br>Género(s): %{customdata[0]}')
+            return fig
+        figura_en_cache("top_artistas_popularidad", figura_top_artistas, numero_artistas, clave)
+
+        modo_escala = lambda: filtrar_agregado(agregados_figuras["modo_escala"], filtros.get("year"), filtros.get("genre"), combinar)
         cols = st.columns(2)
         with cols[0]:
             # Media de la popularidad en base al modo
-            st.image('imagenes/modopopularidad.png')
+            figura_en_cache("popularidad_modo", lambda: figura_popularidad_modo(modo_escala()), clave_agregados)
         with cols[1]:
             # Media de la popularidad en base a la escala de la canción
-            st.image('imagenes/escalapopularidad.png')
+            figura_en_cache("popularidad_escala", lambda: figura_popularidad_escala(modo_escala()), clave_agregados)
 
         # Grafica top canciones más populares y su camino hacia la popularidad
-        df_aux = ordenar_por_popularidad(df, numero_canciones)
-        fig = px.parallel_categories(df_aux
-                                    ,dimensions=['genre', 'key', 'mode', 'popularity']
-                                    ,color="popularity"
-                                    ,color_continuous_scale=px.colors.sequential.Agsunset
-                                    ,title=f'Top {numero_canciones} canciones más populares y su camino hacia la popularidad'
-                                    ,labels={"genre": "Género", "key": "Key", "mode": "Modo", "popularity": "Popularidad"})
-        st.plotly_chart(fig)
+        figura_en_cache("top_canciones", lambda: px.parallel_categories(calcular_top_canciones()
+                                        ,dimensions=['genre', 'key', 'mode', 'popularity']
+                                        ,color="popularity"
+                                        ,color_continuous_scale=px.colors.sequential.Agsunset
+                                        ,title=f'Top {numero_canciones} canciones más populares y su camino hacia la popularidad'
+                                        ,labels={"genre": "Género", "key": "Key", "mode": "Modo", "popularity": "Popularidad"}), numero_canciones, clave)
     with tabsPopularidad[1]:
         # Grafica canciones más populares y su bailabilidad
-        df_aux = ordenar_por_popularidad(df, numero_canciones)
-        fig = px.area(df_aux, x='track_name', y='danceability', title=f'Top {numero_canciones} canciones con mayor popularidad y su bailabilidad'
-                , hover_data=["artist_name", "popularity"], labels={"danceability": "Bailabilidad", "track_name": "Canción", "artist_name": "Artista", "popularity": "Popularidad"}
-                , markers=True)
-        st.plotly_chart(fig)
+        figura_en_cache("bailabilidad", lambda: px.area(calcular_top_canciones(), x='track_name', y='danceability', title=f'Top {numero_canciones} canciones con mayor popularidad y su bailabilidad'
+                    , hover_data=["artist_name", "popularity"], labels={"danceability": "Bailabilidad", "track_name": "Canción", "artist_name": "Artista", "popularity": "Popularidad"}
+                    , markers=True), numero_canciones, clave)
     with tabsPopularidad[2]:
         # Histograma de popularidad media por género y año
-        html_content = cargar_html("html/popularidadgeneros.html")
-        components.html(html_content, height=700)
+        figura_en_cache("popularidad_generos", lambda: figura_popularidad_generos(
+            filtrar_agregado(agregados_graficas["genero_anio"], filtros.get("year"), filtros.get("genre"), combinar)), clave_agregados)
     with tabsPopularidad[3]:
         # Histograma de la energía media en base a la popularidad segun el año
-        html_content = cargar_html("html/energiapopularidad.html")
-        components.html(html_content, height=700)
+        figura_en_cache("energia", lambda: figura_media_por_popularidad(filtrar_agregado(agregados_graficas["popularidad_anio"], filtros.get("year"), filtros.get("genre"), combinar)
+                                               , 'energy', 'Media de la energía en base a la popularidad según el año', 'Media de Energía'), clave_agregados)
     with tabsPopularidad[4]:
         # Histograma de la positividad media en base a la popularidad segun el año
-        html_content = cargar_html("html/positividadpopularidad.html")
-        components.html(html_content, height=700)
+        figura_en_cache("positividad", lambda: figura_media_por_popularidad(filtrar_agregado(agregados_graficas["popularidad_anio"], filtros.get("year"), filtros.get("genre"), combinar)
+                                               , 'valence', 'Media de la positividad en base a la popularidad según el año', 'Media de Positividad'), clave_agregados)
 elif pestaña == "Características de la canción":
     st.sidebar.markdown("---")
     st.sidebar.markdown("### Configuración")
     # Número de artistas a mostrar en la gráfica
     numero_artistas = st.sidebar.slider("Número de artistas", 1, 50, 10, key="artistas")
+    agregados_graficas = cargar_agregados_graficas(version_datos())
+    agregados_figuras = cargar_agregados_figuras(version_datos())
+    with tramo("filtros"):
+        filtros, combinar = seleccionar_filtros(agregados_graficas)
+        mascara = mascara_filtros_barra(filtros, combinar)
+    clave_agregados = clave_filtros(filtros, combinar, ("year", "genre"))
     tabsCaracteristicas = st.tabs(["Artistas", "Volumen", "Tempo"])
     with tabsCaracteristicas[0]:
         # Grafico artistas con mas canciones
-        top_50_artists = artistas_con_mas_canciones(df, numero_artistas)
-
-        fig = px.treemap(top_50_artists, 
-                        path=['artist_name'], 
-                        values='song_count',
-                        color='song_count', 
-                        color_continuous_scale='RdYlGn',
-                        title=f'Top {numero_artistas} artistas con más canciones',
-                        labels={'song_count': 'Total Canciones'})
-        fig.update_traces(hovertemplate='Artista: %{label}<br>Número de Canciones: %{value}')
-        st.plotly_chart(fig)
+        def figura_artistas_canciones():
+            with tramo("top_artistas", artistas=numero_artistas):
+                top_50_artists = artistas_con_mas_canciones(numero_artistas, mascara)
+            fig = px.treemap(top_50_artists, 
+                            path=['artist_name'], 
+                            values='song_count',
+                            color='song_count', 
+                            color_continuous_scale='RdYlGn',
+                            title=f'Top {numero_artistas} artistas con más canciones',
+                            labels={'song_count': 'Total Canciones'})
+            fig.update_traces(hovertemplate='Artista: %{label}<br>Número de Canciones: %{value}')
+            return fig
+        figura_en_cache("artistas_canciones", figura_artistas_canciones, numero_artistas, clave_filtros(filtros, combinar))
     with tabsCaracteristicas[1]:
         # Histograma del volumen con la energía promedio
-        with open("html/volumenenergia.html", "r", encoding="utf-8") as f:
-            html_content = f.read()
-        components.html(html_content, height=700)
+        figura_en_cache("volumen_energia", lambda: figura_volumen_energia(
+            filtrar_agregado(agregados_graficas["volumen"], filtros.get("year"), filtros.get("genre"), combinar)), clave_agregados)
 
     with tabsCaracteristicas[2]:
         # Histograma bailabilidad en base al tempo de las canciones
-        html_content = cargar_html("html/tempobailable.html")
-        components.html(html_content, height=500)
-        st.image('imagenes/tempobailable.png')  
+        figura_en_cache("tempo_bailabilidad", lambda: figura_tempo_bailabilidad(
+            filtrar_agregado(agregados_graficas["tempo"], filtros.get("year"), filtros.get("genre"), combinar)), clave_agregados)
+        # Densidad conjunta del tempo y la bailabilidad
+        figura_en_cache("densidad_tempo", lambda: figura_densidad_tempo(
+            filtrar_agregado(agregados_figuras["tempo_bailabilidad"], filtros.get("year"), filtros.get("genre"), combinar)), clave_agregados)
 elif pestaña == "Informe":
     # Informe Power BI
     codigo_iframe = '''<iframe title="spotify" width="1320" height="700"
@@ -275,48 +622,13 @@ elif pestaña == "Predicción de popularidad":
             # Botón para predecir la popularidad de la canción
             b = st.form_submit_button("Predecir", use_container_width=True)
             if b:
-                # Código para predecir la popularidad de la canción realizando un modelo de despliegue en Azure Machine Learning
-                def allowSelfSignedHttps(allowed):
-                    if allowed and not os.environ.get('PYTHONHTTPSVERIFY', '') and getattr(ssl, '_create_unverified_context', None):
-                        ssl._create_default_https_context = ssl._create_unverified_context
-
-                allowSelfSignedHttps(True) # this line is needed if you use self-signed certificate in your scoring service.
-
-                data =  {
-                "input_data": {
-                    "columns": [
-                        "danceability",
-                        "energy",
-                        "loudness",
-                        "speechiness",
-                        "acousticness",
-                        "instrumentalness",
-                        "valence",
-                        "tempo"
-                        ],
-                    "index": [0],
-                    "data": [[danceability, energy, loudness, speechiness, acousticness, instrumentalness, valence, tempo]]
-                }
-                }
-
-                body = str.encode(json.dumps(data))
-
-                url = st.secrets['azure']['url']
-                # Replace this with the primary/secondary key, AMLToken, or Microsoft Entra ID token for the endpoint
-                api_key = st.secrets['azure']['api_key']
-                if not api_key:
-                    raise Exception("A key should be provided to invoke the endpoint")
-
-                # The azureml-model-deployment header will force the request to go to a specific deployment.
-                # Remove this header to have the request observe the endpoint traffic rules
-                headers = {'Content-Type':'application/json', 'Authorization':('Bearer '+ api_key), 'azureml-model-deployment': 'spotifyfinal40-1' }
-
-                req = urllib.request.Request(url, body, headers)
-
+                # Predecimos la popularidad de la canción con el modelo local o, si no está, con el despliegue en Azure Machine Learning
+                cancion = {"danceability": danceability, "energy": energy, "loudness": loudness, "speechiness": speechiness,
+                           "acousticness": acousticness, "instrumentalness": instrumentalness, "valence": valence, "tempo": tempo}
                 try:
-                    response = urllib.request.urlopen(req)
-
-                    result = json.loads(response.read())
+                    predictor = cargar_predictor()
+                    with tramo("prediccion", backend=type(predictor).__name__):
+                        result = predictor.predecir(cancion)
                     color = "#1DB954" 
                     if result[0] == 'Baja popularidad':
                         color = "#e81434"
@@ -326,14 +638,48 @@ elif pestaña == "Predicción de popularidad":
                         <h3>Esta canción tendría una <h3 style='color:{color}'>{result[0].lower()}</h3></h3>
                     </div>
                     """, unsafe_allow_html=True)
-                except urllib.error.HTTPError as error:
-                    print("The request failed with status code: " + str(error.code))
-                    print(error.info())
-                    print(error.read().decode("utf8", 'ignore'))
-    # Usamos las credenciales de cliente para acceder a la API de Spotify
-    auth_manager=SpotifyClientCredentials(client_id=st.secrets["spotify"]["client_id"], client_secret=st.secrets["spotify"]["client_secret"], requests_session=True)
-    # Creamos un objeto de la clase Spotify usando las credenciales anteriores
-    sp = spotipy.Spotify(auth_manager=auth_manager)
+                except (ErrorPrediccion, urllib3.exceptions.HTTPError) as error:
+                    print(error)
+                    st.error("No se ha podido obtener la predicción, inténtalo de nuevo más tarde.")
+    # Puntuación de un catálogo completo de canciones subido en CSV
+    with st.expander("Puntuar un catálogo de canciones (CSV)"):
+        st.markdown(f"El fichero debe tener las columnas: {', '.join(COLUMNAS_MODELO)}")
+        archivo = st.file_uploader("Catálogo de canciones", type="csv", key="catalogo")
+        if archivo is not None:
+            # Guardamos el resultado en la sesión para no volver a puntuar el fichero en cada rerun
+            if st.session_state.get("catalogo_id") != archivo.file_id:
+                salida = io.StringIO()
+                try:
+                    # Sin pool de procesos: el tamaño del fichero ya está limitado por Streamlit, para catálogos grandes está "python prediccion.py puntuar"
+                    with tramo("puntuar_csv"):
+                        total = puntuar_csv(archivo, salida, cargar_predictor(), procesos=1)
+                        marcar(canciones=total)
+                    st.session_state["catalogo_id"] = archivo.file_id
+                    st.session_state["catalogo_puntuado"] = (total, salida.getvalue())
+                except (ValueError, ErrorPrediccion, urllib3.exceptions.HTTPError) as error:
+                    st.session_state.pop("catalogo_id", None)
+                    st.error(str(error))
+            if st.session_state.get("catalogo_id") == archivo.file_id:
+                total, csv = st.session_state["catalogo_puntuado"]
+                st.download_button(f"Descargar las {total} canciones puntuadas", csv, file_name="catalogo_puntuado.csv", mime="text/csv")
+
+    # Las recomendaciones salen del índice de canciones similares del dataset local o de la API de Spotify
+    st.sidebar.markdown("### Recomendaciones")
+    fuente = st.sidebar.radio("Fuente de las recomendaciones", ("Dataset local", "API de Spotify"), key="fuente")
+    if fuente == "API de Spotify":
+        # Cliente de la API de Spotify compartido y caché de sus respuestas
+        sp = cargar_cliente_spotify()
+        cache_spotify = cargar_cache_spotify()
+        try:
+            opciones_generos = llamar_spotify(cache_spotify, "generos", generos_disponibles, sp, cache_spotify)
+        except ERRORES_SPOTIFY as error:
+            # Sin la API (credenciales, red, límite de peticiones...) usamos los géneros y las canciones del dataset local
+            print(error)
+            st.warning("La API de Spotify no está disponible, mostramos canciones similares del dataset local.")
+            fuente = "Dataset local"
+    if fuente == "Dataset local":
+        # El índice de canciones similares sólo se carga si se usa
+        opciones_generos = cargar_indice_similares(version_datos())["generos"]
 
     # Cambiamos el color de los multiselect
     st.markdown("""
@@ -345,20 +691,27 @@ elif pestaña == "Predicción de popularidad":
     </style>
     """, unsafe_allow_html=True)
 
-    # Multiselect para seleccionar los géneros y hacemos una petición a la API de Spotify para obtener los géneros disponibles
-    genres = st.multiselect("Selecciona de uno a tres géneros para obtener canciones similares ", recommendations(sp), max_selections=3)
+    # Multiselect para seleccionar los géneros, los del dataset o los que admite la API de Spotify
+    genres = st.multiselect("Selecciona de uno a tres géneros para obtener canciones similares ", opciones_generos, max_selections=3)
     parameters_list= ["danceability", "energy", "loudness", "speechiness", "acousticness", "instrumentalness", "valence", "tempo"]
     st.sidebar.markdown("### Parámetros")
     # Multiselect para seleccionar los parámetros de la canción
     parameters = st.sidebar.multiselect("Seleccione de uno a tres parámetros", parameters_list, max_selections=3)
 
-    if genres:
+    # Valores de los sliders para buscar canciones similares en el dataset local
+    valores = {"danceability": danceability, "energy": energy, "loudness": loudness, "speechiness": speechiness,
+               "acousticness": acousticness, "instrumentalness": instrumentalness, "valence": valence, "tempo": tempo}
+    if genres and fuente == "Dataset local":
+        # Buscamos en el dataset las canciones de esos géneros más parecidas a los valores de los sliders
+        with tramo("similares", generos=len(genres)):
+            spotify_urls = [f"https://open.spotify.com/track/{track_id}" for track_id in buscar_similares(cargar_indice_similares(version_datos()), valores, genres, 4, parameters)]
+    elif genres:
         # Parámetros para obtener recomendaciones de canciones similares, lo iremos actualizando con los parámetros seleccionados
         args_recomendaciones = {
             "seed_genres": genres, 
             "limit": 4
         }
-        
+    
         for parameter in parameters:
             match parameter:
                 case "danceability":
@@ -409,15 +762,22 @@ elif pestaña == "Predicción de popularidad":
                         "max_tempo": tempo+10, 
                         "target_tempo": tempo
                     })
-        # Obtenemos las recomendaciones de canciones similares haciendo una petición a la API de Spotify        
-        results = sp.recommendations(**args_recomendaciones)
+        try:
+            # Obtenemos las recomendaciones de canciones similares haciendo una petición a la API de Spotify (o de la caché si ya se hizo)
+            results = llamar_spotify(cache_spotify, "recomendaciones", recomendaciones, sp, cache_spotify, **args_recomendaciones)
+            spotify_urls = [track["external_urls"]["spotify"] for track in results["tracks"]]
+        except ERRORES_SPOTIFY as error:
+            # Si la API no responde (por ejemplo por límite de peticiones) usamos el dataset local
+            print(error)
+            st.warning("La API de Spotify no está disponible, mostramos canciones similares del dataset local.")
+            with tramo("similares", generos=len(genres)):
+                spotify_urls = [f"https://open.spotify.com/track/{track_id}" for track_id in buscar_similares(cargar_indice_similares(version_datos()), valores, genres, 4, parameters)]
 
-        # Mostramos las recomendaciones de canciones similares recorriendo results
+    if genres:
+        # Mostramos las recomendaciones de canciones similares recorriendo sus URL de Spotify
         cols = st.columns(4)
-        for i in range(len(results["tracks"])):
+        for i, spotify_url in enumerate(spotify_urls):
             with cols[i]:
-                # Obtenemos la URL de Spotify
-                spotify_url = results["tracks"][i]["external_urls"]["spotify"]
                 if spotify_url:
                     if 'track' in spotify_url:
                         # Obtenemos el ID de la canción
@@ -430,4 +790,18 @@ elif pestaña == "Predicción de popularidad":
                     if embed_url:
                         components.iframe(embed_url, width=300, height=380)
                     else:
-                        st.write("La URL proporcionada no es válida. Asegúrate de que sea una URL de pista o lista de reproducción de Spotify.")
\ No newline at end of file
+                        st.write("La URL proporcionada no es válida. Asegúrate de que sea una URL de pista o lista de reproducción de Spotify.")
+
+# Cerramos el perfil del rerun, lo guardamos para las medias por sección y lo exportamos si está configurado
+terminar_perfil(perfil)
+tiempos = {"rerun": perfil.duracion * 1000}
+for medido in perfil.tramos:
+    tiempos[medido.nombre] = tiempos.get(medido.nombre, 0) + medido.duracion * 1000
+st.session_state.setdefault("perfiles", {}).setdefault(pestaña, deque(maxlen=REPETICIONES_PANEL)).append(tiempos)
+configuracion = configuracion_perfilado()
+if "otlp_url" in configuracion:
+    enviar_otlp_en_segundo_plano(perfil, configuracion["otlp_url"])
+if "prometheus_puerto" in configuracion:
+    servir_prometheus(int(configuracion["prometheus_puerto"]))
+if depurar:
+    mostrar_panel_rendimiento(perfil, configuracion)
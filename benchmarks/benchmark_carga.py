@@ -0,0 +1,93 @@
+"""
+Benchmark del arranque en frío de la carga de datos: CSV comprimido frente al almacén Parquet.
+
+Cada medición se hace en un proceso nuevo para medir el tiempo de carga y el pico de memoria
+residente (RSS) que tendría un worker de Streamlit al arrancar.
+
+Uso:
+    python -m benchmarks.benchmark_carga --filas 1000000
+    python -m benchmarks.benchmark_carga --csv spotify_data_cleaned.zip --parquet spotify_data_cleaned.parquet
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from datos import COLUMNAS_POR_SECCION, convertir_a_parquet
+
+
+PROGRAMA = """
+import json, resource, sys, time
+import pandas as pd
+from datos import leer_datos
+
+def pico_rss_mb():
+    # VmHWM se reinicia con exec, a diferencia de ru_maxrss que hereda el pico del proceso padre
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("VmHWM")) / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+metodo, ruta_csv, ruta_parquet, columnas = sys.argv[1], sys.argv[2], sys.argv[3], json.loads(sys.argv[4])
+inicio = time.perf_counter()
+if metodo == "csv":
+    df = pd.read_csv(ruta_csv, low_memory=False)
+else:
+    df = leer_datos(columnas, ruta_parquet=ruta_parquet)
+segundos = time.perf_counter() - inicio
+print(json.dumps({"segundos": segundos, "rss_mb": pico_rss_mb(), "memoria_df_mb": df.memory_usage(deep=True).sum() / 2**20}))
+"""
+
+
+def medir(metodo:str, ruta_csv:str, ruta_parquet:str, columnas:list=None)->dict:
+    """
+    Función para medir una carga de datos en un proceso independiente.
+
+    Args:
+    - metodo (str): "csv" para la carga original o "parquet" para el almacén columnar
+    - ruta_csv (str): ruta del CSV comprimido
+    - ruta_parquet (str): ruta del fichero Parquet
+    - columnas (list): columnas a cargar desde Parquet, todas si es None
+
+    Returns:
+    - resultado (dict): tiempo de carga y memoria
+    """
+    salida = subprocess.run([sys.executable, "-c", PROGRAMA, metodo, ruta_csv, ruta_parquet, json.dumps(columnas)],
+                            capture_output=True, text=True, check=True, cwd=os.getcwd())
+    return json.loads(salida.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1_000_000, help="filas del dataset sintético si no se pasan rutas")
+    parser.add_argument("--csv", help="CSV limpio comprimido")
+    parser.add_argument("--parquet", help="almacén Parquet")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_csv, ruta_parquet = args.csv, args.parquet
+        if ruta_csv is None:
+            from benchmarks.datos_sinteticos import generar_datos
+            df = generar_datos(args.filas)
+            ruta_csv = os.path.join(directorio, "spotify_data_cleaned.zip")
+            df.to_csv(ruta_csv, index=False, compression="zip")
+            del df
+        if ruta_parquet is None:
+            ruta_parquet = os.path.join(directorio, "spotify_data_cleaned.parquet")
+            convertir_a_parquet(ruta_csv, ruta_parquet)
+
+        casos = [("csv", "csv", None), ("parquet", "parquet (todas)", None)]
+        casos += [("parquet", f"parquet ({seccion})", list(columnas)) for seccion, columnas in COLUMNAS_POR_SECCION.items()]
+        print(f"{'método':<40}{'segundos':>10}{'RSS MB':>10}{'df MB':>10}")
+        for metodo, nombre, columnas in casos:
+            resultados = [medir(metodo, ruta_csv, ruta_parquet, columnas) for _ in range(args.repeticiones)]
+            mejor = min(resultados, key=lambda r: r["segundos"])
+            print(f"{nombre:<40}{mejor['segundos']:>10.3f}{mejor['rss_mb']:>10.1f}{mejor['memoria_df_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark y comprobación del enriquecimiento contra la API simulada (benchmarks/spotify_simulado.py),
+con un límite de peticiones menor que el ritmo del cliente para forzar respuestas 429 y errores
+503 al azar. El trabajo se interrumpe a mitad y se continúa desde el punto de control; al final
+se escriben las columnas en un almacén sintético y se comprueba que cada canción tiene los
+valores que da la simulación.
+
+Uso:
+    python -m benchmarks.benchmark_enriquecimiento --filas 20000 --tasa 30 --tasa-servidor 20
+"""
+import os
+import asyncio
+import argparse
+import tempfile
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from benchmarks.benchmark_escalado import generar_almacen
+from benchmarks.spotify_simulado import arrancar, cancion_simulada
+from enriquecimiento import enriquecer_canciones, crear_credenciales, escribir_columnas, extraer_campos, leer_punto_control, COLUMNAS_ENRIQUECIDAS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=20_000)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--tasa", type=float, default=30, help="peticiones por segundo del cliente")
+    parser.add_argument("--rafaga", type=float, default=10, help="peticiones seguidas del cliente")
+    parser.add_argument("--tasa-servidor", type=float, default=20, help="peticiones por segundo que admite la API simulada")
+    parser.add_argument("--rafaga-servidor", type=float, default=5, help="peticiones seguidas que admite la API simulada")
+    parser.add_argument("--fallos", type=float, default=0.02, help="probabilidad de un 503 de la API simulada")
+    parser.add_argument("--interrumpir", type=float, default=3, help="segundos tras los que se interrumpe la primera ejecución")
+    args = parser.parse_args()
+
+    servidor = arrancar(tasa=args.tasa_servidor, rafaga=args.rafaga_servidor, fallos=args.fallos)
+    credenciales = crear_credenciales("id", "secreto", servidor.url + "api/token")
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "almacen.parquet")
+        punto_control = os.path.join(directorio, "enriquecimiento.jsonl")
+        generar_almacen(ruta, args.filas)
+        ids = pq.read_table(ruta, columns=["track_id"]).column("track_id").to_pylist()
+
+        def ejecutar():
+            return enriquecer_canciones(ids, credenciales, servidor.url + "v1/", punto_control,
+                                        args.concurrencia, args.tasa, args.rafaga)
+
+        try:
+            asyncio.run(asyncio.wait_for(ejecutar(), args.interrumpir))
+            print("La primera ejecución terminó antes de interrumpirla")
+        except TimeoutError:
+            print(f"Interrumpida a los {args.interrumpir} s con {len(leer_punto_control(punto_control))} canciones en el punto de control")
+        resultados, estadisticas = asyncio.run(ejecutar())
+        print(f"Continuación: {estadisticas['pendientes']} canciones en {estadisticas['lotes']} lotes, {estadisticas['peticiones']} peticiones, "
+              f"{estadisticas['limitadas']} 429 y {estadisticas['errores']} errores en {estadisticas['segundos']:.1f} s "
+              f"({estadisticas['pendientes'] / estadisticas['segundos']:.0f} canciones/s)")
+        print(f"API simulada: {servidor.contadores}")
+        print(f"Canciones pedidas más de una vez: {servidor.contadores['canciones'] - len(set(ids))}")
+
+        escribir_columnas(resultados, ruta, os.path.join(directorio, "agregados"))
+        df = pd.read_parquet(ruta, columns=["track_id"] + list(COLUMNAS_ENRIQUECIDAS))
+        esperado = pd.DataFrame([extraer_campos(cancion_simulada(track_id)) for track_id in df["track_id"]])
+        esperado = esperado.astype({"current_popularity": "Int16"})
+        pd.testing.assert_frame_equal(df.drop(columns="track_id"), esperado, check_dtype=False)
+        print(f"Almacén con {len(df)} canciones y las columnas {list(COLUMNAS_ENRIQUECIDAS)} correctas")
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
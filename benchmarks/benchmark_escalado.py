@@ -0,0 +1,338 @@
+"""
+Benchmark de las funciones de datos de la aplicación con catálogos sintéticos de distintos tamaños.
+
+Para cada tamaño se genera por bloques un almacén Parquet con el esquema de los datos limpios y
+cada caso se mide en un proceso nuevo, fuera de Streamlit: tiempo (mediana de las repeticiones),
+pico de memoria residente del proceso (RSS) durante la función y filas procesadas por segundo.
+Los resultados se guardan en JSON y se comparan con una línea base guardada antes; un caso es
+una regresión si es más lento o usa más memoria que la base por encima de la tolerancia, o si
+supera la memoria de un worker.
+
+Uso:
+    python -m benchmarks.benchmark_escalado --tamanos 100000 1000000 --guardar-base
+    python -m benchmarks.benchmark_escalado --tamanos 100000 1000000 --memoria-maxima 2048
+    python -m benchmarks.benchmark_escalado --directorio /tmp/catalogos   # reutiliza los Parquet generados
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmarks.datos_sinteticos import generar_datos
+from datos import COLUMNAS_POR_SECCION, leer_datos
+from agregados import COLUMNAS_ARTISTAS, construir_agregados_artistas, ordenar_agregados, cubo_artistas_filas, top_artistas_popularidad, top_artistas_canciones
+from seleccion import indice_popularidad, top_k, construir_indice_filtros, bitmap_filtros, mascara_bitmap, COLUMNAS_FILTROS
+from outliers import clean_outliers
+from prediccion import COLUMNAS_MODELO, FILAS_POR_PETICION, construir_peticion
+
+
+TAMANOS = [100_000, 1_000_000, 10_000_000, 50_000_000]
+TAMANO_BLOQUE = 1_000_000 # Filas que se generan y escriben de cada vez
+RUTA_RESULTADOS = "benchmarks/resultados_escalado.json"
+RUTA_BASE = "benchmarks/base_escalado.json"
+TOLERANCIA_TIEMPO = 0.25 # Fracción más lenta que la base que se admite
+TOLERANCIA_MEMORIA = 0.15 # Fracción más de pico de memoria que la base que se admite
+MARGEN_MS = 2.0 # Diferencias de tiempo menores que se ignoran, por ruido en los casos muy rápidos
+NUMERO_TOP = 10
+FILTROS = {"genre": ["pop", "rock", "hip-hop"], "year": (2015, 2020), "mode": ["Major"]}
+COLUMNAS_OUTLIERS = ['loudness', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence', 'danceability', 'energy']
+
+
+def generar_almacen(ruta:str, filas:int, tamano_bloque:int=TAMANO_BLOQUE, semilla:int=0)->None:
+    """
+    Función para escribir un almacén Parquet sintético por bloques, sin tener todo el catálogo en memoria.
+    Todos los bloques comparten los artistas, así que las categorías son las mismas en todo el fichero.
+
+    Args:
+    - ruta (str): ruta del fichero Parquet
+    - filas (int): número de canciones
+    - tamano_bloque (int): canciones por bloque
+    - semilla (int): semilla del primer bloque, los siguientes usan las siguientes
+    """
+    temporal = ruta + ".tmp"
+    escritor = None
+    try:
+        for numero, primera in enumerate(range(0, filas, tamano_bloque)):
+            df = generar_datos(min(tamano_bloque, filas - primera), semilla + numero, max(filas // 16, 1), primera)
+            tabla = pa.Table.from_pandas(df, preserve_index=False)
+            if escritor is None:
+                escritor = pq.ParquetWriter(temporal, tabla.schema)
+            escritor.write_table(tabla, row_group_size=128_000)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    os.replace(temporal, ruta)
+
+
+# Cada caso tiene las columnas que carga y una función que prepara lo que la aplicación ya tiene
+# en caché y devuelve lo que se mide. Los nombres son los de las funciones de app.py equivalentes
+def _cubo(df):
+    return ordenar_agregados(construir_agregados_artistas(df))
+
+
+def _filas_filtradas(df):
+    indice = construir_indice_filtros(df)
+    return np.flatnonzero(mascara_bitmap(indice, bitmap_filtros(indice, FILTROS)))
+
+
+def _cargar_datos(seccion):
+    return lambda ruta, df: lambda: leer_datos(COLUMNAS_POR_SECCION[seccion], ruta_parquet=ruta)
+
+
+def _top_artistas(ruta, df):
+    cubo = _cubo(df)
+    return lambda: top_artistas_popularidad(cubo, NUMERO_TOP)
+
+
+def _top_artistas_filtros(ruta, df):
+    filas = _filas_filtradas(df)
+    return lambda: top_artistas_popularidad(cubo_artistas_filas(df, filas), NUMERO_TOP)
+
+
+def _mas_canciones(ruta, df):
+    cubo = _cubo(df)
+    return lambda: top_artistas_canciones(cubo, NUMERO_TOP)
+
+
+def _mas_canciones_filtros(ruta, df):
+    filas = _filas_filtradas(df)
+    return lambda: top_artistas_canciones(cubo_artistas_filas(df, filas), NUMERO_TOP)
+
+
+def _top_canciones(ruta, df):
+    indice = indice_popularidad(df)
+    return lambda: top_k(df, NUMERO_TOP, indice=indice)
+
+
+def _top_canciones_filtros(ruta, df):
+    indice = indice_popularidad(df)
+    mascara = np.zeros(len(df), dtype=bool)
+    mascara[_filas_filtradas(df)] = True
+    return lambda: top_k(df, NUMERO_TOP, indice=indice, mascara=mascara)
+
+
+def _mascara_filtros(ruta, df):
+    indice = construir_indice_filtros(df)
+    return lambda: mascara_bitmap(indice, bitmap_filtros(indice, FILTROS))
+
+
+def _peticiones(ruta, df):
+    # Todo el catálogo en peticiones de FILAS_POR_PETICION canciones, como prediccion.predecir_por_peticiones
+    X = df[COLUMNAS_MODELO].to_numpy(dtype=np.float64)
+    return lambda: [construir_peticion(X[inicio:inicio + FILAS_POR_PETICION]) for inicio in range(0, len(X), FILAS_POR_PETICION)]
+
+
+CASOS = {
+    "cargar_datos[Popularidad]": (None, _cargar_datos("Popularidad")),
+    "cargar_datos[Características de la canción]": (None, _cargar_datos("Características de la canción")),
+    "cargar_cubo_artistas": (COLUMNAS_ARTISTAS, lambda ruta, df: lambda: _cubo(df)),
+    "calcular_top_artistas": (COLUMNAS_ARTISTAS, _top_artistas),
+    "calcular_top_artistas[filtros]": (COLUMNAS_ARTISTAS + ("key", "mode"), _top_artistas_filtros),
+    "artistas_con_mas_canciones": (COLUMNAS_ARTISTAS, _mas_canciones),
+    "artistas_con_mas_canciones[filtros]": (("artist_name",) + COLUMNAS_FILTROS, _mas_canciones_filtros),
+    "cargar_indice_popularidad": (("popularity",), lambda ruta, df: lambda: indice_popularidad(df)),
+    "ordenar_por_popularidad": (COLUMNAS_POR_SECCION["Popularidad"], _top_canciones),
+    "ordenar_por_popularidad[filtros]": (COLUMNAS_POR_SECCION["Popularidad"] + ("year",), _top_canciones_filtros),
+    "cargar_indice_filtros": (COLUMNAS_FILTROS, lambda ruta, df: lambda: construir_indice_filtros(df)),
+    "mascara_filtros_barra": (COLUMNAS_FILTROS, _mascara_filtros),
+    "clean_outliers": (tuple(COLUMNAS_OUTLIERS), lambda ruta, df: lambda: clean_outliers(df, COLUMNAS_OUTLIERS)),
+    "clean_outliers[secuencial]": (tuple(COLUMNAS_OUTLIERS), lambda ruta, df: lambda: clean_outliers(df, COLUMNAS_OUTLIERS, secuencial=True)),
+    "construir_peticion": (tuple(COLUMNAS_MODELO), _peticiones),
+}
+
+
+def memoria_proceso()->dict:
+    """
+    Función para leer la memoria residente actual y el pico del proceso.
+
+    Returns:
+    - memoria (dict): "rss_mb" y "pico_mb"
+    """
+    try:
+        with open("/proc/self/status") as f:
+            campos = {linea.split(":")[0]: int(linea.split()[1]) / 1024 for linea in f if linea.startswith(("VmRSS", "VmHWM"))}
+        return {"rss_mb": campos["VmRSS"], "pico_mb": campos["VmHWM"]}
+    except OSError:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return {"rss_mb": pico, "pico_mb": pico}
+
+
+def reiniciar_pico()->bool:
+    """
+    Función para reiniciar el pico de memoria del proceso (sólo en Linux), para medir el de una función.
+
+    Returns:
+    - reiniciado (bool): False si no se puede y el pico incluye la preparación del caso
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def medir_caso(caso:str, ruta:str, repeticiones:int)->dict:
+    """
+    Función para medir un caso en el proceso actual. Se llama en un proceso nuevo por caso.
+
+    Args:
+    - caso (str): nombre del caso en CASOS
+    - ruta (str): almacén Parquet
+    - repeticiones (int): veces que se ejecuta la función
+
+    Returns:
+    - resultado (dict): segundos (mediana y mínimo), pico de memoria y memoria añadida por la función
+    """
+    columnas, preparar = CASOS[caso]
+    df = leer_datos(columnas, ruta_parquet=ruta) if columnas is not None else None
+    funcion = preparar(ruta, df)
+    antes = memoria_proceso()["rss_mb"]
+    reiniciado = reiniciar_pico()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    pico = memoria_proceso()["pico_mb"]
+    return {"segundos": float(np.median(tiempos)), "segundos_min": min(tiempos), "pico_mb": pico,
+            "incremento_mb": pico - antes if reiniciado else None}
+
+
+def medir_en_proceso(caso:str, ruta:str, repeticiones:int)->dict:
+    """
+    Función para medir un caso en un proceso independiente, con la memoria de un worker recién arrancado.
+
+    Args:
+    - caso (str): nombre del caso en CASOS
+    - ruta (str): almacén Parquet
+    - repeticiones (int): veces que se ejecuta la función
+
+    Returns:
+    - resultado (dict): medidas del caso, o "error" si el proceso falla (por ejemplo si se queda sin memoria)
+    """
+    salida = subprocess.run([sys.executable, "-m", "benchmarks.benchmark_escalado", "--caso", caso, "--parquet", ruta,
+                             "--repeticiones", str(repeticiones)], capture_output=True, text=True, cwd=os.getcwd())
+    if salida.returncode != 0:
+        errores = salida.stderr.strip().splitlines()
+        return {"error": errores[-1] if errores else f"el proceso ha terminado con el código {salida.returncode}"}
+    return json.loads(salida.stdout.splitlines()[-1])
+
+
+def comparar(resultados:list, base:list, tolerancia_tiempo:float=TOLERANCIA_TIEMPO,
+             tolerancia_memoria:float=TOLERANCIA_MEMORIA, margen_ms:float=MARGEN_MS, memoria_maxima:float=None)->list:
+    """
+    Función para marcar las regresiones de unos resultados frente a la línea base.
+
+    Args:
+    - resultados (list): medidas de cada tamaño y caso
+    - base (list): medidas guardadas como línea base
+    - tolerancia_tiempo (float): fracción más lenta que se admite
+    - tolerancia_memoria (float): fracción más de pico de memoria que se admite
+    - margen_ms (float): diferencias de tiempo menores que se ignoran
+    - memoria_maxima (float): MB de un worker, None para no comprobarlo
+
+    Returns:
+    - resultados (list): las mismas medidas con la lista "regresiones" en cada una
+    """
+    # Los casos que fallaron al guardar la base no tienen medidas con las que comparar
+    anteriores = {(medida["filas"], medida["caso"]): medida for medida in base if "error" not in medida}
+    for medida in resultados:
+        if "error" in medida:
+            medida["regresiones"] = [f"fallo: {medida['error']}"]
+            continue
+        regresiones = []
+        anterior = anteriores.get((medida["filas"], medida["caso"]))
+        if anterior is not None:
+            diferencia = medida["segundos"] - anterior["segundos"]
+            if diferencia > anterior["segundos"] * tolerancia_tiempo and diferencia * 1000 > margen_ms:
+                regresiones.append(f"tiempo x{medida['segundos'] / anterior['segundos']:.2f}")
+            if medida["pico_mb"] > anterior["pico_mb"] * (1 + tolerancia_memoria):
+                regresiones.append(f"memoria x{medida['pico_mb'] / anterior['pico_mb']:.2f}")
+        if memoria_maxima is not None and medida["pico_mb"] > memoria_maxima:
+            regresiones.append(f"supera {memoria_maxima:.0f} MB")
+        medida["regresiones"] = regresiones
+    return resultados
+
+
+def entorno()->dict:
+    return {"fecha": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(), "pandas": pd.__version__,
+            "numpy": np.__version__, "pyarrow": pa.__version__, "procesador": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS, help="filas de cada catálogo sintético")
+    parser.add_argument("--casos", nargs="+", choices=list(CASOS), default=list(CASOS))
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--directorio", help="carpeta donde se guardan y reutilizan los catálogos, temporal si no se indica")
+    parser.add_argument("--salida", default=RUTA_RESULTADOS, help="fichero JSON de resultados")
+    parser.add_argument("--base", default=RUTA_BASE, help="línea base con la que se comparan los resultados")
+    parser.add_argument("--guardar-base", action="store_true", help="guardar los resultados como nueva línea base")
+    parser.add_argument("--tolerancia-tiempo", type=float, default=TOLERANCIA_TIEMPO)
+    parser.add_argument("--tolerancia-memoria", type=float, default=TOLERANCIA_MEMORIA)
+    parser.add_argument("--memoria-maxima", type=float, help="MB de memoria de un worker, marca los casos que la superan")
+    parser.add_argument("--caso", help=argparse.SUPPRESS)
+    parser.add_argument("--parquet", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.caso is not None:
+        # Proceso hijo: mide un caso y escribe el resultado para el proceso principal
+        print(json.dumps(medir_caso(args.caso, args.parquet, args.repeticiones)))
+        return
+
+    base = []
+    if os.path.exists(args.base) and not args.guardar_base:
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)["resultados"]
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as temporal:
+        directorio = args.directorio or temporal
+        os.makedirs(directorio, exist_ok=True)
+        print(f"{'filas':>12}  {'caso':<46}{'ms':>12}{'pico MB':>10}{'+MB':>9}{'filas/s':>14}  regresiones")
+        for filas in args.tamanos:
+            ruta = os.path.join(directorio, f"catalogo_{filas}.parquet")
+            if not os.path.exists(ruta):
+                inicio = time.perf_counter()
+                generar_almacen(ruta, filas)
+                print(f"{filas:>12}  catálogo generado en {time.perf_counter() - inicio:.1f} s")
+            for caso in args.casos:
+                medida = {"filas": filas, "caso": caso, **medir_en_proceso(caso, ruta, args.repeticiones)}
+                comparar([medida], base, args.tolerancia_tiempo, args.tolerancia_memoria, memoria_maxima=args.memoria_maxima)
+                resultados.append(medida)
+                if "error" in medida:
+                    print(f"{filas:>12}  {caso:<46}{'-':>12}{'-':>10}{'-':>9}{'-':>14}  {', '.join(medida['regresiones'])}")
+                    continue
+                medida["filas_por_segundo"] = filas / medida["segundos"] if medida["segundos"] else None
+                incremento = f"{medida['incremento_mb']:>9.1f}" if medida["incremento_mb"] is not None else f"{'-':>9}"
+                print(f"{filas:>12}  {caso:<46}{medida['segundos'] * 1000:>12.3f}{medida['pico_mb']:>10.1f}{incremento}"
+                      f"{medida['filas_por_segundo']:>14.0f}  {', '.join(medida['regresiones'])}")
+
+    informe = {"entorno": entorno(), "resultados": resultados}
+    fallidos = [f"{medida['filas']} {medida['caso']}" for medida in resultados if "error" in medida]
+    rutas = [args.salida] + ([args.base] if args.guardar_base and not fallidos else [])
+    if args.guardar_base and fallidos:
+        print(f"No se guarda la línea base porque han fallado {len(fallidos)} casos: {', '.join(fallidos)}")
+    for ruta in rutas:
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=1)
+    regresiones = [medida for medida in resultados if medida["regresiones"]]
+    print(f"Resultados en {', '.join(rutas)}. {len(regresiones)} regresiones" + (f" frente a {args.base}" if base else ""))
+    sys.exit(1 if regresiones else 0)
+
+
+if __name__ == "__main__":
+    main()
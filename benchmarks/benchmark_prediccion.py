@@ -0,0 +1,101 @@
+"""
+Benchmark de latencia y rendimiento de los predictores de popularidad.
+
+- Local: modelo serializado cargado en el proceso, una canción y lotes vectorizados.
+- Azure: endpoint remoto con conexiones reutilizadas, una canción por petición y lotes en una petición.
+  Sin --url se levanta un servidor local que imita el endpoint para medir el coste del cliente HTTP,
+  y se compara con la petición original de urllib.request sin reutilizar conexiones.
+
+Uso:
+    python -m benchmarks.benchmark_prediccion
+    python -m benchmarks.benchmark_prediccion --modelo modelos/modelo_popularidad.joblib --url https://... --api-key ...
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from benchmarks.datos_sinteticos import generar_datos
+from prediccion import COLUMNAS_MODELO, PredictorAzure, PredictorLocal, construir_peticion, entrenar_modelo
+
+
+class EndpointSimulado(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Mantiene la conexión abierta como el endpoint real
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        filas = cuerpo["input_data"]["data"]
+        respuesta = json.dumps(["Alta popularidad" if fila[1] > 0.5 else "Baja popularidad" for fila in filas]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(respuesta)))
+        self.end_headers()
+        self.wfile.write(respuesta)
+
+    def log_message(self, *args):
+        pass
+
+
+def peticion_original(url:str, api_key:str, fila:list)->list:
+    # Petición como la hacía app.py: urllib.request sin reutilizar la conexión
+    headers = {'Content-Type': 'application/json', 'Authorization': ('Bearer ' + api_key)}
+    req = urllib.request.Request(url, construir_peticion(np.array([fila])), headers)
+    return json.loads(urllib.request.urlopen(req).read())
+
+
+def medir(nombre:str, funcion, canciones:int, repeticiones:int)->None:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    mejor = min(tiempos)
+    print(f"{nombre:<40}{mejor * 1000:>12.3f}{canciones / mejor:>16.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modelo", help="modelo serializado, si no se entrena uno con datos sintéticos")
+    parser.add_argument("--url", help="URL del endpoint de Azure")
+    parser.add_argument("--api-key", default="clave")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    X = generar_datos(100_000)[COLUMNAS_MODELO].to_numpy(dtype=np.float64)
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_modelo = args.modelo
+        if ruta_modelo is None:
+            ruta_modelo = os.path.join(directorio, "modelo.joblib")
+            entrenar_modelo(generar_datos(200_000, semilla=1), ruta_modelo)
+        local = PredictorLocal(ruta_modelo)
+
+        servidor = None
+        url = args.url
+        if url is None:
+            servidor = ThreadingHTTPServer(("127.0.0.1", 0), EndpointSimulado)
+            threading.Thread(target=servidor.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{servidor.server_port}/score"
+        azure = PredictorAzure(url, args.api_key, despliegue=None)
+
+        print(f"{'caso':<40}{'ms':>12}{'canciones/s':>16}")
+        medir("local, 1 canción", lambda: local.predecir(X[0]), 1, args.repeticiones)
+        for lote in [100, 10_000, 100_000]:
+            medir(f"local, lote de {lote}", lambda: local.predecir(X[:lote]), lote, args.repeticiones)
+        medir("azure original (urlopen), 1 canción", lambda: peticion_original(url, args.api_key, X[0].tolist()), 1, args.repeticiones)
+        medir("azure pool, 1 canción", lambda: azure.predecir(X[0]), 1, args.repeticiones)
+        medir("azure pool, 20 peticiones de 1", lambda: [azure.predecir(fila) for fila in X[:20]], 20, args.repeticiones)
+        for lote in [100, 10_000]:
+            medir(f"azure pool, lote de {lote}", lambda: azure.predecir(X[:lote]), lote, args.repeticiones)
+        if servidor is not None:
+            servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark de la latencia por rerun de la pestaña "Popularidad" al obtener las canciones más populares:
+ordenación completa con sort_values (implementación original, que se llamaba dos veces por rerun)
+frente al índice ordenado y a la selección parcial de seleccion.top_k, y coste de calcular
+las filas filtradas recorriendo las columnas frente a combinar los bitmaps del índice de filtros.
+
+Uso:
+    python -m benchmarks.benchmark_topk --filas 1000000 --top 50
+"""
+import argparse
+import time
+
+from benchmarks.datos_sinteticos import generar_datos
+from seleccion import indice_popularidad, top_k, construir_indice_filtros, bitmap_filtros, mascara_bitmap, mascara_filtros
+
+
+def ordenar_original(df, top):
+    return df.sort_values(by='popularity', ascending=False).head(top)
+
+
+def ordenar_original_filtrado(df, top, filtros):
+    mascara = df['genre'].isin(filtros['genre']) & df['year'].between(*filtros['year']) & df['mode'].isin(filtros['mode'])
+    return df[mascara].sort_values(by='popularity', ascending=False).head(top)
+
+
+def cronometrar(funcion, repeticiones:int)->float:
+    """
+    Función para medir el mejor tiempo de varias ejecuciones de una función.
+
+    Args:
+    - funcion (callable): función sin argumentos a medir
+    - repeticiones (int): número de ejecuciones
+
+    Returns:
+    - segundos (float): mejor tiempo
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1_000_000)
+    parser.add_argument("--top", type=int, default=50)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    df = generar_datos(args.filas)
+    inicio = time.perf_counter()
+    indice = indice_popularidad(df)
+    print(f"Construcción del índice (una vez por versión): {time.perf_counter() - inicio:.3f} s")
+    inicio = time.perf_counter()
+    indice_filtros = construir_indice_filtros(df)
+    print(f"Construcción del índice de filtros (una vez por versión): {time.perf_counter() - inicio:.3f} s")
+
+    filtros = {"genre": ["pop", "rock", "hip-hop"], "year": (2015, 2020), "mode": ["Major"]}
+    casos = [
+        ("sort_values x2 (original)", lambda: [ordenar_original(df, args.top) for _ in range(2)]),
+        ("top_k con índice", lambda: top_k(df, args.top, indice=indice)),
+        ("top_k argpartition", lambda: top_k(df, args.top)),
+        ("sort_values filtrado", lambda: ordenar_original_filtrado(df, args.top, filtros)),
+        ("top_k con índice filtrado", lambda: top_k(df, args.top, filtros, indice=indice)),
+        ("top_k argpartition filtrado", lambda: top_k(df, args.top, filtros)),
+        ("filas filtradas recorriendo", lambda: mascara_filtros(df, filtros)),
+        ("filas filtradas con bitmaps", lambda: mascara_bitmap(indice_filtros, bitmap_filtros(indice_filtros, filtros))),
+        ("bitmaps Y", lambda: bitmap_filtros(indice_filtros, filtros, "y")),
+        ("bitmaps O", lambda: bitmap_filtros(indice_filtros, filtros, "o")),
+        ("top_k con índice y bitmaps", lambda: top_k(df, args.top, indice=indice,
+                                                    mascara=mascara_bitmap(indice_filtros, bitmap_filtros(indice_filtros, filtros)))),
+    ]
+    print(f"{'caso':<32}{'ms por rerun':>14}")
+    for nombre, funcion in casos:
+        print(f"{nombre:<32}{cronometrar(funcion, args.repeticiones) * 1000:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
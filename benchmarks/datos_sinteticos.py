@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from datos import ESCALAS, MODOS
+
+
+GENEROS = ["acoustic", "afrobeat", "alt-rock", "ambient", "black-metal", "blues", "breakbeat", "cantopop",
+           "chicago-house", "chill", "classical", "club", "comedy", "country", "dance", "dancehall",
+           "death-metal", "deep-house", "detroit-techno", "disco", "drum-and-bass", "dub", "dubstep",
+           "edm", "electro", "electronic", "emo", "folk", "forro", "french", "funk", "garage", "german",
+           "gospel", "goth", "grindcore", "groove", "guitar", "hard-rock", "hardcore", "hardstyle",
+           "heavy-metal", "hip-hop", "house", "indian", "indie-pop", "industrial", "jazz", "k-pop",
+           "metal", "metalcore", "minimal-techno", "new-age", "opera", "party", "piano", "pop",
+           "pop-film", "power-pop", "progressive-house", "psych-rock", "punk", "punk-rock", "rock",
+           "rock-n-roll", "romance", "sad", "salsa", "samba", "show-tunes", "singer-songwriter", "ska",
+           "sleep", "songwriter", "soul", "spanish", "swedish", "tango", "techno", "trance", "trip-hop"]
+
+
+def generar_datos(filas:int, semilla:int=0, numero_artistas:int=None, primera_fila:int=0)->pd.DataFrame:
+    """
+    Función para generar un dataframe sintético con el mismo esquema que los datos limpios.
+
+    Args:
+    - filas (int): número de canciones a generar
+    - semilla (int): semilla del generador aleatorio
+    - numero_artistas (int): artistas distintos, uno por cada 16 canciones si es None
+    - primera_fila (int): número de la primera canción, para generar los datos por bloques sin repetir ids
+
+    Returns:
+    - df (pd.Dataframe): dataframe sintético
+    """
+    rng = np.random.default_rng(semilla)
+    numero_artistas = numero_artistas or max(filas // 16, 1)
+    duracion = rng.integers(30_000, 600_000, filas)
+    segundos = duracion // 1000
+    df = pd.DataFrame({
+        "artist_name": pd.Categorical.from_codes(rng.integers(0, numero_artistas, filas), [f"Artista {i}" for i in range(numero_artistas)]),
+        "track_name": [f"Canción {i}" for i in range(primera_fila, primera_fila + filas)],
+        "track_id": [f"{i:022d}" for i in range(primera_fila, primera_fila + filas)],
+        "popularity": np.clip(rng.gamma(1.5, 12, filas), 0, 100).astype("int16"),
+        "year": rng.integers(2000, 2024, filas).astype("int16"),
+        "genre": pd.Categorical.from_codes(rng.integers(0, len(GENEROS), filas), GENEROS),
+        "danceability": rng.beta(5, 4, filas).astype("float32"),
+        "energy": rng.beta(3, 2, filas).astype("float32"),
+        "key": pd.Categorical.from_codes(rng.integers(0, len(ESCALAS), filas), ESCALAS),
+        "loudness": np.clip(rng.normal(-9, 5, filas), -58, 6).astype("float32"),
+        "mode": pd.Categorical.from_codes(rng.integers(0, len(MODOS), filas), MODOS),
+        "speechiness": rng.beta(1, 10, filas).astype("float32"),
+        "acousticness": rng.beta(0.6, 1.2, filas).astype("float32"),
+        "instrumentalness": rng.beta(0.3, 1, filas).astype("float32"),
+        "liveness": rng.beta(1.5, 6, filas).astype("float32"),
+        "valence": rng.beta(2, 2, filas).astype("float32"),
+        "tempo": rng.normal(121, 30, filas).clip(0, 250).astype("float32"),
+        "duration_ms": duracion.astype("int32"),
+        "duration_min_secs": [f"{s // 60}:{s % 60:02d}" for s in segundos],
+        "time_signature": rng.choice([3.0, 4.0, 5.0], filas, p=[0.1, 0.85, 0.05]).astype("float32"),
+    })
+    return df
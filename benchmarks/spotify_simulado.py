@@ -0,0 +1,173 @@
+"""
+Servidor local que simula los endpoints de la API de Spotify que usa enriquecimiento.py (token
+de acceso y varias canciones), con su propio límite de peticiones por segundo: las peticiones
+que lo superan reciben un 429 con Retry-After. También puede devolver errores 503 al azar.
+Las canciones se generan a partir de su id, así que siempre devuelve lo mismo para cada una,
+y una de cada 50 no existe.
+
+Uso:
+    python -m benchmarks.spotify_simulado --puerto 8000 --tasa 20 --rafaga 5
+    python enriquecimiento.py --url-api http://127.0.0.1:8000/v1/ --url-token http://127.0.0.1:8000/api/token
+"""
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+TOKEN = "token-simulado"
+MAXIMO_IDS = 50
+
+
+def cancion_simulada(track_id:str)->dict:
+    """
+    Función para generar siempre la misma canción de la API para un id.
+
+    Args:
+    - track_id (str): id de la canción
+
+    Returns:
+    - cancion (dict): canción con el formato de la API, None para una de cada 50
+    """
+    semilla = zlib.crc32(track_id.encode())
+    if semilla % 50 == 0:
+        return None
+    return {
+        "id": track_id,
+        "popularity": semilla % 101,
+        "preview_url": f"https://p.scdn.co/mp3-preview/{track_id}" if semilla % 3 else None,
+        "album": {"name": f"Álbum {semilla % 1000}",
+                  "images": [{"url": f"https://i.scdn.co/image/{semilla:08x}", "height": 640, "width": 640}]},
+    }
+
+
+class ServidorSimulado(ThreadingHTTPServer):
+    """
+    Servidor HTTP con el límite de peticiones y los contadores de la simulación.
+
+    Args:
+    - direccion (tuple): host y puerto
+    - tasa (float): peticiones por segundo permitidas
+    - rafaga (float): peticiones seguidas permitidas
+    - fallos (float): probabilidad de responder 503
+    """
+    daemon_threads = True
+
+    def __init__(self, direccion:tuple, tasa:float, rafaga:float, fallos:float=0.0):
+        super().__init__(direccion, ManejadorSimulado)
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.fallos = fallos
+        self.tokens = rafaga
+        self.actualizado = time.monotonic()
+        self.bloqueo = threading.Lock()
+        self.contadores = {"token": 0, "peticiones": 0, "limitadas": 0, "fallos": 0, "canciones": 0}
+
+    def admitir(self)->float:
+        """
+        Función para aplicar el límite de peticiones con un cubo de tokens.
+
+        Returns:
+        - espera (float): 0 si se admite la petición, si no los segundos hasta que se admitiría
+        """
+        with self.bloqueo:
+            ahora = time.monotonic()
+            self.tokens = min(self.rafaga, self.tokens + (ahora - self.actualizado) * self.tasa)
+            self.actualizado = ahora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.tasa
+
+    def contar(self, nombre:str, valor:int=1)->None:
+        with self.bloqueo:
+            self.contadores[nombre] += valor
+
+
+class ManejadorSimulado(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def responder(self, codigo:int, contenido:dict, cabeceras:dict=None)->None:
+        cuerpo = json.dumps(contenido).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.contar("token")
+        self.responder(200, {"access_token": TOKEN, "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith("/tracks"):
+            return self.responder(404, {"error": {"status": 404, "message": "Service not found"}})
+        if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            return self.responder(401, {"error": {"status": 401, "message": "Invalid access token"}})
+        espera = self.server.admitir()
+        if espera:
+            self.server.contar("limitadas")
+            return self.responder(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                                  {"Retry-After": str(math.ceil(espera))})
+        if random.random() < self.server.fallos:
+            self.server.contar("fallos")
+            return self.responder(503, {"error": {"status": 503, "message": "Service unavailable"}})
+        ids = parse_qs(url.query).get("ids", [""])[0].split(",")
+        if len(ids) > MAXIMO_IDS:
+            return self.responder(400, {"error": {"status": 400, "message": "Too many ids requested"}})
+        self.server.contar("peticiones")
+        self.server.contar("canciones", len(ids))
+        self.responder(200, {"tracks": [cancion_simulada(track_id) for track_id in ids]})
+
+    def log_message(self, *args):
+        pass
+
+
+def arrancar(puerto:int=0, tasa:float=20, rafaga:float=5, fallos:float=0.0, host:str="127.0.0.1")->ServidorSimulado:
+    """
+    Función para arrancar el servidor simulado en un hilo en segundo plano.
+
+    Args:
+    - puerto (int): puerto, 0 para uno libre
+    - tasa (float): peticiones por segundo permitidas
+    - rafaga (float): peticiones seguidas permitidas
+    - fallos (float): probabilidad de responder 503
+    - host (str): dirección en la que escucha
+
+    Returns:
+    - servidor (ServidorSimulado): servidor arrancado, con su URL base en servidor.url
+    """
+    servidor = ServidorSimulado((host, puerto), tasa, rafaga, fallos)
+    servidor.url = f"http://{host}:{servidor.server_address[1]}/"
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--puerto", type=int, default=8000)
+    parser.add_argument("--tasa", type=float, default=20, help="peticiones por segundo permitidas")
+    parser.add_argument("--rafaga", type=float, default=5, help="peticiones seguidas permitidas")
+    parser.add_argument("--fallos", type=float, default=0.0, help="probabilidad de responder 503")
+    args = parser.parse_args()
+    servidor = arrancar(args.puerto, args.tasa, args.rafaga, args.fallos)
+    print(f"API simulada en {servidor.url}v1/ y token en {servidor.url}api/token")
+    try:
+        while True:
+            time.sleep(10)
+            print(servidor.contadores)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import json
+import time
+import sqlite3
+import threading
+import requests
+import spotipy
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+
+
+URL_API = "https://api.spotify.com/v1/"
+URL_TOKEN = "https://accounts.spotify.com/api/token"
+RUTA_CACHE = "spotify_cache.sqlite"
+TTL_RESPUESTAS = 3600 # Segundos que se reutiliza una respuesta de la API
+MAXIMO_ENTRADAS = 5000 # Respuestas guardadas como máximo, se eliminan las menos usadas recientemente
+
+
+def crear_sesion(conexiones:int=10, reintentos:int=3)->requests.Session:
+    """
+    Función para crear una sesión HTTP que mantiene abiertas las conexiones con la API de Spotify
+    y reintenta los errores temporales.
+
+    Args:
+    - conexiones (int): conexiones que se mantienen abiertas por host
+    - reintentos (int): reintentos de los errores temporales y los 429, 0 si los gestiona quien llama
+
+    Returns:
+    - sesion (requests.Session): sesión HTTP
+    """
+    sesion = requests.Session()
+    reintentos = Retry(total=reintentos, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                       allowed_methods=False, respect_retry_after_header=True) if reintentos else 0
+    adaptador = HTTPAdapter(pool_connections=conexiones, pool_maxsize=conexiones, max_retries=reintentos)
+    sesion.mount("https://", adaptador)
+    sesion.mount("http://", adaptador)
+    return sesion
+
+
+def crear_cliente(client_id:str, client_secret:str, url_api:str=URL_API, url_token:str=URL_TOKEN)->spotipy.Spotify:
+    """
+    Función para crear un cliente de la API de Spotify con una sesión HTTP compartida y el token
+    de acceso guardado en memoria, así se reutiliza mientras no caduque.
+
+    Args:
+    - client_id (str): id de la aplicación de Spotify
+    - client_secret (str): secreto de la aplicación de Spotify
+    - url_api (str): URL base de la API, se puede cambiar por un servidor local
+    - url_token (str): URL para obtener el token de acceso
+
+    Returns:
+    - sp (spotipy.Spotify): cliente de la API
+    """
+    sesion = crear_sesion()
+    auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret,
+                                            requests_session=sesion, cache_handler=MemoryCacheHandler())
+    auth_manager.OAUTH_TOKEN_URL = url_token
+    sp = spotipy.Spotify(auth_manager=auth_manager, requests_session=sesion)
+    sp.prefix = url_api
+    return sp
+
+
+def normalizar_argumentos(argumentos:dict)->dict:
+    """
+    Función para normalizar los argumentos de una petición y que peticiones equivalentes
+    compartan la misma clave de caché: se ordenan las listas, se redondean los decimales
+    y se quitan los argumentos vacíos.
+
+    Args:
+    - argumentos (dict): argumentos de la petición
+
+    Returns:
+    - argumentos (dict): argumentos normalizados
+    """
+    normalizados = {}
+    for nombre, valor in argumentos.items():
+        if valor is None:
+            continue
+        if isinstance(valor, float):
+            valor = round(valor, 4)
+        elif isinstance(valor, (list, tuple, set)):
+            valor = sorted(valor)
+        normalizados[nombre] = valor
+    return normalizados
+
+
+class CacheRespuestas:
+    """
+    Caché en SQLite de las respuestas de la API de Spotify, compartida entre sesiones y reinicios.
+    Cada respuesta caduca a los ttl segundos y, al superar el máximo de entradas, se eliminan
+    las usadas hace más tiempo. Lleva la cuenta de aciertos y fallos.
+
+    Args:
+    - ruta (str): ruta de la base de datos, ":memory:" para no guardarla en disco
+    - ttl (float): segundos que es válida una respuesta
+    - maximo_entradas (int): número máximo de respuestas guardadas
+    """
+    def __init__(self, ruta:str=RUTA_CACHE, ttl:float=TTL_RESPUESTAS, maximo_entradas:int=MAXIMO_ENTRADAS):
+        self.ttl = ttl
+        self.maximo_entradas = maximo_entradas
+        self.aciertos = 0
+        self.fallos = 0
+        self.bloqueo = threading.Lock()
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("""CREATE TABLE IF NOT EXISTS respuestas (
+            clave TEXT PRIMARY KEY, valor TEXT NOT NULL, creado REAL NOT NULL, usado REAL NOT NULL)""")
+        self.conexion.execute("CREATE INDEX IF NOT EXISTS respuestas_usado ON respuestas (usado)")
+
+    @staticmethod
+    def clave(nombre:str, argumentos:dict)->str:
+        """
+        Función para obtener la clave de caché de una petición.
+
+        Args:
+        - nombre (str): nombre del endpoint
+        - argumentos (dict): argumentos de la petición
+
+        Returns:
+        - clave (str): clave de la petición
+        """
+        return json.dumps({"endpoint": nombre, "argumentos": normalizar_argumentos(argumentos)}, sort_keys=True)
+
+    def obtener(self, clave:str):
+        """
+        Función para obtener una respuesta guardada si no ha caducado.
+
+        Args:
+        - clave (str): clave de la petición
+
+        Returns:
+        - respuesta: respuesta guardada o None si no está o ha caducado
+        """
+        ahora = time.time()
+        with self.bloqueo:
+            fila = self.conexion.execute("SELECT valor, creado FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+            if fila is None or ahora - fila[1] > self.ttl:
+                if fila is not None:
+                    self.conexion.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                self.fallos += 1
+                return None
+            self.conexion.execute("UPDATE respuestas SET usado = ? WHERE clave = ?", (ahora, clave))
+            self.aciertos += 1
+        return json.loads(fila[0])
+
+    def guardar(self, clave:str, respuesta)->None:
+        """
+        Función para guardar una respuesta, eliminando las menos usadas si se supera el máximo.
+
+        Args:
+        - clave (str): clave de la petición
+        - respuesta: respuesta serializable en JSON
+        """
+        ahora = time.time()
+        with self.bloqueo:
+            self.conexion.execute("INSERT OR REPLACE INTO respuestas (clave, valor, creado, usado) VALUES (?, ?, ?, ?)",
+                                  (clave, json.dumps(respuesta), ahora, ahora))
+            self.conexion.execute("""DELETE FROM respuestas WHERE clave IN (
+                SELECT clave FROM respuestas ORDER BY usado DESC LIMIT -1 OFFSET ?)""", (self.maximo_entradas,))
+
+    def obtener_o_pedir(self, nombre:str, argumentos:dict, pedir):
+        """
+        Función para obtener una respuesta de la caché o pedirla a la API y guardarla.
+
+        Args:
+        - nombre (str): nombre del endpoint
+        - argumentos (dict): argumentos de la petición
+        - pedir (callable): función sin argumentos que hace la petición
+
+        Returns:
+        - respuesta: respuesta de la API
+        """
+        clave = self.clave(nombre, argumentos)
+        respuesta = self.obtener(clave)
+        if respuesta is None:
+            respuesta = pedir()
+            self.guardar(clave, respuesta)
+        return respuesta
+
+    def estadisticas(self)->dict:
+        """
+        Función para obtener los contadores de la caché.
+
+        Returns:
+        - estadisticas (dict): aciertos, fallos y entradas guardadas
+        """
+        with self.bloqueo:
+            entradas = self.conexion.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": entradas}
+
+
+def generos_disponibles(sp:spotipy.Spotify, cache:CacheRespuestas)->list:
+    """
+    Función para obtener los géneros que admite el endpoint de recomendaciones.
+
+    Args:
+    - sp (spotipy.Spotify): cliente de la API
+    - cache (CacheRespuestas): caché de respuestas
+
+    Returns:
+    - generos (list): géneros disponibles
+    """
+    return cache.obtener_o_pedir("recommendation_genre_seeds", {}, sp.recommendation_genre_seeds)["genres"]
+
+
+def recomendaciones(sp:spotipy.Spotify, cache:CacheRespuestas, **argumentos)->dict:
+    """
+    Función para obtener recomendaciones de canciones, reutilizando la respuesta si ya se
+    pidieron con los mismos géneros y parámetros.
+
+    Args:
+    - sp (spotipy.Spotify): cliente de la API
+    - cache (CacheRespuestas): caché de respuestas
+    - argumentos: argumentos de sp.recommendations
+
+    Returns:
+    - results (dict): respuesta de la API con las canciones recomendadas
+    """
+    return cache.obtener_o_pedir("recommendations", argumentos, lambda: sp.recommendations(**argumentos))
@@ -0,0 +1,202 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+
+RUTA_CSV = "spotify_data_cleaned.zip"
+RUTA_PARQUET = "spotify_data_cleaned.parquet"
+
+ESCALAS = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+MODOS = ["Minor", "Major"]
+
+# Tipos de cada columna en el almacén columnar. Las columnas con pocos valores distintos
+# se guardan como categóricas y las características de audio se reducen a float32/int16
+TIPOS_COLUMNAS = {
+    "artist_name": "category",
+    "track_name": "object",
+    "track_id": "object",
+    "popularity": "int16",
+    "year": "int16",
+    "genre": "category",
+    "danceability": "float32",
+    "energy": "float32",
+    "key": pd.CategoricalDtype(ESCALAS),
+    "loudness": "float32",
+    "mode": pd.CategoricalDtype(MODOS),
+    "speechiness": "float32",
+    "acousticness": "float32",
+    "instrumentalness": "float32",
+    "liveness": "float32",
+    "valence": "float32",
+    "tempo": "float32",
+    "duration_ms": "int32",
+    "duration_min_secs": "object",
+    "time_signature": "float32", # Puede contener nulos tras la imputación por moda
+}
+
+# Características de audio que usan el modelo de popularidad y el índice de similares, en el
+# mismo orden que el endpoint de Azure
+COLUMNAS_MODELO = ["danceability", "energy", "loudness", "speechiness", "acousticness", "instrumentalness", "valence", "tempo"]
+
+# Columnas que necesita cada sección de la aplicación, así sólo se cargan las que se van a usar
+COLUMNAS_POR_SECCION = {
+    "Popularidad": ("artist_name", "track_name", "popularity", "genre", "danceability", "key", "mode"),
+    "Características de la canción": ("artist_name",),
+}
+
+# Versiones ya calculadas en este proceso, por ruta, tamaño y fecha de modificación
+_versiones = {}
+
+
+def aplicar_tipos(df:pd.DataFrame)->pd.DataFrame:
+    """
+    Función para convertir las columnas de un dataframe a los tipos del almacén columnar.
+
+    Args:
+    - df (pd.Dataframe): dataframe con los datos limpios
+
+    Returns:
+    - df (pd.Dataframe): dataframe con los tipos reducidos
+    """
+    tipos = {columna: tipo for columna, tipo in TIPOS_COLUMNAS.items() if columna in df.columns}
+    return df.astype(tipos)
+
+
+def guardar_datos(df:pd.DataFrame, ruta:str=RUTA_PARQUET)->None:
+    """
+    Función para guardar el dataframe limpio en formato Parquet con tipos reducidos.
+
+    Args:
+    - df (pd.Dataframe): dataframe con los datos limpios
+    - ruta (str): ruta del fichero Parquet de salida
+    """
+    aplicar_tipos(df).to_parquet(ruta, engine="pyarrow", index=False, row_group_size=128_000)
+
+
+def convertir_a_parquet(ruta_csv:str=RUTA_CSV, ruta_parquet:str=RUTA_PARQUET)->None:
+    """
+    Función para convertir el CSV comprimido que genera el preprocesamiento al almacén Parquet.
+
+    Args:
+    - ruta_csv (str): ruta del CSV limpio
+    - ruta_parquet (str): ruta del fichero Parquet de salida
+    """
+    df = pd.read_csv(ruta_csv, dtype=TIPOS_COLUMNAS)
+    guardar_datos(df, ruta_parquet)
+
+
+def leer_datos(columnas:list=None, ruta_parquet:str=RUTA_PARQUET, ruta_csv:str=RUTA_CSV)->pd.DataFrame:
+    """
+    Función para leer los datos limpios cargando únicamente las columnas indicadas.
+    Si existe el almacén Parquet se lee mapeado en memoria, si no se usa el CSV.
+
+    Args:
+    - columnas (list): columnas a cargar, todas si es None
+    - ruta_parquet (str): ruta del fichero Parquet
+    - ruta_csv (str): ruta del CSV limpio
+
+    Returns:
+    - df (pd.Dataframe): dataframe con las columnas pedidas
+    """
+    columnas = list(columnas) if columnas is not None else None
+    if os.path.exists(ruta_parquet):
+        return pd.read_parquet(ruta_parquet, columns=columnas, memory_map=True)
+    return pd.read_csv(ruta_csv, usecols=columnas, dtype=TIPOS_COLUMNAS)
+
+
+def ruta_datos(ruta_parquet:str=RUTA_PARQUET, ruta_csv:str=RUTA_CSV)->str:
+    """
+    Función para obtener el fichero del que se leen los datos: el Parquet si existe y si no el CSV.
+
+    Args:
+    - ruta_parquet (str): ruta del fichero Parquet
+    - ruta_csv (str): ruta del CSV limpio
+
+    Returns:
+    - ruta (str): ruta del fichero de datos
+    """
+    return ruta_parquet if os.path.exists(ruta_parquet) else ruta_csv
+
+
+def hash_contenido(ruta:str, tamano_bloque:int=1 << 20)->str:
+    """
+    Función para calcular el hash del contenido de un fichero leyéndolo por bloques.
+
+    Args:
+    - ruta (str): ruta del fichero
+    - tamano_bloque (int): bytes que se leen de cada vez
+
+    Returns:
+    - hash (str): hash SHA-1 del contenido, en hexadecimal
+    """
+    sha1 = hashlib.sha1()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b""):
+            sha1.update(bloque)
+    return sha1.hexdigest()
+
+
+def registrar_version(ruta:str, anterior:str=None)->str:
+    """
+    Función para calcular la versión de un fichero de datos a partir de su contenido y guardarla
+    en su manifiesto (<ruta>.version.json) junto al tamaño y la fecha de modificación, para no
+    volver a leer el fichero mientras no cambie.
+
+    Args:
+    - ruta (str): ruta del fichero de datos
+    - anterior (str): versión de la que sale esta, si es una actualización incremental
+
+    Returns:
+    - version (str): identificador de la versión
+    """
+    info = os.stat(ruta)
+    manifiesto = {
+        "version": hash_contenido(ruta)[:12],
+        "tamano": info.st_size,
+        "modificado_ns": info.st_mtime_ns,
+        "anterior": anterior,
+    }
+    try:
+        temporal = f"{ruta}.version.json.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(manifiesto, f, indent=1)
+        os.replace(temporal, f"{ruta}.version.json")
+    except OSError:
+        pass # Sin permisos de escritura la versión se vuelve a calcular en cada arranque
+    _versiones[(os.path.abspath(ruta), info.st_size, info.st_mtime_ns)] = manifiesto["version"]
+    return manifiesto["version"]
+
+
+def version_datos(ruta_parquet:str=RUTA_PARQUET, ruta_csv:str=RUTA_CSV)->str:
+    """
+    Función para obtener un identificador de la versión de los datos, que sirve para
+    invalidar las cachés y los agregados guardados cuando cambia el contenido del fichero.
+    Se lee del manifiesto si el fichero no ha cambiado desde que se calculó, y si no
+    se calcula el hash del contenido y se actualiza el manifiesto.
+
+    Args:
+    - ruta_parquet (str): ruta del fichero Parquet
+    - ruta_csv (str): ruta del CSV limpio
+
+    Returns:
+    - version (str): identificador de la versión
+    """
+    ruta = ruta_datos(ruta_parquet, ruta_csv)
+    info = os.stat(ruta)
+    clave = (os.path.abspath(ruta), info.st_size, info.st_mtime_ns)
+    if clave in _versiones:
+        return _versiones[clave]
+    try:
+        with open(f"{ruta}.version.json", encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        if (manifiesto["tamano"], manifiesto["modificado_ns"]) == (info.st_size, info.st_mtime_ns):
+            _versiones[clave] = manifiesto["version"]
+            return manifiesto["version"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return registrar_version(ruta)
+
+
+if __name__ == "__main__":
+    convertir_a_parquet()
@@ -0,0 +1,464 @@
+"""
+Enriquecimiento del almacén con datos de la API de Spotify que no vienen en la descarga: el
+álbum y su portada, la URL de la muestra de 30 segundos y la popularidad actual.
+
+Las canciones se piden por lotes al endpoint de varias canciones (hasta 50 ids por petición)
+con varias peticiones a la vez. Un cubo de tokens limita las peticiones por segundo entre todas
+ellas; ante un 429 se para todo el tiempo que indica Retry-After y los errores del servidor se
+reintentan con espera exponencial. Cada lote terminado se añade a un punto de control en disco,
+así que el trabajo se puede interrumpir y continuar sin volver a pedir lo ya descargado. Al
+terminar, los resultados se escriben en el almacén como columnas nuevas y se registra la nueva
+versión de los datos.
+
+Las peticiones se hacen con requests en hilos y se coordinan con asyncio. Las credenciales se
+leen de .streamlit/secrets.toml, como en la aplicación; para probarlo sin la API está
+benchmarks/spotify_simulado.py, que simula los límites de peticiones.
+
+Uso:
+    python enriquecimiento.py
+    python enriquecimiento.py --concurrencia 8 --tasa 10 --limite 10000
+    python enriquecimiento.py --url-api http://127.0.0.1:8000/v1/ --url-token http://127.0.0.1:8000/api/token
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tomllib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import requests
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+
+from datos import RUTA_PARQUET, registrar_version, version_datos
+from agregados import DIRECTORIO_AGREGADOS, FAMILIAS, cargar_agregados, guardar_agregados
+from cliente_spotify import URL_API, URL_TOKEN, crear_sesion
+from preprocesamiento import TAMANO_GRUPO_FILAS
+
+
+RUTA_PUNTO_CONTROL = "enriquecimiento.jsonl" # Canciones ya descargadas, una por línea
+RUTA_SECRETOS = os.path.join(".streamlit", "secrets.toml")
+TAMANO_LOTE = 50 # Máximo de ids que admite el endpoint de varias canciones
+CONCURRENCIA = 4 # Peticiones a la vez
+PETICIONES_POR_SEGUNDO = 5 # Ritmo sostenido del cubo de tokens
+RAFAGA = 10 # Peticiones que se pueden hacer seguidas con el cubo lleno
+MAXIMO_REINTENTOS = 8
+ESPERA_BASE = 0.5 # Segundos de la primera espera, se duplica en cada reintento
+ESPERA_MAXIMA = 60
+TIMEOUT = 15
+# Columnas que se añaden al almacén y su tipo
+COLUMNAS_ENRIQUECIDAS = {
+    "album_name": pa.string(),
+    "album_image_url": pa.string(),
+    "preview_url": pa.string(),
+    "current_popularity": pa.int16(),
+}
+
+
+class ErrorEnriquecimiento(Exception):
+    """
+    Error de la API que no se resuelve reintentando.
+    """
+
+
+class CuboTokens:
+    """
+    Cubo de tokens compartido por todas las peticiones. Se rellena a un ritmo fijo hasta su
+    capacidad y cada petición gasta un token, esperando si no queda ninguno. Tras un 429 se
+    vacía y no se hace ninguna petición hasta que pasa la espera indicada.
+
+    Args:
+    - tasa (float): tokens que se añaden por segundo
+    - capacidad (float): tokens como máximo, las peticiones que se pueden hacer seguidas
+    """
+    def __init__(self, tasa:float=PETICIONES_POR_SEGUNDO, capacidad:float=RAFAGA):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.actualizado = time.monotonic()
+        self.pausa_hasta = 0.0
+        self.bloqueo = asyncio.Lock()
+
+    async def esperar(self)->None:
+        """
+        Función para esperar hasta que haya un token y gastarlo. Las peticiones esperan por orden.
+        """
+        async with self.bloqueo:
+            while True:
+                ahora = time.monotonic()
+                if ahora < self.pausa_hasta:
+                    await asyncio.sleep(self.pausa_hasta - ahora)
+                    continue
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+                self.actualizado = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.tasa)
+
+    def pausar(self, segundos:float)->None:
+        """
+        Función para no dar tokens durante unos segundos y empezar después con el cubo vacío.
+
+        Args:
+        - segundos (float): segundos de pausa
+        """
+        self.pausa_hasta = max(self.pausa_hasta, time.monotonic() + segundos)
+        self.tokens = 0
+        self.actualizado = self.pausa_hasta
+
+
+def tiempo_espera(intento:int, retry_after:str=None)->float:
+    """
+    Función para calcular la espera antes de reintentar una petición: la que indica la API en
+    Retry-After o una espera exponencial con una parte aleatoria, para que las peticiones que
+    fallan a la vez no se reintenten a la vez.
+
+    Args:
+    - intento (int): número de reintento, empezando en 0
+    - retry_after (str): cabecera Retry-After de la respuesta, en segundos
+
+    Returns:
+    - segundos (float): segundos de espera
+    """
+    if retry_after is not None:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+    return min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** intento) * random.uniform(0.5, 1)
+
+
+def crear_credenciales(client_id:str, client_secret:str, url_token:str=URL_TOKEN)->SpotifyClientCredentials:
+    """
+    Función para crear el gestor del token de acceso, que lo guarda en memoria y lo renueva al caducar.
+
+    Args:
+    - client_id (str): id de la aplicación de Spotify
+    - client_secret (str): secreto de la aplicación de Spotify
+    - url_token (str): URL para obtener el token de acceso
+
+    Returns:
+    - credenciales (SpotifyClientCredentials): gestor del token
+    """
+    credenciales = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret,
+                                            requests_session=crear_sesion(1), cache_handler=MemoryCacheHandler())
+    credenciales.OAUTH_TOKEN_URL = url_token
+    return credenciales
+
+
+async def pedir_lote(sesion:requests.Session, credenciales:SpotifyClientCredentials, cubo:CuboTokens, ids:list,
+                     url_api:str=URL_API, estadisticas:dict=None, mercado:str=None)->list:
+    """
+    Función para pedir un lote de canciones al endpoint de varias canciones, reintentando los
+    429, los errores del servidor y los de conexión.
+
+    Args:
+    - sesion (requests.Session): sesión HTTP sin reintentos propios
+    - credenciales (SpotifyClientCredentials): gestor del token de acceso
+    - cubo (CuboTokens): cubo de tokens compartido
+    - ids (list): ids de las canciones, como máximo TAMANO_LOTE
+    - url_api (str): URL base de la API
+    - estadisticas (dict): contadores de peticiones, 429 y errores que se actualizan
+    - mercado (str): código del país para la disponibilidad y la muestra
+
+    Returns:
+    - canciones (list): canción de cada id en el mismo orden, None si no existe
+    """
+    estadisticas = estadisticas if estadisticas is not None else {}
+    argumentos = {"ids": ",".join(ids)}
+    if mercado:
+        argumentos["market"] = mercado
+    for intento in range(MAXIMO_REINTENTOS + 1):
+        await cubo.esperar()
+        token = await asyncio.to_thread(credenciales.get_access_token, as_dict=False)
+        try:
+            respuesta = await asyncio.to_thread(sesion.get, url_api + "tracks", params=argumentos, timeout=TIMEOUT,
+                                                headers={"Authorization": f"Bearer {token}"})
+        except requests.RequestException as error:
+            estadisticas["errores"] = estadisticas.get("errores", 0) + 1
+            ultimo = str(error)
+            await asyncio.sleep(tiempo_espera(intento))
+            continue
+        estadisticas["peticiones"] = estadisticas.get("peticiones", 0) + 1
+        if respuesta.status_code == 200:
+            return respuesta.json()["tracks"]
+        ultimo = f"La API respondió {respuesta.status_code}: {respuesta.text[:200]}"
+        if respuesta.status_code == 429:
+            # El límite es de toda la aplicación, así que paramos todas las peticiones
+            estadisticas["limitadas"] = estadisticas.get("limitadas", 0) + 1
+            cubo.pausar(tiempo_espera(intento, respuesta.headers.get("Retry-After")))
+        elif respuesta.status_code == 401:
+            # Token caducado o revocado: se pide otro
+            credenciales.cache_handler.save_token_to_cache(None)
+        elif respuesta.status_code >= 500:
+            estadisticas["errores"] = estadisticas.get("errores", 0) + 1
+            await asyncio.sleep(tiempo_espera(intento))
+        else:
+            raise ErrorEnriquecimiento(ultimo)
+    raise ErrorEnriquecimiento(f"Sin respuesta tras {MAXIMO_REINTENTOS} reintentos. {ultimo}")
+
+
+def extraer_campos(cancion:dict)->dict:
+    """
+    Función para quedarse con los campos de una canción de la API que se añaden al almacén.
+
+    Args:
+    - cancion (dict): canción de la API, None si no existe
+
+    Returns:
+    - campos (dict): valor de cada columna de COLUMNAS_ENRIQUECIDAS, nulos si la canción no existe
+    """
+    if cancion is None:
+        return dict.fromkeys(COLUMNAS_ENRIQUECIDAS)
+    album = cancion.get("album") or {}
+    imagenes = album.get("images") or [{}] # La API las da de mayor a menor tamaño
+    return {
+        "album_name": album.get("name"),
+        "album_image_url": imagenes[0].get("url"),
+        "preview_url": cancion.get("preview_url"),
+        "current_popularity": cancion.get("popularity"),
+    }
+
+
+def leer_punto_control(ruta:str=RUTA_PUNTO_CONTROL)->dict:
+    """
+    Función para leer las canciones descargadas en ejecuciones anteriores. Una última línea
+    incompleta, de un trabajo interrumpido mientras escribía, no se tiene en cuenta.
+
+    Args:
+    - ruta (str): fichero del punto de control
+
+    Returns:
+    - resultados (dict): campos de cada track_id
+    """
+    resultados = {}
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    fila = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                resultados[fila.pop("track_id")] = fila
+    return resultados
+
+
+def recortar_punto_control(ruta:str=RUTA_PUNTO_CONTROL)->None:
+    """
+    Función para quitar del punto de control una última línea incompleta, para que las
+    canciones que se añadan después empiecen en una línea propia y no se pierdan al leerlo.
+
+    Args:
+    - ruta (str): fichero del punto de control
+    """
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, "r+b") as f:
+        final = posicion = f.seek(0, os.SEEK_END)
+        while posicion > 0:
+            inicio = max(0, posicion - 65536)
+            f.seek(inicio)
+            salto = f.read(posicion - inicio).rfind(b"\n")
+            if salto >= 0:
+                posicion = inicio + salto + 1
+                break
+            posicion = inicio
+        if posicion < final:
+            f.truncate(posicion)
+
+
+def guardar_punto_control(fichero, resultados:dict)->None:
+    """
+    Función para añadir un lote terminado al punto de control y pasarlo a disco.
+
+    Args:
+    - fichero: fichero del punto de control abierto para añadir
+    - resultados (dict): campos de cada track_id del lote
+    """
+    fichero.write("".join(json.dumps({"track_id": track_id, **campos}, ensure_ascii=False) + "\n"
+                          for track_id, campos in resultados.items()))
+    fichero.flush()
+    os.fsync(fichero.fileno())
+
+
+async def enriquecer_canciones(ids:list, credenciales:SpotifyClientCredentials, url_api:str=URL_API,
+                               punto_control:str=RUTA_PUNTO_CONTROL, concurrencia:int=CONCURRENCIA,
+                               tasa:float=PETICIONES_POR_SEGUNDO, rafaga:float=RAFAGA, mercado:str=None)->tuple:
+    """
+    Función para descargar los campos de las canciones que no están en el punto de control,
+    con varias peticiones a la vez y el ritmo limitado por un cubo de tokens.
+
+    Si un lote falla después de todos sus reintentos se paran las demás peticiones; los lotes
+    terminados ya están en el punto de control.
+
+    Args:
+    - ids (list): track_id de las canciones
+    - credenciales (SpotifyClientCredentials): gestor del token de acceso
+    - url_api (str): URL base de la API
+    - punto_control (str): fichero del punto de control
+    - concurrencia (int): peticiones a la vez
+    - tasa (float): peticiones por segundo
+    - rafaga (float): peticiones seguidas con el cubo lleno
+    - mercado (str): código del país para la disponibilidad y la muestra
+
+    Returns:
+    - resultados (dict): campos de cada track_id, también los de ejecuciones anteriores
+    - estadisticas (dict): lotes, peticiones, 429, errores y segundos
+    """
+    inicio = time.perf_counter()
+    resultados = leer_punto_control(punto_control)
+    pendientes = [track_id for track_id in dict.fromkeys(map(str, ids)) if track_id not in resultados]
+    cola = asyncio.Queue()
+    for i in range(0, len(pendientes), TAMANO_LOTE):
+        cola.put_nowait(pendientes[i:i + TAMANO_LOTE])
+    estadisticas = {"pendientes": len(pendientes), "lotes": 0, "peticiones": 0, "limitadas": 0, "errores": 0}
+    cubo = CuboTokens(tasa, rafaga)
+    sesion = crear_sesion(concurrencia, reintentos=0)
+    if pendientes:
+        # Pedimos el token antes de empezar para que no lo pidan todas las tareas a la vez
+        await asyncio.to_thread(credenciales.get_access_token, as_dict=False)
+
+    recortar_punto_control(punto_control)
+    with open(punto_control, "a", encoding="utf-8") as fichero:
+        async def trabajador():
+            while not cola.empty():
+                lote = cola.get_nowait()
+                canciones = await pedir_lote(sesion, credenciales, cubo, lote, url_api, estadisticas, mercado)
+                nuevos = {track_id: extraer_campos(cancion) for track_id, cancion in zip(lote, canciones)}
+                guardar_punto_control(fichero, nuevos)
+                resultados.update(nuevos)
+                estadisticas["lotes"] += 1
+
+        tareas = [asyncio.create_task(trabajador()) for _ in range(min(concurrencia, cola.qsize()))]
+        try:
+            await asyncio.gather(*tareas)
+        except BaseException:
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            raise
+        finally:
+            sesion.close()
+    estadisticas["segundos"] = time.perf_counter() - inicio
+    return resultados, estadisticas
+
+
+def escribir_columnas(resultados:dict, ruta_parquet:str=RUTA_PARQUET, directorio:str=DIRECTORIO_AGREGADOS)->str:
+    """
+    Función para añadir los campos descargados al almacén como columnas nuevas (o actualizar
+    las que ya estaban), dejando nulas las canciones que no se han pedido.
+
+    El almacén se reescribe por grupos de filas sin convertir el resto de columnas, con otro
+    nombre y renombrándolo al terminar. Como las columnas de los agregados no cambian, los de la
+    versión anterior se guardan con la nueva sin recalcularlos.
+
+    Args:
+    - resultados (dict): campos de cada track_id
+    - ruta_parquet (str): almacén Parquet
+    - directorio (str): carpeta donde se guardan los agregados
+
+    Returns:
+    - version (str): versión de los datos con las columnas nuevas
+    """
+    version_anterior = version_datos(ruta_parquet)
+    agregados = {familia: cargar_agregados(version_anterior, directorio, familia, ruta_parquet) for familia in FAMILIAS}
+    indice = pd.Index(list(map(str, resultados)))
+    campos = {columna: pa.array([fila[columna] for fila in resultados.values()], type=tipo)
+              for columna, tipo in COLUMNAS_ENRIQUECIDAS.items()}
+    almacen = pq.ParquetFile(ruta_parquet)
+    # Esquema del almacén con las columnas nuevas al final, así también funciona si no tiene filas
+    esquema = almacen.schema_arrow
+    for columna, tipo in COLUMNAS_ENRIQUECIDAS.items():
+        if columna in esquema.names:
+            esquema = esquema.set(esquema.get_field_index(columna), pa.field(columna, tipo))
+        else:
+            esquema = esquema.append(pa.field(columna, tipo))
+    temporal = ruta_parquet + ".tmp"
+    escritor = pq.ParquetWriter(temporal, esquema)
+    try:
+        for lote in almacen.iter_batches(batch_size=TAMANO_GRUPO_FILAS):
+            tabla = pa.Table.from_batches([lote])
+            posiciones = indice.get_indexer(tabla.column("track_id").to_pandas().astype(str))
+            pedidas = posiciones >= 0
+            posiciones = pa.array(posiciones, mask=~pedidas) # Las canciones sin pedir toman un nulo
+            for columna, tipo in COLUMNAS_ENRIQUECIDAS.items():
+                nuevos = campos[columna].take(posiciones)
+                if columna in tabla.column_names:
+                    # Las canciones que no se han pedido esta vez conservan su valor
+                    nuevos = pc.if_else(pa.array(pedidas), nuevos, tabla.column(columna).cast(tipo))
+                    tabla = tabla.set_column(tabla.schema.get_field_index(columna), columna, nuevos)
+                else:
+                    tabla = tabla.append_column(columna, nuevos)
+            escritor.write_table(tabla.cast(esquema), row_group_size=TAMANO_GRUPO_FILAS)
+    except BaseException:
+        # No dejamos el almacén temporal a medias
+        escritor.close()
+        escritor = None
+        os.remove(temporal)
+        raise
+    finally:
+        if escritor is not None:
+            escritor.close()
+    os.replace(temporal, ruta_parquet)
+    version = registrar_version(ruta_parquet, anterior=version_anterior)
+    for tablas in agregados.values():
+        guardar_agregados(tablas, version, directorio)
+    return version
+
+
+def leer_secretos(ruta:str=RUTA_SECRETOS)->dict:
+    """
+    Función para leer la configuración de Spotify de los secretos de la aplicación.
+
+    Args:
+    - ruta (str): fichero secrets.toml
+
+    Returns:
+    - secretos (dict): sección [spotify], vacía si no existe el fichero
+    """
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, "rb") as f:
+        return tomllib.load(f).get("spotify", {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parquet", default=RUTA_PARQUET, help="almacén Parquet a enriquecer")
+    parser.add_argument("--agregados", default=DIRECTORIO_AGREGADOS, help="carpeta de los agregados")
+    parser.add_argument("--punto-control", default=RUTA_PUNTO_CONTROL, help="fichero con las canciones ya descargadas")
+    parser.add_argument("--secretos", default=RUTA_SECRETOS, help="secrets.toml con la sección [spotify]")
+    parser.add_argument("--url-api", help="URL base de la API, por defecto la de los secretos o la de Spotify")
+    parser.add_argument("--url-token", help="URL del token de acceso, por defecto la de los secretos o la de Spotify")
+    parser.add_argument("--concurrencia", type=int, default=CONCURRENCIA, help="peticiones a la vez")
+    parser.add_argument("--tasa", type=float, default=PETICIONES_POR_SEGUNDO, help="peticiones por segundo")
+    parser.add_argument("--rafaga", type=float, default=RAFAGA, help="peticiones seguidas como máximo")
+    parser.add_argument("--mercado", help="código del país (ES, US...) para la disponibilidad y las muestras")
+    parser.add_argument("--limite", type=int, help="enriquecer sólo las primeras canciones del almacén")
+    parser.add_argument("--sin-escribir", action="store_true", help="sólo descargar al punto de control, sin escribir el almacén")
+    args = parser.parse_args()
+
+    secretos = leer_secretos(args.secretos)
+    if "client_id" not in secretos or "client_secret" not in secretos:
+        parser.error(f"faltan client_id y client_secret en la sección [spotify] de {args.secretos}")
+    credenciales = crear_credenciales(secretos["client_id"], secretos["client_secret"],
+                                      args.url_token or secretos.get("url_token", URL_TOKEN))
+    ids = pq.read_table(args.parquet, columns=["track_id"]).column("track_id").to_pylist()[:args.limite]
+
+    resultados, estadisticas = asyncio.run(enriquecer_canciones(
+        ids, credenciales, args.url_api or secretos.get("url_api", URL_API), args.punto_control,
+        args.concurrencia, args.tasa, args.rafaga, args.mercado))
+    print(f"{estadisticas['pendientes']} canciones pedidas en {estadisticas['lotes']} lotes y {estadisticas['peticiones']} peticiones "
+          f"({estadisticas['limitadas']} limitadas con 429, {estadisticas['errores']} errores) en {estadisticas['segundos']:.1f} s")
+    if not args.sin_escribir:
+        version = escribir_columnas(resultados, args.parquet, args.agregados)
+        print(f"{len(resultados)} canciones enriquecidas escritas en {args.parquet}. Versión {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Búsqueda local del clasificador de popularidad: validación cruzada de varios modelos y
+combinaciones de hiperparámetros repartida en un pool de procesos.
+
+La matriz de características se escala una vez y se comparte con los procesos en memoria
+compartida, así cada tarea sólo envía el modelo, sus parámetros y el número de pliegue. Cada
+pliegue ajustado se guarda en disco con una clave que depende de los datos, el modelo, los
+parámetros y el reparto de los pliegues, de forma que una búsqueda interrumpida o repetida sólo
+ajusta los que faltan. Al terminar se entrena el mejor candidato con todos los datos y se guarda
+como modelo local de la aplicación.
+
+Uso:
+    python entrenamiento.py
+    python entrenamiento.py --procesos 32 --pliegues 5 --objetivo 0.75
+    python entrenamiento.py --modelos regresion_logistica random_forest --sin-guardar
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import joblib
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.naive_bayes import GaussianNB
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+from datos import leer_datos
+from prediccion import COLUMNAS_MODELO, RUTA_MODELO, guardar_modelo, preparar_entrenamiento
+
+
+DIRECTORIO_PLIEGUES = "modelos/pliegues" # Caché de los pliegues ajustados
+RUTA_INFORME = "modelos/busqueda.json"
+NUMERO_PLIEGUES = 5
+SEMILLA = 15 # Semilla del reparto de los pliegues, la del train_test_split del notebook
+
+# Modelos del notebook con sus parámetros fijos
+MODELOS = {
+    "regresion_logistica": (LogisticRegression, {"max_iter": 1000}),
+    "knn": (KNeighborsClassifier, {"p": 2}),
+    "naive_bayes": (GaussianNB, {}),
+    "random_forest": (RandomForestClassifier, {"random_state": 357, "n_jobs": 1}),
+    "gradient_boosting": (GradientBoostingClassifier, {"random_state": 357, "validation_fraction": 0.1, "n_iter_no_change": 5, "tol": 0.01}),
+}
+
+# Hiperparámetros que se prueban de cada modelo, todas las combinaciones
+ESPACIO_BUSQUEDA = {
+    "naive_bayes": {},
+    "regresion_logistica": {"C": [0.1, 1, 10]},
+    "knn": {"n_neighbors": [10, 25, 50], "weights": ["distance", "uniform"]},
+    "gradient_boosting": {"learning_rate": [0.1, 0.3], "max_depth": [3, 5]},
+    "random_forest": {"n_estimators": [100, 200], "max_depth": [None, 16], "min_samples_leaf": [1, 5]},
+}
+
+
+def crear_modelo(nombre:str, parametros:dict):
+    """
+    Función para crear un modelo sin entrenar con sus parámetros fijos y los de la búsqueda.
+
+    Args:
+    - nombre (str): modelo de MODELOS
+    - parametros (dict): hiperparámetros del candidato
+
+    Returns:
+    - modelo: estimador de scikit-learn
+    """
+    clase, fijos = MODELOS[nombre]
+    return clase(**{**fijos, **parametros})
+
+
+def candidatos(espacio:dict=ESPACIO_BUSQUEDA)->list:
+    """
+    Función para obtener todas las combinaciones de modelo e hiperparámetros de un espacio de búsqueda.
+
+    Args:
+    - espacio (dict): parámetros a probar de cada modelo
+
+    Returns:
+    - candidatos (list): pares (modelo, parámetros)
+    """
+    return [(nombre, dict(parametros)) for nombre, rejilla in espacio.items() for parametros in ParameterGrid(rejilla)]
+
+
+def clave_pliegue(huella:str, nombre:str, parametros:dict, pliegue:int, numero_pliegues:int, semilla:int)->str:
+    """
+    Función para obtener la clave de un pliegue ajustado en la caché.
+
+    Args:
+    - huella (str): hash de los datos de entrenamiento
+    - nombre (str): modelo
+    - parametros (dict): hiperparámetros del candidato
+    - pliegue (int): número del pliegue
+    - numero_pliegues (int): pliegues de la validación cruzada
+    - semilla (int): semilla del reparto de los pliegues
+
+    Returns:
+    - clave (str): clave del pliegue
+    """
+    descripcion = json.dumps([huella, nombre, {**MODELOS[nombre][1], **parametros}, pliegue, numero_pliegues, semilla], sort_keys=True, default=str)
+    return hashlib.sha1(descripcion.encode("utf-8")).hexdigest()
+
+
+def repartir_pliegues(y:np.ndarray, numero_pliegues:int, semilla:int)->list:
+    """
+    Función para repartir las canciones en pliegues estratificados por clase.
+
+    Args:
+    - y (np.ndarray): clase de cada canción
+    - numero_pliegues (int): número de pliegues
+    - semilla (int): semilla del reparto
+
+    Returns:
+    - pliegues (list): pares (posiciones de entrenamiento, posiciones de validación)
+    """
+    return list(StratifiedKFold(numero_pliegues, shuffle=True, random_state=semilla).split(np.zeros(len(y)), y))
+
+
+def leer_pliegue(directorio:str, clave:str)->dict:
+    """
+    Función para leer un pliegue ajustado de la caché.
+
+    Args:
+    - directorio (str): carpeta de la caché
+    - clave (str): clave del pliegue
+
+    Returns:
+    - resultado (dict): exactitud y segundos del pliegue, None si no está
+    """
+    try:
+        with open(os.path.join(directorio, f"{clave}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ajustar_pliegue(X:np.ndarray, y:np.ndarray, pliegues:list, nombre:str, parametros:dict, pliegue:int,
+                    directorio:str=None, clave:str=None, guardar_modelos:bool=False)->dict:
+    """
+    Función para ajustar un candidato en un pliegue y medir su exactitud en la parte de validación.
+    Si se indica la carpeta de la caché, el resultado (y con guardar_modelos el modelo) se guarda
+    en ella en cuanto termina, para no perderlo si se interrumpe la búsqueda.
+
+    Args:
+    - X (np.ndarray): matriz de características escalada
+    - y (np.ndarray): código de la clase de cada canción
+    - pliegues (list): reparto de los pliegues
+    - nombre (str): modelo
+    - parametros (dict): hiperparámetros del candidato
+    - pliegue (int): número del pliegue
+    - directorio (str): carpeta de la caché, None para no guardar
+    - clave (str): clave del pliegue en la caché
+    - guardar_modelos (bool): guardar también el modelo ajustado
+
+    Returns:
+    - resultado (dict): modelo, parámetros, pliegue, exactitud y segundos de ajuste
+    """
+    entrenamiento, validacion = pliegues[pliegue]
+    modelo = crear_modelo(nombre, parametros)
+    inicio = time.perf_counter()
+    modelo.fit(X[entrenamiento], y[entrenamiento])
+    segundos = time.perf_counter() - inicio
+    resultado = {"modelo": nombre, "parametros": parametros, "pliegue": pliegue,
+                 "exactitud": float((modelo.predict(X[validacion]) == y[validacion]).mean()), "segundos": segundos}
+    if directorio is not None:
+        os.makedirs(directorio, exist_ok=True)
+        if guardar_modelos:
+            joblib.dump(modelo, os.path.join(directorio, f"{clave}.joblib"), compress=3)
+        # El JSON se escribe el último y con otro nombre, así sólo existe si el pliegue está completo
+        temporal = os.path.join(directorio, f"{clave}.{os.getpid()}.tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, default=str)
+        os.replace(temporal, os.path.join(directorio, f"{clave}.json"))
+    return resultado
+
+
+# Datos de cada proceso del pool: vistas de la memoria compartida y el reparto de los pliegues
+_datos_proceso = {}
+
+
+def _iniciar_proceso(nombre_X:str, forma:tuple, nombre_y:str, numero_pliegues:int, semilla:int)->None:
+    # Cada proceso usa un solo hilo de BLAS/OpenMP, el paralelismo lo da el pool
+    _datos_proceso["hilos"] = threadpool_limits(1)
+    memorias = (shared_memory.SharedMemory(name=nombre_X), shared_memory.SharedMemory(name=nombre_y))
+    X = np.ndarray(forma, dtype=np.float64, buffer=memorias[0].buf)
+    y = np.ndarray(forma[:1], dtype=np.int8, buffer=memorias[1].buf)
+    _datos_proceso.update(memorias=memorias, X=X, y=y, pliegues=repartir_pliegues(y, numero_pliegues, semilla))
+
+
+def _ajustar_en_proceso(nombre:str, parametros:dict, pliegue:int, directorio:str, clave:str, guardar_modelos:bool)->dict:
+    return ajustar_pliegue(_datos_proceso["X"], _datos_proceso["y"], _datos_proceso["pliegues"], nombre, parametros,
+                           pliegue, directorio, clave, guardar_modelos)
+
+
+def compartir(array:np.ndarray)->shared_memory.SharedMemory:
+    """
+    Función para copiar un array a un bloque de memoria compartida entre procesos.
+
+    Args:
+    - array (np.ndarray): array a compartir
+
+    Returns:
+    - memoria (SharedMemory): bloque con una copia del array, hay que cerrarlo y liberarlo al terminar
+    """
+    memoria = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=memoria.buf)[:] = array
+    return memoria
+
+
+def tiempo_hasta_exactitud(curva:list, objetivo:float)->float:
+    """
+    Función para obtener los segundos que tarda la búsqueda en encontrar un candidato con una exactitud.
+
+    Args:
+    - curva (list): mejor exactitud media encontrada a lo largo de la búsqueda
+    - objetivo (float): exactitud media a alcanzar
+
+    Returns:
+    - segundos (float): segundos desde el inicio de la búsqueda, None si no se alcanza
+    """
+    return next((punto["segundos"] for punto in curva if punto["exactitud"] >= objetivo), None)
+
+
+def buscar_modelo(X:np.ndarray, y:np.ndarray, espacio:dict=ESPACIO_BUSQUEDA, numero_pliegues:int=NUMERO_PLIEGUES,
+                  procesos:int=None, directorio:str=DIRECTORIO_PLIEGUES, guardar_modelos:bool=False, semilla:int=SEMILLA)->dict:
+    """
+    Función para buscar el mejor candidato por validación cruzada repartiendo los pliegues en un pool de procesos.
+
+    La matriz se escala una sola vez con todos los datos antes de repartir los pliegues. Los pliegues
+    que ya están en la caché no se vuelven a ajustar. Cada vez que un candidato completa todos sus
+    pliegues se apunta en la curva de tiempo hasta la exactitud la mejor exactitud media hasta ese momento.
+
+    Args:
+    - X (np.ndarray): matriz de características
+    - y (np.ndarray): clase de cada canción
+    - espacio (dict): parámetros a probar de cada modelo
+    - numero_pliegues (int): pliegues de la validación cruzada
+    - procesos (int): procesos del pool, todos los núcleos si es None y sin pool si es 1
+    - directorio (str): carpeta de la caché de pliegues, None para no usarla
+    - guardar_modelos (bool): guardar en la caché también los modelos ajustados
+    - semilla (int): semilla del reparto de los pliegues
+
+    Returns:
+    - busqueda (dict): "candidatos" ordenados de mejor a peor, "mejor", "curva", "segundos",
+      "pliegues_ajustados" y "pliegues_en_cache"
+    """
+    procesos = procesos or os.cpu_count() or 1
+    X = StandardScaler().fit_transform(np.asarray(X, dtype=np.float64))
+    clases, y = np.unique(y, return_inverse=True)
+    y = y.astype(np.int8)
+    huella = hashlib.sha1(X.tobytes() + y.tobytes() + ",".join(map(str, clases)).encode("utf-8")).hexdigest()
+
+    lista = candidatos(espacio)
+    resultados = {numero: {} for numero in range(len(lista))}
+    tareas = []
+    for numero, (nombre, parametros) in enumerate(lista):
+        for pliegue in range(numero_pliegues):
+            clave = clave_pliegue(huella, nombre, parametros, pliegue, numero_pliegues, semilla)
+            guardado = leer_pliegue(directorio, clave) if directorio is not None else None
+            if guardado is not None:
+                resultados[numero][pliegue] = guardado
+            else:
+                tareas.append((numero, nombre, parametros, pliegue, clave))
+    en_cache = sum(len(pliegues) for pliegues in resultados.values())
+
+    inicio = time.perf_counter()
+    curva = []
+
+    def apuntar(numero:int, resultado:dict)->None:
+        resultados[numero][resultado["pliegue"]] = resultado
+        if len(resultados[numero]) == numero_pliegues:
+            exactitud = float(np.mean([r["exactitud"] for r in resultados[numero].values()]))
+            if not curva or exactitud > curva[-1]["exactitud"]:
+                curva.append({"segundos": time.perf_counter() - inicio, "exactitud": exactitud,
+                              "modelo": lista[numero][0], "parametros": lista[numero][1]})
+
+    # Los candidatos que ya estaban completos en la caché cuentan desde el instante cero
+    for numero in resultados:
+        if len(resultados[numero]) == numero_pliegues:
+            apuntar(numero, resultados[numero][numero_pliegues - 1])
+
+    if procesos == 1 or len(tareas) <= 1:
+        pliegues = repartir_pliegues(y, numero_pliegues, semilla)
+        for numero, nombre, parametros, pliegue, clave in tareas:
+            apuntar(numero, ajustar_pliegue(X, y, pliegues, nombre, parametros, pliegue, directorio, clave, guardar_modelos))
+    elif tareas:
+        memorias = [compartir(X), compartir(y)]
+        try:
+            # Usamos spawn como en el resto de pools del proyecto; los procesos sólo reciben los nombres de la memoria compartida
+            with ProcessPoolExecutor(min(procesos, len(tareas)), mp_context=multiprocessing.get_context("spawn"), initializer=_iniciar_proceso,
+                                     initargs=(memorias[0].name, X.shape, memorias[1].name, numero_pliegues, semilla)) as executor:
+                futuros = {executor.submit(_ajustar_en_proceso, nombre, parametros, pliegue, directorio, clave, guardar_modelos): numero
+                           for numero, nombre, parametros, pliegue, clave in tareas}
+                for futuro in as_completed(futuros):
+                    apuntar(futuros[futuro], futuro.result())
+        finally:
+            for memoria in memorias:
+                memoria.close()
+                memoria.unlink()
+
+    resumen = []
+    for numero, (nombre, parametros) in enumerate(lista):
+        exactitudes = [resultados[numero][pliegue]["exactitud"] for pliegue in range(numero_pliegues)]
+        resumen.append({"modelo": nombre, "parametros": parametros, "exactitud": float(np.mean(exactitudes)),
+                        "desviacion": float(np.std(exactitudes)),
+                        "segundos_ajuste": float(sum(resultados[numero][pliegue]["segundos"] for pliegue in range(numero_pliegues)))})
+    resumen.sort(key=lambda candidato: -candidato["exactitud"])
+    return {"candidatos": resumen, "mejor": resumen[0], "curva": curva, "segundos": time.perf_counter() - inicio,
+            "pliegues_ajustados": len(tareas), "pliegues_en_cache": en_cache}
+
+
+def entrenar_mejor(X:np.ndarray, y:np.ndarray, mejor:dict):
+    """
+    Función para entrenar con todos los datos el mejor candidato de la búsqueda, junto con el
+    escalado, de forma que el modelo recibe las características sin escalar como el de la aplicación.
+
+    Args:
+    - X (np.ndarray): matriz de características sin escalar
+    - y (np.ndarray): clase de cada canción
+    - mejor (dict): candidato con "modelo" y "parametros"
+
+    Returns:
+    - modelo (Pipeline): escalado y modelo entrenados
+    """
+    modelo = make_pipeline(StandardScaler(), crear_modelo(mejor["modelo"], mejor["parametros"]))
+    return modelo.fit(X, y)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=None, help="procesos del pool, todos los núcleos por defecto")
+    parser.add_argument("--pliegues", type=int, default=NUMERO_PLIEGUES, help="pliegues de la validación cruzada")
+    parser.add_argument("--modelos", nargs="+", choices=list(ESPACIO_BUSQUEDA), default=list(ESPACIO_BUSQUEDA))
+    parser.add_argument("--muestras", type=int, default=41000, help="canciones de cada clase, como en el notebook")
+    parser.add_argument("--objetivo", type=float, help="exactitud para la que se informa del tiempo hasta alcanzarla")
+    parser.add_argument("--cache", default=DIRECTORIO_PLIEGUES, help="carpeta de la caché de pliegues")
+    parser.add_argument("--sin-cache", action="store_true", help="ajustar todos los pliegues sin leer ni guardar la caché")
+    parser.add_argument("--guardar-modelos", action="store_true", help="guardar en la caché también los modelos de cada pliegue")
+    parser.add_argument("--modelo", default=RUTA_MODELO, help="ruta donde se guarda el mejor modelo")
+    parser.add_argument("--informe", default=RUTA_INFORME, help="ruta donde se guarda el resultado de la búsqueda")
+    parser.add_argument("--sin-guardar", action="store_true", help="sólo buscar, sin entrenar ni guardar el mejor modelo")
+    args = parser.parse_args()
+
+    X, y = preparar_entrenamiento(leer_datos(COLUMNAS_MODELO + ["popularity"]), args.muestras)
+    busqueda = buscar_modelo(X, y, {nombre: ESPACIO_BUSQUEDA[nombre] for nombre in args.modelos}, args.pliegues,
+                             args.procesos, None if args.sin_cache else args.cache, args.guardar_modelos)
+
+    print(f"{len(busqueda['candidatos'])} candidatos, {busqueda['pliegues_ajustados']} pliegues ajustados y "
+          f"{busqueda['pliegues_en_cache']} de la caché en {busqueda['segundos']:.1f} s")
+    print(f"{'modelo':<22}{'exactitud':>10}{'desv.':>8}{'s ajuste':>10}  parámetros")
+    for candidato in busqueda["candidatos"]:
+        print(f"{candidato['modelo']:<22}{candidato['exactitud']:>10.4f}{candidato['desviacion']:>8.4f}{candidato['segundos_ajuste']:>10.1f}  {candidato['parametros']}")
+    print("Tiempo hasta la exactitud:")
+    for punto in busqueda["curva"]:
+        print(f"  {punto['segundos']:>8.1f} s  {punto['exactitud']:.4f}  {punto['modelo']} {punto['parametros']}")
+    if args.objetivo is not None:
+        segundos = tiempo_hasta_exactitud(busqueda["curva"], args.objetivo)
+        print(f"Exactitud {args.objetivo}: " + (f"alcanzada en {segundos:.1f} s" if segundos is not None else "no alcanzada"))
+
+    if not args.sin_guardar:
+        guardar_modelo(entrenar_mejor(X, y, busqueda["mejor"]), args.modelo)
+        os.makedirs(os.path.dirname(args.informe) or ".", exist_ok=True)
+        with open(args.informe, "w", encoding="utf-8") as f:
+            json.dump(busqueda, f, ensure_ascii=False, indent=1, default=str)
+        print(f"Mejor modelo ({busqueda['mejor']['modelo']}) guardado en {args.modelo} y búsqueda en {args.informe}")
+
+
+if __name__ == "__main__":
+    main()
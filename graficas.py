@@ -0,0 +1,435 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from agregados import ANCHURA_POPULARIDAD, ANCHURA_VOLUMEN, ANCHURA_TEMPO, RANGOS_DISTRIBUCION, INTERVALOS_DISTRIBUCION, INTERVALOS_TEMPO, INTERVALOS_BAILABILIDAD
+from datos import ESCALAS, MODOS
+from outliers import limites_desde_cuartiles
+
+
+# Columnas numéricas de la matriz de correlación de Spearman, las de df.corr(numeric_only=True) en el notebook
+COLUMNAS_SPEARMAN = ["popularity", "year", "danceability", "energy", "loudness", "speechiness", "acousticness",
+                     "instrumentalness", "liveness", "valence", "tempo", "duration_ms", "time_signature"]
+MAXIMO_FIGURAS = 128 # Figuras que se guardan en la caché de figuras
+
+
+def filtrar_agregado(tabla:pd.DataFrame, anios:tuple=None, generos:list=None, combinar:str="y")->pd.DataFrame:
+    """
+    Función para quedarse con las filas de una tabla de agregados de unos años y géneros.
+
+    Args:
+    - tabla (pd.Dataframe): tabla de agregados con las columnas year y genre
+    - anios (tuple): año mínimo y máximo, todos si es None
+    - generos (list): géneros a mostrar, todos si es None o está vacía
+    - combinar (str): "y" para que se cumplan los dos filtros, "o" para que se cumpla alguno
+
+    Returns:
+    - tabla (pd.Dataframe): tabla filtrada
+    """
+    condiciones = []
+    if anios:
+        condiciones.append(tabla['year'].between(*anios).to_numpy())
+    if generos:
+        condiciones.append(tabla['genre'].isin(generos).to_numpy())
+    if not condiciones:
+        return tabla
+    mascara = np.logical_and.reduce(condiciones) if combinar == "y" else np.logical_or.reduce(condiciones)
+    return tabla[mascara]
+
+
+def cuantiles_histograma(intervalos:np.ndarray, conteos:np.ndarray, anchura:float, cuantiles:list)->np.ndarray:
+    """
+    Función para aproximar cuantiles a partir de un histograma, interpolando dentro del intervalo.
+
+    Args:
+    - intervalos (np.ndarray): inicio de cada intervalo, ordenados
+    - conteos (np.ndarray): número de canciones de cada intervalo
+    - anchura (float): anchura de los intervalos
+    - cuantiles (list): cuantiles a calcular entre 0 y 1
+
+    Returns:
+    - valores (np.ndarray): valor aproximado de cada cuantil
+    """
+    acumulado = np.cumsum(conteos)
+    objetivos = np.asarray(cuantiles) * acumulado[-1]
+    posiciones = np.minimum(np.searchsorted(acumulado, objetivos), len(acumulado) - 1)
+    anteriores = np.where(posiciones > 0, acumulado[posiciones - 1], 0)
+    fraccion = (objetivos - anteriores) / np.maximum(conteos[posiciones], 1)
+    return intervalos[posiciones] + fraccion * anchura
+
+
+def sumar_intervalos(tabla:pd.DataFrame, columnas:list)->pd.DataFrame:
+    """
+    Función para sumar una tabla de agregados por las columnas indicadas.
+
+    Args:
+    - tabla (pd.Dataframe): tabla de agregados con columnas *_sum y song_count
+    - columnas (list): columnas por las que se agrupa
+
+    Returns:
+    - datos (pd.Dataframe): tabla agrupada y ordenada
+    """
+    sumas = [columna for columna in tabla.columns if columna.endswith('_sum') or columna == 'song_count']
+    return tabla.groupby(columnas, observed=True)[sumas].sum().reset_index()
+
+
+def figura_popularidad_generos(tabla:pd.DataFrame)->go.Figure:
+    """
+    Función para crear la gráfica de la popularidad media de cada género a lo largo de los años.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "genero_anio" de los agregados
+
+    Returns:
+    - fig (go.Figure): gráfica de barras animada por año
+    """
+    titulo = "Popularidad de los Géneros a lo largo de los años"
+    datos = sumar_intervalos(tabla, ['year', 'genre'])
+    if datos.empty:
+        return go.Figure(layout_title_text=titulo)
+    datos['popularity'] = datos['popularity_sum'] / datos['song_count']
+    datos['genre'] = datos['genre'].astype(str)
+    fig = px.bar(datos.sort_values('year'), x='genre', y='popularity', animation_frame='year', title=titulo
+                , labels={"popularity": "Popularidad", "genre": "", "year": "Año"}
+                , range_y=[0, datos['popularity'].max() * 1.05])
+    fig.update_layout(xaxis_tickfont_size=11)
+    fig.update_xaxes(categoryorder="total ascending", tickangle=-35, title_standoff=0) # Ajustamos las etiquetas y el título del eje x para que no se superpongan con el animation frame
+    fig.update_layout(yaxis_title='Media de Popularidad')
+    return fig
+
+
+def figura_media_por_popularidad(tabla:pd.DataFrame, columna:str, titulo:str, eje_y:str)->go.Figure:
+    """
+    Función para crear la gráfica de la media de una característica en base a la popularidad según el año.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "popularidad_anio" de los agregados
+    - columna (str): característica a promediar (energy o valence)
+    - titulo (str): título de la gráfica
+    - eje_y (str): título del eje y
+
+    Returns:
+    - fig (go.Figure): gráfica de barras animada por año
+    """
+    # La popularidad 100 se junta con el último intervalo para no salirse del eje
+    tabla = tabla.assign(popularity_bin=np.minimum(tabla['popularity_bin'], 100 - ANCHURA_POPULARIDAD))
+    datos = sumar_intervalos(tabla, ['year', 'popularity_bin'])
+    if datos.empty:
+        return go.Figure(layout_title_text=titulo)
+    datos[columna] = datos[f"{columna}_sum"] / datos['song_count']
+    datos['popularity'] = datos['popularity_bin'] + ANCHURA_POPULARIDAD / 2
+    fig = px.bar(datos.sort_values('year'), x='popularity', y=columna, title=titulo
+            , labels={"year": "Año"}
+            , animation_frame="year"
+            , range_y=[0, 1]
+            , range_x=[0, 100])
+    fig.update_layout(xaxis_title='Popularidad', yaxis_title=eje_y, bargap=0.05)
+    return fig
+
+
+def figura_volumen_energia(tabla:pd.DataFrame)->go.Figure:
+    """
+    Función para crear el histograma del volumen con la energía promedio y su diagrama de caja.
+    Los cuartiles del diagrama se aproximan a partir del histograma precalculado.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "volumen" de los agregados
+
+    Returns:
+    - fig (go.Figure): histograma con el diagrama de caja encima
+    """
+    titulo = 'Histograma del Volumen con la Energía Promedio'
+    datos = sumar_intervalos(tabla, ['loudness_bin'])
+    if datos.empty:
+        return go.Figure(layout_title_text=titulo)
+    intervalos = datos['loudness_bin'].to_numpy(dtype=np.float64)
+    conteos = datos['song_count'].to_numpy()
+    q1, mediana, q3 = cuantiles_histograma(intervalos, conteos, ANCHURA_VOLUMEN, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    minimo, maximo = intervalos[0], intervalos[-1] + ANCHURA_VOLUMEN
+    media = np.average(intervalos + ANCHURA_VOLUMEN / 2, weights=conteos)
+
+    # Juntamos los intervalos de dos en dos para que el histograma tenga unas 30 barras
+    anchura = 2 * ANCHURA_VOLUMEN
+    datos['intervalo'] = np.floor(datos['loudness_bin'] / anchura) * anchura
+    barras = sumar_intervalos(datos.drop(columns='loudness_bin'), ['intervalo'])
+    barras['energy'] = barras['energy_sum'] / barras['song_count']
+
+    color_map = {'Menor que cero': '#add8e6', 'Mayor o igual a cero': '#2874A6'} # Mapa de colores para los valores de loudness
+    barras['loudness_color'] = np.where(barras['intervalo'] < 0, 'Menor que cero', 'Mayor o igual a cero')
+
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.15, 0.85], vertical_spacing=0.02)
+    fig.add_trace(go.Box(y=["Boxplot"], q1=[q1], median=[mediana], q3=[q3], mean=[media]
+                        , lowerfence=[max(minimo, q1 - 1.5 * iqr)], upperfence=[min(maximo, q3 + 1.5 * iqr)]
+                        , orientation='h', marker_color="#148F77", name="Boxplot"), row=1, col=1)
+    for etiqueta, color in color_map.items():
+        barras_color = barras[barras['loudness_color'] == etiqueta]
+        fig.add_trace(go.Bar(x=barras_color['intervalo'] + anchura / 2, y=barras_color['energy'], width=anchura
+                            , marker_color=color, name=etiqueta
+                            , hovertemplate='Volumen: %{x}<br>Energía promedio: %{y:.2f}<extra></extra>'), row=2, col=1)
+    fig.update_layout(title=titulo, showlegend=False, bargap=0.05)
+    fig.update_xaxes(title_text='Volumen', row=2, col=1)
+    fig.update_yaxes(title_text='Energía', row=2, col=1)
+    fig.update_yaxes(showticklabels=False, row=1, col=1)
+    return fig
+
+
+def figura_tempo_bailabilidad(tabla:pd.DataFrame)->go.Figure:
+    """
+    Función para crear el histograma de la bailabilidad media en base al tempo. Los outliers
+    del tempo se quitan con el rango intercuartílico aproximado a partir del histograma.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "tempo" de los agregados
+
+    Returns:
+    - fig (go.Figure): histograma de la bailabilidad media
+    """
+    titulo = 'Bailabilidad en base al tempo de las canciones'
+    datos = sumar_intervalos(tabla, ['tempo_bin'])
+    if datos.empty:
+        return go.Figure(layout_title_text=titulo)
+    intervalos = datos['tempo_bin'].to_numpy(dtype=np.float64)
+    q1, q3 = cuantiles_histograma(intervalos, datos['song_count'].to_numpy(), ANCHURA_TEMPO, [0.25, 0.75])
+    inferior, superior = limites_desde_cuartiles(q1, q3)
+    centros = intervalos + ANCHURA_TEMPO / 2
+    datos = datos[(centros >= inferior) & (centros <= superior)]
+    datos = datos.assign(tempo=datos['tempo_bin'] + ANCHURA_TEMPO / 2, danceability=datos['danceability_sum'] / datos['song_count'])
+    fig = px.bar(datos, x='tempo', y='danceability', title=titulo
+            , hover_data={"song_count": True}
+            , labels={"danceability": "Bailabilidad", "tempo": "Tempo", "song_count": "Canciones"})
+    fig.update_layout(xaxis_title='Tempo', yaxis_title='Media Bailabilidad', bargap=0.05)
+    return fig
+
+
+def figura_distribuciones(tabla:pd.DataFrame)->go.Figure:
+    """
+    Función para crear los histogramas de las variables continuas a partir de sus agregados.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "distribuciones" de los agregados de figuras
+
+    Returns:
+    - fig (go.Figure): un histograma por variable en una rejilla de 5x2
+    """
+    datos = sumar_intervalos(tabla, ['variable', 'bin'])
+    fig = make_subplots(rows=5, cols=2, subplot_titles=[variable.capitalize() for variable in RANGOS_DISTRIBUCION],
+                        vertical_spacing=0.06, horizontal_spacing=0.06)
+    for numero, (variable, (minimo, maximo)) in enumerate(RANGOS_DISTRIBUCION.items()):
+        barras = datos[datos['variable'] == variable]
+        anchura = (maximo - minimo) / INTERVALOS_DISTRIBUCION
+        fig.add_trace(go.Bar(x=minimo + (barras['bin'] + 0.5) * anchura, y=barras['song_count'], width=anchura, name=variable.capitalize()
+                            , marker=dict(color="skyblue", line=dict(color="black", width=0.8))
+                            , hovertemplate='%{x:.2f}: %{y} canciones<extra></extra>'), row=numero // 2 + 1, col=numero % 2 + 1)
+    fig.update_layout(title='Distribución de las variables continuas', showlegend=False, height=1100, bargap=0)
+    return fig
+
+
+def indice_rangos(df:pd.DataFrame, columnas:list=COLUMNAS_SPEARMAN)->dict:
+    """
+    Función para ordenar una sola vez cada columna y guardar el rango denso (posición entre los
+    valores distintos) de cada canción. Con él los rangos de cualquier subconjunto de canciones
+    se obtienen contando, sin volver a ordenar.
+
+    Args:
+    - df (pd.Dataframe): dataframe con las columnas
+    - columnas (list): columnas de la correlación
+
+    Returns:
+    - indice (dict): "rangos" densos (int32), "distintos" de cada columna, filas "validas" (sin nulos) y "columnas"
+    """
+    X = df[columnas].to_numpy(dtype=np.float64)
+    validas = ~np.isnan(X).any(axis=1)
+    rangos = np.zeros(X.shape, dtype=np.int32)
+    distintos = []
+    for j in range(len(columnas)):
+        valores, rangos[validas, j] = np.unique(X[validas, j], return_inverse=True)
+        distintos.append(len(valores))
+    return {"rangos": rangos, "distintos": distintos, "validas": validas, "columnas": list(columnas)}
+
+
+def matriz_spearman(indice:dict, mascara:np.ndarray=None)->pd.DataFrame:
+    """
+    Función para calcular la matriz de correlación de Spearman de unas canciones con el índice de rangos.
+
+    Los rangos medios (con empates) de las canciones seleccionadas salen de contar cuántas hay con
+    cada rango denso, y la matriz es la correlación de Pearson de esos rangos, calculada para todas
+    las columnas a la vez. Como df.corr(method='spearman') cuando no hay nulos; las canciones con
+    algún nulo no se tienen en cuenta.
+
+    Args:
+    - indice (dict): índice de rangos
+    - mascara (np.ndarray): canciones seleccionadas, todas si es None
+
+    Returns:
+    - matriz (pd.Dataframe): correlación de Spearman entre las columnas
+    """
+    validas = indice["validas"] if mascara is None else indice["validas"] & mascara
+    densos = indice["rangos"][validas]
+    rangos = np.empty(densos.shape, dtype=np.float64)
+    for j, distintos in enumerate(indice["distintos"]):
+        conteos = np.bincount(densos[:, j], minlength=distintos)
+        rangos[:, j] = (np.cumsum(conteos) - (conteos - 1) / 2)[densos[:, j]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matriz = np.corrcoef(rangos, rowvar=False) if len(rangos) > 1 else np.full((len(indice["columnas"]),) * 2, np.nan)
+    return pd.DataFrame(matriz, index=indice["columnas"], columns=indice["columnas"])
+
+
+def figura_spearman(matriz:pd.DataFrame)->go.Figure:
+    """
+    Función para crear el mapa de calor de la correlación de Spearman.
+
+    Args:
+    - matriz (pd.Dataframe): matriz de correlación
+
+    Returns:
+    - fig (go.Figure): mapa de calor con el valor de cada par
+    """
+    fig = px.imshow(matriz.round(2), text_auto=".2f", color_continuous_scale='RdBu_r', zmin=-1, zmax=1, aspect="auto"
+                   , title='Mapa de calor de la Correlación de Spearman')
+    fig.update_layout(height=750)
+    return fig
+
+
+def figura_popularidad_modo(tabla:pd.DataFrame)->go.Figure:
+    """
+    Función para crear la gráfica de la popularidad media según el modo.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "modo_escala" de los agregados de figuras
+
+    Returns:
+    - fig (go.Figure): gráfica de barras
+    """
+    datos = sumar_intervalos(tabla, ['mode'])
+    datos = datos.assign(mode=datos['mode'].astype(str), popularity=datos['popularity_sum'] / datos['song_count'])
+    fig = px.bar(datos, x='mode', y='popularity', title='Media de la popularidad en base al modo'
+                , category_orders={"mode": MODOS})
+    fig.update_layout(xaxis_title='Modo', yaxis_title='Media de Popularidad')
+    fig.update_traces(hovertemplate='Modo: %{x}<br>Media de Popularidad: %{y:.2f}')
+    return fig
+
+
+def figura_popularidad_escala(tabla:pd.DataFrame)->go.Figure:
+    """
+    Función para crear la gráfica de la popularidad media según la escala.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "modo_escala" de los agregados de figuras
+
+    Returns:
+    - fig (go.Figure): gráfica de barras con un color por escala
+    """
+    datos = sumar_intervalos(tabla, ['key'])
+    datos = datos.assign(key=datos['key'].astype(str), popularity=datos['popularity_sum'] / datos['song_count'])
+    fig = px.bar(datos, x='key', y='popularity', title='Media de la popularidad en base a la escala de la canción'
+                , labels={"key": "Escala"}
+                , color="key"
+                , category_orders={"key": ESCALAS})
+    fig.update_layout(xaxis_title='Escala', yaxis_title='Media de Popularidad')
+    fig.update_traces(hovertemplate='Escala: %{x}<br>Media de Popularidad: %{y:.2f}')
+    return fig
+
+
+def figura_densidad_tempo(tabla:pd.DataFrame)->go.Figure:
+    """
+    Función para crear el histograma conjunto del tempo y la bailabilidad, con la media del tempo.
+
+    Args:
+    - tabla (pd.Dataframe): tabla "tempo_bailabilidad" de los agregados de figuras
+
+    Returns:
+    - fig (go.Figure): mapa de calor con el número de canciones de cada intervalo
+    """
+    titulo = "Distribución de Tempo y Bailabilidad"
+    datos = sumar_intervalos(tabla, ['tempo_bin', 'danceability_bin'])
+    if datos.empty:
+        return go.Figure(layout_title_text=titulo)
+    minimo, maximo = RANGOS_DISTRIBUCION['tempo']
+    anchura_tempo = (maximo - minimo) / INTERVALOS_TEMPO
+    conteos = np.zeros((INTERVALOS_BAILABILIDAD, INTERVALOS_TEMPO))
+    conteos[datos['danceability_bin'].to_numpy(), datos['tempo_bin'].to_numpy()] = datos['song_count'].to_numpy()
+    fig = go.Figure(go.Heatmap(x=minimo + (np.arange(INTERVALOS_TEMPO) + 0.5) * anchura_tempo,
+                               y=(np.arange(INTERVALOS_BAILABILIDAD) + 0.5) / INTERVALOS_BAILABILIDAD,
+                               z=np.where(conteos > 0, conteos, np.nan), colorscale='Blues', colorbar=dict(title='Canciones', len=0.75)
+                               , hovertemplate='Tempo: %{x:.0f}<br>Bailabilidad: %{y:.3f}<br>Canciones: %{z}<extra></extra>'))
+    fig.add_vline(x=datos['tempo_sum'].sum() / datos['song_count'].sum(), line_dash='dash', line_color='red', opacity=0.5
+                  , annotation_text='Media')
+    fig.update_layout(title=titulo, xaxis_title='Tempo', yaxis_title='Danceability')
+    return fig
+
+
+def clave_filtros(filtros:dict, combinar:str, columnas:tuple=None)->tuple:
+    """
+    Función para convertir los filtros en una clave de la caché de figuras, igual para los mismos filtros.
+
+    Args:
+    - filtros (dict): valores seleccionados de cada columna filtrada
+    - combinar (str): "y" o "o"
+    - columnas (tuple): columnas de los filtros que afectan a la figura, todas si es None
+
+    Returns:
+    - clave (tuple): filtros ordenados y forma de combinarlos
+    """
+    filtros = {columna: valor for columna, valor in filtros.items() if valor and (columnas is None or columna in columnas)}
+    return tuple((columna, tuple(valor) if isinstance(valor, tuple) else tuple(sorted(valor)))
+                 for columna, valor in sorted(filtros.items())), combinar if len(filtros) > 1 else "y"
+
+
+class CacheFiguras:
+    """
+    Caché LRU de figuras ya construidas, compartida entre sesiones. La clave incluye la versión
+    de los datos, así que las figuras de versiones anteriores dejan de usarse y se expulsan las
+    primeras al superar el máximo de entradas. Lleva la cuenta de aciertos y fallos.
+
+    Args:
+    - maximo_entradas (int): número máximo de figuras guardadas
+    """
+    def __init__(self, maximo_entradas:int=MAXIMO_FIGURAS):
+        self.maximo_entradas = maximo_entradas
+        self.figuras = OrderedDict()
+        self.bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave:tuple, construir)->tuple:
+        """
+        Función para obtener una figura de la caché o construirla y guardarla si no está.
+        Las figuras guardadas no se deben modificar.
+
+        Args:
+        - clave (tuple): versión de los datos, figura y parámetros
+        - construir (callable): función sin argumentos que construye la figura
+
+        Returns:
+        - fig (go.Figure): figura
+        - acierto (bool): si la figura estaba en la caché
+        """
+        with self.bloqueo:
+            if clave in self.figuras:
+                self.figuras.move_to_end(clave)
+                self.aciertos += 1
+                return self.figuras[clave], True
+        # Se construye fuera del bloqueo para no frenar a otras sesiones; si dos la construyen a la vez se queda una
+        fig = construir()
+        with self.bloqueo:
+            self.fallos += 1
+            self.figuras[clave] = fig
+            self.figuras.move_to_end(clave)
+            while len(self.figuras) > self.maximo_entradas:
+                self.figuras.popitem(last=False)
+        return fig, False
+
+    def estadisticas(self)->dict:
+        """
+        Función para obtener el uso de la caché.
+
+        Returns:
+        - estadisticas (dict): aciertos, fallos y figuras guardadas
+        """
+        with self.bloqueo:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self.figuras)}
@@ -0,0 +1,169 @@
+"""
+Ingesta incremental de una nueva descarga de datos de Spotify en el almacén limpio.
+
+Las canciones se identifican por su track_id: las nuevas se añaden, las que ya estaban con
+otros valores se sustituyen y las que no han cambiado se ignoran. El almacén se reescribe
+por grupos de filas sin volver a limpiar los datos anteriores, los agregados se actualizan
+sumando y restando sólo las canciones afectadas y se registra la nueva versión del contenido,
+con la que la aplicación invalida sus cachés.
+
+Uso:
+    python ingesta.py nuevas_canciones.csv
+"""
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datos import RUTA_PARQUET, registrar_version, version_datos
+from agregados import DIRECTORIO_AGREGADOS, FAMILIAS, actualizar_agregados, cargar_agregados, guardar_agregados
+from preprocesamiento import TAMANO_GRUPO_FILAS, COLUMNAS_MODA, calcular_modas, contar_compases, limpiar_bloque, tipar_bloque
+
+
+def filas_iguales(anteriores:pd.DataFrame, nuevas:pd.DataFrame)->np.ndarray:
+    """
+    Función para comparar fila a fila dos dataframes con las mismas columnas y el mismo orden.
+
+    Args:
+    - anteriores (pd.Dataframe): canciones con sus valores guardados
+    - nuevas (pd.Dataframe): las mismas canciones con sus valores nuevos
+
+    Returns:
+    - iguales (np.ndarray): True en las filas con todos los valores iguales (dos nulos cuentan como iguales)
+    """
+    iguales = np.ones(len(anteriores), dtype=bool)
+    for columna in nuevas.columns:
+        a = anteriores[columna].astype(object).to_numpy()
+        b = nuevas[columna].astype(object).to_numpy()
+        iguales &= (a == b) | (pd.isna(a) & pd.isna(b))
+    return iguales
+
+
+def primeras_apariciones(df:pd.DataFrame, vistos:np.ndarray)->tuple:
+    """
+    Función para encontrar los artistas que aparecen por primera vez en un bloque y el género
+    de su primera canción, marcándolos como vistos.
+
+    Args:
+    - df (pd.Dataframe): bloque con artist_name y genre categóricas
+    - vistos (np.ndarray): artistas (por código) que ya han aparecido en bloques anteriores
+
+    Returns:
+    - artistas (np.ndarray): códigos de los artistas nuevos, en orden de aparición
+    - generos (np.ndarray): códigos del género de su primera canción
+    """
+    codigos = df['artist_name'].cat.codes.to_numpy()
+    distintos, posiciones = np.unique(codigos, return_index=True)
+    nuevos = ~vistos[distintos]
+    distintos, posiciones = distintos[nuevos], posiciones[nuevos]
+    orden = np.argsort(posiciones)
+    vistos[distintos] = True
+    return distintos[orden], df['genre'].cat.codes.to_numpy()[posiciones[orden]]
+
+
+def ingerir(entrada:str, ruta_parquet:str=RUTA_PARQUET, directorio:str=DIRECTORIO_AGREGADOS)->dict:
+    """
+    Función para incorporar una descarga de datos originales (mismo formato que spotify_data.zip)
+    al almacén limpio y actualizar los agregados de forma incremental.
+
+    La moda del compás para las canciones con compás 0 se calcula con los compases del almacén
+    y de la descarga. El almacén se escribe con otro nombre y se renombra al terminar.
+
+    Args:
+    - entrada (str): CSV con las canciones nuevas o cambiadas
+    - ruta_parquet (str): almacén Parquet con los datos limpios
+    - directorio (str): carpeta donde se guardan los agregados
+
+    Returns:
+    - resumen (dict): canciones nuevas, cambiadas e iguales, y versiones anterior y nueva
+    """
+    version_anterior = version_datos(ruta_parquet)
+    agregados = {familia: cargar_agregados(version_anterior, directorio, familia, ruta_parquet) for familia in FAMILIAS}
+    almacen = pq.ParquetFile(ruta_parquet)
+
+    # Limpiamos la descarga con las modas del compás del almacén y de la propia descarga
+    delta = pd.read_csv(entrada).drop_duplicates("track_id", keep="last")
+    compases = pd.read_parquet(ruta_parquet, columns=COLUMNAS_MODA + ["time_signature"])
+    compases = compases.astype({"artist_name": object, "genre": object, "time_signature": "float64"})
+    conteos, categorias = contar_compases([compases, delta[COLUMNAS_MODA + ["time_signature"]].astype({"time_signature": "float64"})])
+    delta = tipar_bloque(limpiar_bloque(delta, calcular_modas(conteos)), categorias)
+    tipos = {columna: pd.CategoricalDtype(valores) for columna, valores in categorias.items()}
+    delta = delta.set_index("track_id", drop=False)
+
+    vistos = np.zeros(len(tipos["artist_name"].categories), dtype=bool)
+    primeros_artistas, primeros_generos = [], []
+    quitadas, iguales = [], set()
+    # Escribimos con el esquema del almacén, así también funciona si no tiene filas
+    esquema = almacen.schema_arrow
+    temporal = ruta_parquet + ".tmp"
+    escritor = pq.ParquetWriter(temporal, esquema)
+    try:
+        for lote in almacen.iter_batches(batch_size=TAMANO_GRUPO_FILAS):
+            df = tipar_bloque(lote.to_pandas(), categorias)
+            afectadas = df["track_id"].isin(delta.index).to_numpy()
+            if afectadas.any():
+                anteriores = df[afectadas]
+                sin_cambios = filas_iguales(anteriores, delta.loc[anteriores["track_id"]])
+                iguales.update(anteriores["track_id"][sin_cambios])
+                # Las canciones cambiadas se quitan de su sitio y se escriben al final con los valores nuevos
+                quitadas.append(anteriores[~sin_cambios])
+                conservar = ~afectadas
+                conservar[np.flatnonzero(afectadas)[sin_cambios]] = True
+                df = df[conservar]
+            artistas, generos = primeras_apariciones(df, vistos)
+            primeros_artistas.append(artistas)
+            primeros_generos.append(generos)
+            escritor.write_table(pa.Table.from_pandas(df, schema=esquema, preserve_index=False), row_group_size=TAMANO_GRUPO_FILAS)
+
+        nuevas = delta[~delta.index.isin(list(iguales))].reset_index(drop=True)
+        quitadas = pd.concat(quitadas, ignore_index=True) if quitadas else nuevas.iloc[:0]
+        if nuevas.empty:
+            escritor.close()
+            escritor = None
+            os.remove(temporal)
+            return {"nuevas": 0, "cambiadas": 0, "iguales": len(iguales), "version_anterior": version_anterior, "version": version_anterior}
+        artistas, generos = primeras_apariciones(nuevas, vistos)
+        primeros_artistas.append(artistas)
+        primeros_generos.append(generos)
+        # Las columnas que no vienen en la descarga, como las de enriquecimiento.py, quedan nulas
+        escritor.write_table(pa.Table.from_pandas(nuevas.reindex(columns=esquema.names), schema=esquema, preserve_index=False),
+                             row_group_size=TAMANO_GRUPO_FILAS)
+    except BaseException:
+        # No dejamos el almacén temporal a medias
+        escritor.close()
+        escritor = None
+        os.remove(temporal)
+        raise
+    finally:
+        if escritor is not None:
+            escritor.close()
+    os.replace(temporal, ruta_parquet)
+    version = registrar_version(ruta_parquet, anterior=version_anterior)
+
+    primeros = pd.DataFrame({
+        "artist_name": pd.Categorical.from_codes(np.concatenate(primeros_artistas), dtype=tipos["artist_name"]),
+        "genre": pd.Categorical.from_codes(np.concatenate(primeros_generos), dtype=tipos["genre"]),
+    })
+    for familia, tablas in agregados.items():
+        columnas = list(FAMILIAS[familia][1])
+        guardar_agregados(actualizar_agregados(tablas, nuevas[columnas], quitadas[columnas], familia, tipos, primeros), version, directorio)
+    return {"nuevas": len(nuevas) - len(quitadas), "cambiadas": len(quitadas), "iguales": len(iguales),
+            "version_anterior": version_anterior, "version": version}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entrada", help="CSV con las canciones nuevas o cambiadas, en el formato original")
+    parser.add_argument("--parquet", default=RUTA_PARQUET, help="almacén Parquet a actualizar")
+    parser.add_argument("--agregados", default=DIRECTORIO_AGREGADOS, help="carpeta de los agregados")
+    args = parser.parse_args()
+    resumen = ingerir(args.entrada, args.parquet, args.agregados)
+    print(f"{resumen['nuevas']} canciones nuevas, {resumen['cambiadas']} cambiadas y {resumen['iguales']} sin cambios. "
+          f"Versión {resumen['version_anterior']} -> {resumen['version']}")
+
+
+if __name__ == "__main__":
+    main()
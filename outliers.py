@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+
+FACTOR_IQR = 1.5 # Veces el rango intercuartílico que se admite por debajo de Q1 y por encima de Q3
+TAMANO_MUESTRA = 100_000 # Filas que guarda la muestra para aproximar los cuartiles
+
+
+def limites_desde_cuartiles(q1, q3, factor:float=FACTOR_IQR)->tuple:
+    """
+    Función para obtener los límites inferior y superior a partir de los cuartiles.
+
+    Args:
+    - q1: primer cuartil, un número o un array con uno por columna
+    - q3: tercer cuartil, un número o un array con uno por columna
+    - factor (float): veces el rango intercuartílico que se admite fuera de los cuartiles
+
+    Returns:
+    - limites (tuple): límite inferior y límite superior
+    """
+    iqr = q3 - q1
+    return q1 - factor * iqr, q3 + factor * iqr
+
+
+def limites_iqr(df:pd.DataFrame, columnas:list, factor:float=FACTOR_IQR)->dict:
+    """
+    Función para calcular los límites del rango intercuartílico de varias columnas en una sola pasada.
+
+    Args:
+    - df (pd.Dataframe): dataframe con las columnas
+    - columnas (list): columnas de las que se calculan los límites
+    - factor (float): veces el rango intercuartílico que se admite fuera de los cuartiles
+
+    Returns:
+    - limites (dict): límite inferior y superior de cada columna
+    """
+    q1, q3 = np.nanquantile(df[columnas].to_numpy(dtype=np.float64), [0.25, 0.75], axis=0)
+    inferiores, superiores = limites_desde_cuartiles(q1, q3, factor)
+    return {columna: (float(inferior), float(superior)) for columna, inferior, superior in zip(columnas, inferiores, superiores)}
+
+
+def mascara_limites(df:pd.DataFrame, limites:dict)->np.ndarray:
+    """
+    Función para obtener qué filas están dentro de los límites de todas las columnas, combinando
+    las condiciones sobre un único array sin copiar el dataframe.
+
+    Args:
+    - df (pd.Dataframe): dataframe a filtrar
+    - limites (dict): límite inferior y superior de cada columna
+
+    Returns:
+    - mascara (np.ndarray): True en las filas que no son outliers
+    """
+    mascara = np.ones(len(df), dtype=bool)
+    for columna, (inferior, superior) in limites.items():
+        valores = df[columna].to_numpy()
+        mascara &= valores >= inferior
+        mascara &= valores <= superior
+    return mascara
+
+
+def filtrar_outliers(df:pd.DataFrame, columnas:list, limites:dict=None, factor:float=FACTOR_IQR, secuencial:bool=False)->tuple:
+    """
+    Función para eliminar los outliers de un dataframe usando el rango intercuartílico.
+
+    Por defecto los cuartiles de todas las columnas se calculan a la vez sobre el dataframe completo.
+    Con secuencial=True cada columna se mide sobre las filas que quedan tras filtrar las anteriores,
+    como hacía la versión original de clean_outliers, pero sin copiar el dataframe en cada paso.
+
+    Args:
+    - df (pd.Dataframe): dataframe a limpiar
+    - columnas (list): columnas a limpiar
+    - limites (dict): límites ya calculados (guardados o aproximados), si es None se calculan
+    - factor (float): veces el rango intercuartílico que se admite fuera de los cuartiles
+    - secuencial (bool): calcular los límites de cada columna tras filtrar las anteriores
+
+    Returns:
+    - df (pd.Dataframe): dataframe sin outliers
+    - limites (dict): límite inferior y superior usado en cada columna
+    """
+    if limites is None and secuencial:
+        limites = {}
+        mascara = np.ones(len(df), dtype=bool)
+        for columna in columnas:
+            valores = df[columna].to_numpy(dtype=np.float64)
+            q1, q3 = np.nanquantile(valores[mascara], [0.25, 0.75])
+            inferior, superior = limites_desde_cuartiles(q1, q3, factor)
+            limites[columna] = (float(inferior), float(superior))
+            mascara &= (valores >= inferior) & (valores <= superior)
+        return df[mascara], limites
+    if limites is None:
+        limites = limites_iqr(df, columnas, factor)
+    return df[mascara_limites(df, limites)], limites
+
+
+def clean_outliers(df_aux:pd.DataFrame, columns:list, secuencial:bool=False)->pd.DataFrame:
+    """
+    Función para eliminar los outliers de un dataframe usando el rango intercuartílico.
+
+    Args:
+    - df_aux (pd.Dataframe): dataframe a limpiar
+    - columns (list): lista de columnas a limpiar
+    - secuencial (bool): calcular los límites de cada columna tras filtrar las anteriores
+
+    Returns:
+    - df_aux (pd.Dataframe): dataframe sin outliers
+    """
+    return filtrar_outliers(df_aux, columns, secuencial=secuencial)[0]
+
+
+class MuestraCuantiles:
+    """
+    Muestra uniforme de tamaño fijo (bottom-k: se quedan las filas con menor prioridad aleatoria)
+    para aproximar los cuartiles de datos que no caben en memoria. Se actualiza por bloques y dos
+    muestras de partes distintas de los datos se pueden fusionar.
+
+    Args:
+    - columnas (list): columnas de las que se guardan valores
+    - tamano (int): número máximo de filas de la muestra
+    - semilla (int): semilla del generador de prioridades
+    """
+    def __init__(self, columnas:list, tamano:int=TAMANO_MUESTRA, semilla:int=0):
+        self.columnas = list(columnas)
+        self.tamano = tamano
+        self.rng = np.random.default_rng(semilla)
+        self.prioridades = np.empty(0, dtype=np.float64)
+        self.valores = np.empty((0, len(self.columnas)), dtype=np.float64)
+        self.filas = 0
+
+    def _anadir(self, prioridades:np.ndarray, valores:np.ndarray)->None:
+        # Solo pueden entrar las filas con menor prioridad que la mayor de una muestra llena
+        if len(self.prioridades) >= self.tamano:
+            nuevas = prioridades < self.prioridades.max()
+            prioridades, valores = prioridades[nuevas], valores[nuevas]
+        prioridades = np.concatenate([self.prioridades, prioridades])
+        valores = np.concatenate([self.valores, valores])
+        if len(prioridades) > self.tamano:
+            seleccion = np.argpartition(prioridades, self.tamano - 1)[:self.tamano]
+            prioridades, valores = prioridades[seleccion], valores[seleccion]
+        self.prioridades, self.valores = prioridades, valores
+
+    def actualizar(self, df:pd.DataFrame)->"MuestraCuantiles":
+        """
+        Función para añadir un bloque de filas a la muestra.
+
+        Args:
+        - df (pd.Dataframe): bloque con las columnas de la muestra
+
+        Returns:
+        - muestra (MuestraCuantiles): la propia muestra
+        """
+        self._anadir(self.rng.random(len(df)), df[self.columnas].to_numpy(dtype=np.float64))
+        self.filas += len(df)
+        return self
+
+    def fusionar(self, otra:"MuestraCuantiles")->"MuestraCuantiles":
+        """
+        Función para añadir a la muestra otra muestra de las mismas columnas.
+
+        Args:
+        - otra (MuestraCuantiles): muestra de otra parte de los datos
+
+        Returns:
+        - muestra (MuestraCuantiles): la propia muestra
+        """
+        self._anadir(otra.prioridades, otra.valores)
+        self.filas += otra.filas
+        return self
+
+    def limites(self, factor:float=FACTOR_IQR)->dict:
+        """
+        Función para calcular los límites del rango intercuartílico aproximado de cada columna.
+
+        Args:
+        - factor (float): veces el rango intercuartílico que se admite fuera de los cuartiles
+
+        Returns:
+        - limites (dict): límite inferior y superior de cada columna
+        """
+        return limites_iqr(pd.DataFrame(self.valores, columns=self.columnas), self.columnas, factor)
@@ -0,0 +1,416 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+
+
+SERVICIO = "spotify-analytics" # Nombre del servicio en las trazas y prefijo de las métricas
+URL_OTLP = "http://localhost:4318/v1/traces" # Endpoint OTLP/HTTP de un colector local
+PREFIJO_METRICAS = "spotify_app"
+
+
+class Tramo:
+    """
+    Intervalo de tiempo medido dentro de un perfil, con sus atributos y el tramo que lo contiene.
+
+    Args:
+    - nombre (str): etapa que se mide
+    - padre (Tramo): tramo que lo contiene, None si es de primer nivel
+    - atributos (dict): datos de la etapa (función, figura, acierto o fallo de caché...)
+    """
+    def __init__(self, nombre:str, padre:"Tramo"=None, atributos:dict=None):
+        self.nombre = nombre
+        self.padre = padre
+        self.atributos = dict(atributos or {})
+        self.id = os.urandom(8).hex()
+        self.inicio_ns = time.time_ns()
+        self.inicio = time.perf_counter()
+        self.duracion = None
+
+    @property
+    def nivel(self)->int:
+        return 0 if self.padre is None else self.padre.nivel + 1
+
+
+class Perfil:
+    """
+    Tramos y contadores de una ejecución (un rerun de la aplicación o un script).
+
+    Args:
+    - nombre (str): nombre de la ejecución, por ejemplo la sección de la aplicación
+    """
+    def __init__(self, nombre:str):
+        self.nombre = nombre
+        self.traza = os.urandom(16).hex()
+        self.inicio_ns = time.time_ns()
+        self.inicio = time.perf_counter()
+        self.duracion = None
+        self.tramos = []
+        self.contadores = {}
+        self.pila = []
+
+    @contextmanager
+    def tramo(self, nombre:str, **atributos):
+        """
+        Función para medir el tiempo de un bloque de código como un tramo del perfil.
+
+        Args:
+        - nombre (str): etapa que se mide
+        - atributos: datos de la etapa
+
+        Yields:
+        - tramo (Tramo): tramo abierto, se le pueden añadir atributos
+        """
+        tramo = Tramo(nombre, self.pila[-1] if self.pila else None, atributos)
+        self.tramos.append(tramo)
+        self.pila.append(tramo)
+        try:
+            yield tramo
+        finally:
+            tramo.duracion = time.perf_counter() - tramo.inicio
+            self.pila.pop()
+
+    def contar(self, nombre:str, valor:float=1, etiqueta:str="")->None:
+        """
+        Función para sumar a un contador del perfil.
+
+        Args:
+        - nombre (str): nombre del contador
+        - valor (float): cantidad a sumar
+        - etiqueta (str): objeto al que se refiere (función, figura, imagen...)
+        """
+        self.contadores[(nombre, etiqueta)] = self.contadores.get((nombre, etiqueta), 0) + valor
+
+    def terminar(self)->"Perfil":
+        """
+        Función para cerrar el perfil y guardar su duración total.
+
+        Returns:
+        - perfil (Perfil): el propio perfil
+        """
+        self.duracion = time.perf_counter() - self.inicio
+        return self
+
+    def resumen(self)->list:
+        """
+        Función para obtener los tramos del perfil en orden, con su duración y porcentaje del total.
+
+        Returns:
+        - filas (list): un diccionario por tramo
+        """
+        total = self.duracion or (time.perf_counter() - self.inicio)
+        return [{
+            "tramo": "  " * tramo.nivel + tramo.nombre,
+            "ms": round((tramo.duracion or 0) * 1000, 3),
+            "% del rerun": round(100 * (tramo.duracion or 0) / total, 1) if total else 0.0,
+            "atributos": ", ".join(f"{clave}={valor}" for clave, valor in tramo.atributos.items()),
+        } for tramo in self.tramos]
+
+
+_perfil_actual = ContextVar("perfil_actual", default=None)
+
+
+def iniciar_perfil(nombre:str)->Perfil:
+    """
+    Función para empezar el perfil de una ejecución en el hilo actual. Los tramos y contadores
+    que se registren a continuación en este hilo se guardan en él.
+
+    Args:
+    - nombre (str): nombre de la ejecución
+
+    Returns:
+    - perfil (Perfil): perfil nuevo
+    """
+    perfil = Perfil(nombre)
+    _perfil_actual.set(perfil)
+    return perfil
+
+
+@contextmanager
+def tramo(nombre:str, **atributos):
+    """
+    Función para medir un bloque de código en el perfil actual. Sin perfil no mide nada.
+
+    Args:
+    - nombre (str): etapa que se mide
+    - atributos: datos de la etapa
+
+    Yields:
+    - tramo (Tramo): tramo abierto, o None si no hay perfil
+    """
+    perfil = _perfil_actual.get()
+    if perfil is None:
+        yield None
+        return
+    with perfil.tramo(nombre, **atributos) as abierto:
+        yield abierto
+
+
+def contar(nombre:str, valor:float=1, etiqueta:str="")->None:
+    """
+    Función para sumar a un contador del perfil actual.
+
+    Args:
+    - nombre (str): nombre del contador
+    - valor (float): cantidad a sumar
+    - etiqueta (str): objeto al que se refiere
+    """
+    perfil = _perfil_actual.get()
+    if perfil is not None:
+        perfil.contar(nombre, valor, etiqueta)
+
+
+def marcar(**atributos)->None:
+    """
+    Función para añadir atributos al tramo abierto más interno del perfil actual.
+
+    Args:
+    - atributos: datos a añadir
+    """
+    perfil = _perfil_actual.get()
+    if perfil is not None and perfil.pila:
+        perfil.pila[-1].atributos.update(atributos)
+
+
+def medir_cache(nombre:str):
+    """
+    Decorador para medir una función cacheada (st.cache_resource, st.cache_data...): el tramo
+    incluye el hash de los argumentos y la búsqueda en la caché, y cuenta aciertos y fallos.
+    La función cacheada tiene que llamar a marcar(cache="fallo") cuando se ejecuta.
+
+    Args:
+    - nombre (str): nombre de la caché en los tramos y contadores
+
+    Returns:
+    - decorador (callable): decorador de la función cacheada
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with tramo("cache", funcion=nombre) as abierto:
+                resultado = funcion(*args, **kwargs)
+                if abierto is not None:
+                    abierto.atributos.setdefault("cache", "acierto")
+                    contar(f"cache_{abierto.atributos['cache']}s", etiqueta=nombre)
+            return resultado
+        return envoltura
+    return decorador
+
+
+class RegistroMetricas:
+    """
+    Acumulado de los perfiles terminados en el proceso, para exponerlo como métricas.
+    Por cada tramo guarda el número de veces, la suma y el máximo de su duración, y por
+    cada contador su total.
+    """
+    def __init__(self):
+        self.bloqueo = threading.Lock()
+        self.tramos = {}
+        self.contadores = {}
+        self.perfiles = {}
+
+    def registrar(self, perfil:Perfil)->None:
+        """
+        Función para añadir un perfil terminado al acumulado.
+
+        Args:
+        - perfil (Perfil): perfil terminado
+        """
+        with self.bloqueo:
+            self.perfiles[perfil.nombre] = self.perfiles.get(perfil.nombre, 0) + 1
+            for medido in [("rerun", perfil.nombre, perfil.duracion)] + [(t.nombre, perfil.nombre, t.duracion) for t in perfil.tramos]:
+                veces, suma, maximo = self.tramos.get(medido[:2], (0, 0.0, 0.0))
+                self.tramos[medido[:2]] = (veces + 1, suma + medido[2], max(maximo, medido[2]))
+            for clave, valor in perfil.contadores.items():
+                self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def prometheus(self)->str:
+        """
+        Función para exportar el acumulado en el formato de texto de Prometheus.
+
+        Returns:
+        - texto (str): métricas en formato de exposición de Prometheus
+        """
+        lineas = [f"# TYPE {PREFIJO_METRICAS}_tramo_segundos summary"]
+        # El máximo no es una muestra válida de un summary, así que va en su propia familia
+        maximos = [f"# TYPE {PREFIJO_METRICAS}_tramo_segundos_max gauge"]
+        with self.bloqueo:
+            for (nombre, perfil), (veces, suma, maximo) in sorted(self.tramos.items()):
+                etiquetas = f'tramo="{nombre}",perfil="{perfil}"'
+                lineas.append(f"{PREFIJO_METRICAS}_tramo_segundos_count{{{etiquetas}}} {veces}")
+                lineas.append(f"{PREFIJO_METRICAS}_tramo_segundos_sum{{{etiquetas}}} {suma:.6f}")
+                maximos.append(f"{PREFIJO_METRICAS}_tramo_segundos_max{{{etiquetas}}} {maximo:.6f}")
+            lineas += maximos
+            for nombre in sorted({nombre for nombre, _ in self.contadores}):
+                lineas.append(f"# TYPE {PREFIJO_METRICAS}_{nombre}_total counter")
+                for (contador, etiqueta), valor in sorted(self.contadores.items()):
+                    if contador == nombre:
+                        lineas.append(f'{PREFIJO_METRICAS}_{nombre}_total{{etiqueta="{etiqueta}"}} {valor}')
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = RegistroMetricas()
+
+
+def terminar_perfil(perfil:Perfil, registro:RegistroMetricas=REGISTRO)->Perfil:
+    """
+    Función para cerrar un perfil y añadirlo a las métricas del proceso.
+
+    Args:
+    - perfil (Perfil): perfil a cerrar
+    - registro (RegistroMetricas): acumulado de métricas
+
+    Returns:
+    - perfil (Perfil): perfil cerrado
+    """
+    registro.registrar(perfil.terminar())
+    return perfil
+
+
+def exportar_json(perfil:Perfil)->str:
+    """
+    Función para exportar un perfil en JSON.
+
+    Args:
+    - perfil (Perfil): perfil a exportar
+
+    Returns:
+    - texto (str): perfil en JSON con sus tramos y contadores
+    """
+    return json.dumps({
+        "perfil": perfil.nombre,
+        "traza": perfil.traza,
+        "inicio_ns": perfil.inicio_ns,
+        "duracion_s": perfil.duracion,
+        "tramos": [{"id": t.id, "padre": t.padre.id if t.padre else None, "nombre": t.nombre, "inicio_ns": t.inicio_ns,
+                    "duracion_s": t.duracion, "atributos": t.atributos} for t in perfil.tramos],
+        "contadores": [{"nombre": nombre, "etiqueta": etiqueta, "valor": valor} for (nombre, etiqueta), valor in perfil.contadores.items()],
+    }, ensure_ascii=False, indent=1, default=str)
+
+
+def _atributos_otlp(atributos:dict)->list:
+    return [{"key": clave, "value": {"stringValue": str(valor)}} for clave, valor in atributos.items()]
+
+
+def peticion_otlp(perfil:Perfil, servicio:str=SERVICIO)->dict:
+    """
+    Función para construir la petición OTLP/HTTP en JSON con los tramos de un perfil. El rerun
+    completo es el tramo raíz y los tramos de primer nivel cuelgan de él.
+
+    Args:
+    - perfil (Perfil): perfil terminado
+    - servicio (str): nombre del servicio
+
+    Returns:
+    - peticion (dict): cuerpo de la petición a /v1/traces
+    """
+    raiz = os.urandom(8).hex()
+    spans = [{"traceId": perfil.traza, "spanId": raiz, "name": perfil.nombre, "kind": 1,
+              "startTimeUnixNano": str(perfil.inicio_ns),
+              "endTimeUnixNano": str(perfil.inicio_ns + int((perfil.duracion or 0) * 1e9)), "attributes": []}]
+    for t in perfil.tramos:
+        spans.append({"traceId": perfil.traza, "spanId": t.id, "parentSpanId": t.padre.id if t.padre else raiz,
+                      "name": t.nombre, "kind": 1, "startTimeUnixNano": str(t.inicio_ns),
+                      "endTimeUnixNano": str(t.inicio_ns + int((t.duracion or 0) * 1e9)),
+                      "attributes": _atributos_otlp(t.atributos)})
+    contadores = {f"{nombre}[{etiqueta}]" if etiqueta else nombre: valor for (nombre, etiqueta), valor in perfil.contadores.items()}
+    spans[0]["attributes"] = _atributos_otlp(contadores)
+    return {"resourceSpans": [{
+        "resource": {"attributes": _atributos_otlp({"service.name": servicio})},
+        "scopeSpans": [{"scope": {"name": "perfilado"}, "spans": spans}],
+    }]}
+
+
+_pool_otlp = urllib3.PoolManager(maxsize=2)
+
+
+def enviar_otlp(perfil:Perfil, url:str=URL_OTLP, timeout:float=2)->None:
+    """
+    Función para enviar los tramos de un perfil a un colector OTLP/HTTP (por ejemplo el de OpenTelemetry).
+
+    Args:
+    - perfil (Perfil): perfil terminado
+    - url (str): endpoint /v1/traces del colector
+    - timeout (float): segundos máximos de espera
+
+    Raises:
+    - urllib3.exceptions.HTTPError: si no se puede conectar con el colector
+    """
+    _pool_otlp.request("POST", url, body=json.dumps(peticion_otlp(perfil)).encode("utf-8"),
+                       headers={"Content-Type": "application/json"}, timeout=timeout, retries=False)
+
+
+def enviar_otlp_en_segundo_plano(perfil:Perfil, url:str=URL_OTLP, timeout:float=2)->threading.Thread:
+    """
+    Función para enviar los tramos de un perfil a un colector OTLP/HTTP sin esperar la respuesta.
+    Si el colector no responde sólo se imprime el error.
+
+    Args:
+    - perfil (Perfil): perfil terminado
+    - url (str): endpoint /v1/traces del colector
+    - timeout (float): segundos máximos de espera
+
+    Returns:
+    - hilo (threading.Thread): hilo que hace el envío
+    """
+    def enviar():
+        try:
+            enviar_otlp(perfil, url, timeout)
+        except urllib3.exceptions.HTTPError as error:
+            print(error)
+    hilo = threading.Thread(target=enviar, daemon=True)
+    hilo.start()
+    return hilo
+
+
+_servidores = {}
+_bloqueo_servidores = threading.Lock()
+
+
+def servir_prometheus(puerto:int, registro:RegistroMetricas=REGISTRO, host:str="127.0.0.1")->ThreadingHTTPServer:
+    """
+    Función para exponer las métricas en http://host:puerto/metrics en un hilo en segundo plano.
+    Si ya hay un servidor en ese puerto se reutiliza. Si el puerto está ocupado por otro
+    proceso se avisa una sola vez y no se vuelve a intentar.
+
+    Args:
+    - puerto (int): puerto del servidor
+    - registro (RegistroMetricas): acumulado de métricas
+    - host (str): dirección en la que escucha
+
+    Returns:
+    - servidor (ThreadingHTTPServer): servidor de métricas, None si no se ha podido abrir el puerto
+    """
+
+    class Metricas(BaseHTTPRequestHandler):
+        def do_GET(self):
+            encontrado = self.path.startswith("/metrics")
+            cuerpo = registro.prometheus().encode("utf-8") if encontrado else b""
+            self.send_response(200 if encontrado else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    # Varias sesiones pueden terminar su primer rerun a la vez
+    with _bloqueo_servidores:
+        if puerto in _servidores:
+            return _servidores[puerto]
+        try:
+            servidor = ThreadingHTTPServer((host, puerto), Metricas)
+        except OSError as error:
+            print(f"No se exponen las métricas de Prometheus en el puerto {puerto}: {error}")
+            servidor = None
+        else:
+            threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        _servidores[puerto] = servidor
+    return servidor
@@ -0,0 +1,361 @@
+import os
+import json
+import argparse
+import tomllib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+import pandas as pd
+import urllib3
+from sklearn.ensemble import GradientBoostingClassifier
+
+from datos import COLUMNAS_MODELO, leer_datos
+
+
+RUTA_MODELO = "modelos/modelo_popularidad.joblib"
+DESPLIEGUE_AZURE = "spotifyfinal40-1"
+COLUMNA_PREDICCION = "popularity_class"
+TAMANO_BLOQUE = 50_000 # Canciones que se leen del fichero en cada bloque
+FILAS_POR_PETICION = 5_000 # Canciones por petición al endpoint de Azure
+
+
+class ErrorPrediccion(Exception):
+    """
+    Error devuelto por el endpoint de predicción.
+    """
+
+
+def popularidad_objetivo(popularidad)->np.ndarray:
+    """
+    Función para pasar la popularidad a las dos clases del modelo (popularity2 del notebook).
+
+    Args:
+    - popularidad (array): popularidad de las canciones
+
+    Returns:
+    - clases (np.ndarray): "Baja popularidad" o "Alta popularidad"
+    """
+    return np.where(np.asarray(popularidad) < 50, "Baja popularidad", "Alta popularidad")
+
+
+def matriz_caracteristicas(datos)->np.ndarray:
+    """
+    Función para convertir una canción o un lote de canciones a la matriz de características del modelo.
+
+    Args:
+    - datos (pd.Dataframe, dict, list o np.ndarray): canciones con las columnas de COLUMNAS_MODELO
+
+    Returns:
+    - X (np.ndarray): matriz de tamaño (canciones, 8)
+    """
+    if isinstance(datos, pd.DataFrame):
+        return datos[COLUMNAS_MODELO].to_numpy(dtype=np.float64)
+    if isinstance(datos, dict):
+        return np.array([[datos[columna] for columna in COLUMNAS_MODELO]], dtype=np.float64)
+    return np.atleast_2d(np.asarray(datos, dtype=np.float64))
+
+
+def preparar_entrenamiento(df:pd.DataFrame, muestras_por_clase:int=41000, semilla:int=42)->tuple:
+    """
+    Función para preparar los datos de entrenamiento: clases balanceadas por muestreo, como en
+    MachineLearning.ipynb, y características redondeadas a dos decimales. A diferencia del
+    notebook no se quitan outliers ni se normaliza, porque el modelo recibe los valores sin
+    transformar del formulario y de los CSV.
+
+    Args:
+    - df (pd.Dataframe): dataframe con la popularidad y las columnas del modelo
+    - muestras_por_clase (int): canciones de cada clase
+    - semilla (int): semilla del muestreo
+
+    Returns:
+    - X (np.ndarray): matriz de características
+    - y (np.ndarray): clase de popularidad de cada canción
+    """
+    clases = pd.Series(popularidad_objetivo(df['popularity']), index=df.index)
+    muestras = [df[clases == clase].sample(min(muestras_por_clase, int((clases == clase).sum())), random_state=semilla)
+                for clase in ["Baja popularidad", "Alta popularidad"]]
+    df_aux = pd.concat(muestras)
+    X = np.round(matriz_caracteristicas(df_aux), 2)
+    return X, clases.loc[df_aux.index].to_numpy()
+
+
+def entrenar_modelo(df:pd.DataFrame, ruta:str=RUTA_MODELO):
+    """
+    Función para entrenar el clasificador de popularidad y guardarlo en disco.
+
+    Args:
+    - df (pd.Dataframe): dataframe con la popularidad y las columnas del modelo
+    - ruta (str): ruta donde se guarda el modelo
+
+    Returns:
+    - modelo (GradientBoostingClassifier): modelo entrenado
+    """
+    X, y = preparar_entrenamiento(df)
+    modelo = GradientBoostingClassifier(random_state=357, validation_fraction=0.1, n_iter_no_change=5, tol=0.01)
+    modelo.fit(X, y)
+    guardar_modelo(modelo, ruta)
+    return modelo
+
+
+def guardar_modelo(modelo, ruta:str=RUTA_MODELO)->None:
+    """
+    Función para serializar un modelo entrenado con las columnas de COLUMNAS_MODELO.
+
+    Args:
+    - modelo: modelo de scikit-learn entrenado
+    - ruta (str): ruta donde se guarda el modelo
+    """
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    joblib.dump(modelo, ruta)
+
+
+def construir_peticion(X:np.ndarray)->bytes:
+    """
+    Función para construir el cuerpo de la petición al endpoint de Azure con varias canciones.
+
+    Args:
+    - X (np.ndarray): matriz de características
+
+    Returns:
+    - body (bytes): cuerpo JSON de la petición
+    """
+    data = {
+        "input_data": {
+            "columns": COLUMNAS_MODELO,
+            "index": list(range(len(X))),
+            "data": X.tolist()
+        }
+    }
+    return str.encode(json.dumps(data))
+
+
+class PredictorLocal:
+    """
+    Predictor que usa el modelo serializado cargado en el propio proceso.
+
+    Args:
+    - ruta (str): ruta del modelo serializado
+    """
+    def __init__(self, ruta:str=RUTA_MODELO):
+        self.ruta = ruta
+        self.modelo = joblib.load(ruta)
+        # Los modelos entrenados con un dataframe esperan los nombres de las columnas
+        self.columnas = getattr(self.modelo, "feature_names_in_", None)
+
+    def predecir(self, datos)->np.ndarray:
+        """
+        Función para predecir la clase de popularidad de una canción o un lote de canciones.
+
+        Args:
+        - datos (pd.Dataframe, dict, list o np.ndarray): canciones a predecir
+
+        Returns:
+        - clases (np.ndarray): clase de popularidad de cada canción
+        """
+        X = matriz_caracteristicas(datos)
+        if self.columnas is not None:
+            X = pd.DataFrame(X, columns=COLUMNAS_MODELO)[self.columnas]
+        return self.modelo.predict(X)
+
+
+class PredictorAzure:
+    """
+    Predictor que envía las canciones al endpoint de Azure Machine Learning, reutilizando
+    las conexiones HTTPS (keep-alive) y con tiempo máximo de espera.
+
+    Args:
+    - url (str): URL del endpoint
+    - api_key (str): clave del endpoint
+    - despliegue (str): despliegue al que se fuerza la petición, None para seguir las reglas del endpoint
+    - timeout (float): segundos máximos de espera por petición
+    - conexiones (int): conexiones que se mantienen abiertas
+    """
+    def __init__(self, url:str, api_key:str, despliegue:str=DESPLIEGUE_AZURE, timeout:float=10, conexiones:int=4):
+        if not api_key:
+            raise Exception("A key should be provided to invoke the endpoint")
+        self.url = url
+        self.headers = {'Content-Type': 'application/json', 'Authorization': ('Bearer ' + api_key)}
+        if despliegue:
+            # La cabecera azureml-model-deployment fuerza la petición a un despliegue concreto
+            self.headers['azureml-model-deployment'] = despliegue
+        self.http = urllib3.PoolManager(maxsize=conexiones, block=True, timeout=urllib3.Timeout(total=timeout),
+                                        retries=urllib3.Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                                                              allowed_methods=None))
+
+    def predecir(self, datos)->np.ndarray:
+        """
+        Función para predecir la clase de popularidad de una canción o un lote de canciones
+        con una única petición.
+
+        Args:
+        - datos (pd.Dataframe, dict, list o np.ndarray): canciones a predecir
+
+        Returns:
+        - clases (np.ndarray): clase de popularidad de cada canción
+        """
+        response = self.http.request("POST", self.url, body=construir_peticion(matriz_caracteristicas(datos)), headers=self.headers)
+        if response.status >= 400:
+            raise ErrorPrediccion(f"The request failed with status code: {response.status}\n{response.data.decode('utf8', 'ignore')}")
+        return np.asarray(json.loads(response.data))
+
+
+# Predictor de cada proceso del pool, se carga una vez al arrancar el proceso
+_predictor_proceso = None
+
+
+def _iniciar_proceso(ruta:str)->None:
+    global _predictor_proceso
+    _predictor_proceso = PredictorLocal(ruta)
+
+
+def _puntuar_en_proceso(bloque:pd.DataFrame, cabecera:bool)->str:
+    return puntuar_bloque(_predictor_proceso, bloque, cabecera)
+
+
+def predecir_por_peticiones(predictor, X:np.ndarray, filas_por_peticion:int=FILAS_POR_PETICION)->np.ndarray:
+    """
+    Función para predecir un bloque grande dividiéndolo en peticiones de varias canciones.
+
+    Args:
+    - predictor (PredictorAzure): predictor remoto
+    - X (np.ndarray): matriz de características
+    - filas_por_peticion (int): canciones por petición
+
+    Returns:
+    - clases (np.ndarray): clase de popularidad de cada canción
+    """
+    partes = [predictor.predecir(X[inicio:inicio + filas_por_peticion]) for inicio in range(0, len(X), filas_por_peticion)]
+    return np.concatenate(partes) if partes else np.array([], dtype=object)
+
+
+def puntuar_bloque(predictor, bloque:pd.DataFrame, cabecera:bool)->str:
+    """
+    Función para predecir un bloque de canciones y devolverlo en CSV con la clase de popularidad
+    en una nueva columna. Con Azure el bloque se envía en peticiones de varias canciones.
+
+    Args:
+    - predictor (PredictorLocal o PredictorAzure): predictor a usar
+    - bloque (pd.Dataframe): canciones con las columnas de COLUMNAS_MODELO
+    - cabecera (bool): si se escribe la cabecera del CSV
+
+    Returns:
+    - csv (str): bloque puntuado en CSV
+    """
+    X = matriz_caracteristicas(bloque)
+    # Las canciones con alguna característica vacía se quedan sin predicción
+    validas = ~np.isnan(X).any(axis=1)
+    clases = np.full(len(X), None, dtype=object)
+    if validas.any():
+        if isinstance(predictor, PredictorLocal):
+            clases[validas] = predictor.predecir(X[validas])
+        else:
+            clases[validas] = predecir_por_peticiones(predictor, X[validas])
+    bloque[COLUMNA_PREDICCION] = clases
+    return bloque.to_csv(header=cabecera, index=False)
+
+
+def puntuar_bloques(bloques, predictor, procesos:int=None):
+    """
+    Función para puntuar una secuencia de bloques de canciones, devolviéndolos en orden.
+    Con el modelo local la predicción y el formateo a CSV de cada bloque se reparten en un pool
+    de procesos, y nunca hay más de dos bloques por proceso en vuelo, así la memoria no depende
+    del tamaño de la entrada.
+
+    Args:
+    - bloques (iterable): bloques de canciones (pd.Dataframe con las columnas del modelo)
+    - predictor (PredictorLocal o PredictorAzure): predictor a usar
+    - procesos (int): procesos del pool, todos los núcleos si es None y sin pool si es 1
+
+    Yields:
+    - csv (str): cada bloque puntuado en CSV, el primero con cabecera
+    """
+    procesos = procesos or os.cpu_count() or 1
+    if not isinstance(predictor, PredictorLocal) or procesos == 1:
+        for numero, bloque in enumerate(bloques):
+            yield puntuar_bloque(predictor, bloque, numero == 0)
+        return
+    # Usamos spawn para no heredar los hilos del proceso padre (por ejemplo los de Streamlit)
+    with ProcessPoolExecutor(procesos, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_iniciar_proceso, initargs=(predictor.ruta,)) as executor:
+        pendientes = deque()
+        for numero, bloque in enumerate(bloques):
+            pendientes.append(executor.submit(_puntuar_en_proceso, bloque, numero == 0))
+            if len(pendientes) >= 2 * procesos:
+                yield pendientes.popleft().result()
+        while pendientes:
+            yield pendientes.popleft().result()
+
+
+def puntuar_csv(entrada, salida, predictor, tamano_bloque:int=TAMANO_BLOQUE, procesos:int=None)->int:
+    """
+    Función para puntuar un catálogo de canciones en CSV leyéndolo por bloques y escribiendo
+    el resultado a medida que se predice, con la clase de popularidad en una nueva columna.
+
+    Args:
+    - entrada (str o fichero): CSV con al menos las columnas de COLUMNAS_MODELO
+    - salida (str o fichero): CSV de salida
+    - predictor (PredictorLocal o PredictorAzure): predictor a usar
+    - tamano_bloque (int): canciones por bloque
+    - procesos (int): procesos del pool para el modelo local, ver puntuar_bloques
+
+    Returns:
+    - total (int): número de canciones puntuadas
+    """
+    total = 0
+
+    def leer_bloques():
+        nonlocal total
+        for bloque in pd.read_csv(entrada, chunksize=tamano_bloque):
+            faltan = [columna for columna in COLUMNAS_MODELO if columna not in bloque.columns]
+            if faltan:
+                raise ValueError(f"Faltan las columnas {faltan} en el fichero de entrada")
+            total += len(bloque)
+            yield bloque
+
+    fichero = open(salida, "w", newline="", encoding="utf-8") if isinstance(salida, (str, os.PathLike)) else salida
+    try:
+        for csv in puntuar_bloques(leer_bloques(), predictor, procesos):
+            fichero.write(csv)
+    finally:
+        if fichero is not salida:
+            fichero.close()
+    return total
+
+
+def crear_predictor_azure(ruta_secretos:str=".streamlit/secrets.toml")->PredictorAzure:
+    """
+    Función para crear el predictor de Azure con las credenciales de los secretos de Streamlit.
+
+    Args:
+    - ruta_secretos (str): ruta del fichero de secretos
+
+    Returns:
+    - predictor (PredictorAzure): predictor remoto
+    """
+    with open(ruta_secretos, "rb") as f:
+        secretos = tomllib.load(f)
+    return PredictorAzure(secretos['azure']['url'], secretos['azure']['api_key'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena el clasificador de popularidad o puntúa un catálogo de canciones")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    parser_entrenar = subparsers.add_parser("entrenar", help="entrena el modelo con los datos limpios")
+    parser_entrenar.add_argument("--modelo", default=RUTA_MODELO, help="ruta donde se guarda el modelo")
+    parser_puntuar = subparsers.add_parser("puntuar", help="puntúa un CSV con las columnas del modelo")
+    parser_puntuar.add_argument("entrada", help="CSV de entrada")
+    parser_puntuar.add_argument("salida", help="CSV de salida")
+    parser_puntuar.add_argument("--modelo", default=RUTA_MODELO, help="modelo local a usar")
+    parser_puntuar.add_argument("--azure", action="store_true", help="usar el endpoint de Azure de .streamlit/secrets.toml")
+    parser_puntuar.add_argument("--bloque", type=int, default=TAMANO_BLOQUE, help="canciones por bloque")
+    parser_puntuar.add_argument("--procesos", type=int, default=None, help="procesos del pool, todos los núcleos por defecto")
+    args = parser.parse_args()
+
+    if args.comando == "entrenar":
+        entrenar_modelo(leer_datos(COLUMNAS_MODELO + ["popularity"]), args.modelo)
+    else:
+        predictor = crear_predictor_azure() if args.azure else PredictorLocal(args.modelo)
+        total = puntuar_csv(args.entrada, args.salida, predictor, args.bloque, args.procesos)
+        print(f"{total} canciones puntuadas en {args.salida}")
@@ -0,0 +1,290 @@
+"""
+Preprocesamiento por bloques de los datos originales de Spotify, los mismos pasos que
+Preprocesamiento.ipynb pero sin cargar el fichero completo en memoria:
+
+1. Primera pasada: se cuentan los compases (time_signature > 0) de cada género y artista, y
+   se guardan los artistas y géneros que aparecen para fijar las categorías del almacén.
+2. Segunda pasada: cada bloque se limpia (nulos, escalas, modos, moda del compás y duración
+   en minutos:segundos), en paralelo si hay varios núcleos, y se va escribiendo en el Parquet
+   (y opcionalmente en el CSV comprimido) en el orden original.
+
+Uso:
+    python preprocesamiento.py spotify_data.zip
+    python preprocesamiento.py spotify_data.zip --csv spotify_data_cleaned.zip --procesos 4
+"""
+import os
+import argparse
+import zipfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datos import ESCALAS, MODOS, TIPOS_COLUMNAS, RUTA_PARQUET
+
+
+RUTA_ENTRADA = "spotify_data.zip"
+TAMANO_BLOQUE = 200_000 # Filas que se leen y limpian de cada vez
+COLUMNAS_MODA = ["genre", "artist_name"] # Grupos en los que se calcula la moda de time_signature
+TAMANO_GRUPO_FILAS = 128_000 # Filas por grupo del Parquet, como en datos.guardar_datos
+
+
+def leer_bloques(ruta:str=RUTA_ENTRADA, tamano_bloque:int=TAMANO_BLOQUE, columnas:list=None):
+    """
+    Función para leer los datos originales por bloques.
+
+    Args:
+    - ruta (str): ruta del CSV original (puede estar comprimido)
+    - tamano_bloque (int): filas de cada bloque
+    - columnas (list): columnas a leer, todas si es None
+
+    Returns:
+    - bloques (iterable): bloques de filas (pd.Dataframe)
+    """
+    return pd.read_csv(ruta, chunksize=tamano_bloque, usecols=columnas)
+
+
+def contar_compases(bloques)->tuple:
+    """
+    Función para la primera pasada: cuenta cuántas canciones de cada género y artista tienen
+    cada compás válido y recoge los artistas y géneros que aparecen.
+
+    Args:
+    - bloques (iterable): bloques con las columnas artist_name, genre y time_signature
+
+    Returns:
+    - conteos (pd.Series): canciones por género, artista y compás
+    - categorias (dict): artistas y géneros ordenados, para las columnas categóricas
+    """
+    partes = []
+    artistas, generos = set(), set()
+    for bloque in bloques:
+        bloque = bloque.fillna({"artist_name": "None"})
+        artistas.update(bloque["artist_name"].unique())
+        generos.update(bloque["genre"].dropna().unique())
+        validos = bloque[bloque["time_signature"] > 0]
+        partes.append(validos.groupby(COLUMNAS_MODA + ["time_signature"]).size())
+        # Juntamos los conteos de vez en cuando para que no crezcan con el número de bloques
+        if len(partes) >= 16:
+            partes = [pd.concat(partes).groupby(level=[0, 1, 2]).sum()]
+    conteos = pd.concat(partes).groupby(level=[0, 1, 2]).sum() if partes else pd.Series(dtype="int64")
+    categorias = {"artist_name": sorted(artistas), "genre": sorted(generos)}
+    return conteos, categorias
+
+
+def calcular_modas(conteos:pd.Series)->pd.Series:
+    """
+    Función para obtener la moda del compás de cada género y artista a partir de los conteos.
+    En caso de empate se queda el compás menor, como pd.Series.mode()[0].
+
+    Args:
+    - conteos (pd.Series): canciones por género, artista y compás
+
+    Returns:
+    - modas (pd.Series): compás más frecuente de cada género y artista
+    """
+    tabla = conteos.rename("canciones").reset_index()
+    tabla = tabla.sort_values(["canciones", "time_signature"], ascending=[False, True], kind="stable")
+    tabla = tabla.drop_duplicates(COLUMNAS_MODA)
+    return tabla.set_index(COLUMNAS_MODA)["time_signature"].astype("float64")
+
+
+def duracion_minutos(duracion_ms:pd.Series)->np.ndarray:
+    """
+    Función para pasar la duración en milisegundos al formato minutos:segundos. Solo se da
+    formato a cada duración distinta en segundos, que son muchas menos que las canciones.
+
+    Args:
+    - duracion_ms (pd.Series): duración en milisegundos
+
+    Returns:
+    - duracion (np.ndarray): duración en texto con el formato M:SS
+    """
+    segundos = (duracion_ms.to_numpy() // 1000).astype(np.int64)
+    distintos, posiciones = np.unique(segundos, return_inverse=True)
+    textos = np.array([f"{s // 60}:{s % 60:02d}" for s in distintos.tolist()], dtype=object)
+    return textos[posiciones]
+
+
+def limpiar_bloque(bloque:pd.DataFrame, modas:pd.Series)->pd.DataFrame:
+    """
+    Función para limpiar un bloque de los datos originales con los pasos de Preprocesamiento.ipynb.
+
+    Args:
+    - bloque (pd.Dataframe): bloque de los datos originales
+    - modas (pd.Series): compás más frecuente de cada género y artista
+
+    Returns:
+    - df (pd.Dataframe): bloque limpio con las columnas de TIPOS_COLUMNAS
+    """
+    df = bloque.drop(columns=["Unnamed: 0"], errors="ignore")
+    df = df.fillna({"artist_name": "None", "track_name": "None"})
+    df["key"] = df["key"].map(dict(enumerate(ESCALAS)))
+    df["mode"] = df["mode"].map(dict(enumerate(MODOS)))
+    # Las canciones con compás 0 toman la moda de su género y artista, buscándola en el índice de modas
+    df["time_signature"] = df["time_signature"].astype("float64")
+    sin_compas = (df["time_signature"] == 0).to_numpy()
+    if sin_compas.any():
+        claves = pd.MultiIndex.from_frame(df.loc[sin_compas, COLUMNAS_MODA])
+        df.loc[sin_compas, "time_signature"] = modas.reindex(claves).to_numpy()
+    df["duration_min_secs"] = duracion_minutos(df["duration_ms"])
+    return df[list(TIPOS_COLUMNAS)]
+
+
+def tipar_bloque(df:pd.DataFrame, categorias:dict)->pd.DataFrame:
+    """
+    Función para pasar un bloque limpio a los tipos del almacén, con las mismas categorías en
+    todos los bloques para que se puedan escribir en el mismo Parquet.
+
+    Args:
+    - df (pd.Dataframe): bloque limpio
+    - categorias (dict): valores de cada columna categórica
+
+    Returns:
+    - df (pd.Dataframe): bloque con los tipos reducidos
+    """
+    tipos = {columna: tipo for columna, tipo in TIPOS_COLUMNAS.items() if columna in df.columns}
+    tipos.update({columna: pd.CategoricalDtype(valores) for columna, valores in categorias.items()})
+    return df.astype(tipos)
+
+
+def _iniciar_proceso(modas:pd.Series, categorias:dict, csv:bool)->None:
+    global _contexto_proceso
+    _contexto_proceso = (modas, categorias, csv)
+
+
+def _procesar_en_proceso(bloque:pd.DataFrame, cabecera:bool)->tuple:
+    return procesar_bloque(bloque, *_contexto_proceso, cabecera)
+
+
+def procesar_bloque(bloque:pd.DataFrame, modas:pd.Series, categorias:dict, csv:bool, cabecera:bool)->tuple:
+    """
+    Función para limpiar un bloque y prepararlo para escribirlo en el almacén.
+
+    Args:
+    - bloque (pd.Dataframe): bloque de los datos originales
+    - modas (pd.Series): compás más frecuente de cada género y artista
+    - categorias (dict): valores de cada columna categórica
+    - csv (bool): si también se devuelve el bloque limpio en CSV
+    - cabecera (bool): si el CSV lleva cabecera
+
+    Returns:
+    - tabla (pa.Table): bloque con los tipos del almacén
+    - texto (str): bloque limpio en CSV, o None si csv es False
+    """
+    df = limpiar_bloque(bloque, modas)
+    texto = df.to_csv(header=cabecera, index=False) if csv else None
+    return pa.Table.from_pandas(tipar_bloque(df, categorias), preserve_index=False), texto
+
+
+def procesar_bloques(bloques, modas:pd.Series, categorias:dict, csv:bool=False, procesos:int=None):
+    """
+    Función para procesar una secuencia de bloques, devolviéndolos en orden. Con varios procesos
+    la limpieza se reparte en un pool y nunca hay más de dos bloques por proceso en vuelo.
+
+    Args:
+    - bloques (iterable): bloques de los datos originales
+    - modas (pd.Series): compás más frecuente de cada género y artista
+    - categorias (dict): valores de cada columna categórica
+    - csv (bool): si también se devuelve cada bloque en CSV
+    - procesos (int): procesos del pool, todos los núcleos si es None y sin pool si es 1
+
+    Yields:
+    - bloque (tuple): tabla con los tipos del almacén y texto CSV (o None)
+    """
+    procesos = procesos or os.cpu_count() or 1
+    if procesos == 1:
+        for numero, bloque in enumerate(bloques):
+            yield procesar_bloque(bloque, modas, categorias, csv, numero == 0)
+        return
+    # Usamos spawn para no heredar los hilos del proceso padre, como en prediccion.puntuar_bloques
+    with ProcessPoolExecutor(procesos, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_iniciar_proceso, initargs=(modas, categorias, csv)) as executor:
+        pendientes = deque()
+        for numero, bloque in enumerate(bloques):
+            pendientes.append(executor.submit(_procesar_en_proceso, bloque, numero == 0))
+            if len(pendientes) >= 2 * procesos:
+                yield pendientes.popleft().result()
+        while pendientes:
+            yield pendientes.popleft().result()
+
+
+def preprocesar(entrada:str=RUTA_ENTRADA, ruta_parquet:str=RUTA_PARQUET, ruta_csv:str=None,
+                tamano_bloque:int=TAMANO_BLOQUE, procesos:int=None)->int:
+    """
+    Función para preprocesar los datos originales por bloques y escribir el almacén Parquet
+    (y el CSV comprimido si se indica) a medida que avanza. Los ficheros se escriben con otro
+    nombre y se renombran al terminar, así nunca queda un almacén a medias; si falla algún
+    bloque se borran.
+
+    Args:
+    - entrada (str): ruta del CSV original
+    - ruta_parquet (str): ruta del fichero Parquet de salida
+    - ruta_csv (str): ruta del CSV comprimido de salida, no se escribe si es None
+    - tamano_bloque (int): filas de cada bloque
+    - procesos (int): procesos del pool, todos los núcleos si es None
+
+    Returns:
+    - filas (int): canciones escritas
+
+    Raises:
+    - ValueError: si la entrada no tiene canciones
+    """
+    conteos, categorias = contar_compases(leer_bloques(entrada, tamano_bloque, ["artist_name", "genre", "time_signature"]))
+    modas = calcular_modas(conteos)
+    temporal_parquet = ruta_parquet + ".tmp"
+    temporal_csv = ruta_csv + ".tmp" if ruta_csv else None
+    filas = 0
+    escritor = None
+    salida_csv = None
+    archivo = zipfile.ZipFile(temporal_csv, "w", zipfile.ZIP_DEFLATED) if ruta_csv else None
+    try:
+        try:
+            # El nombre dentro del zip es el mismo que pone pandas con compression="zip"
+            salida_csv = archivo.open(os.path.basename(ruta_csv).removesuffix(".zip"), "w", force_zip64=True) if archivo else None
+            for tabla, texto in procesar_bloques(leer_bloques(entrada, tamano_bloque), modas, categorias, ruta_csv is not None, procesos):
+                if escritor is None:
+                    escritor = pq.ParquetWriter(temporal_parquet, tabla.schema)
+                escritor.write_table(tabla, row_group_size=TAMANO_GRUPO_FILAS)
+                if salida_csv:
+                    salida_csv.write(texto.encode("utf-8"))
+                filas += tabla.num_rows
+        finally:
+            if escritor is not None:
+                escritor.close()
+            if salida_csv is not None:
+                salida_csv.close()
+            if archivo is not None:
+                archivo.close()
+        if filas == 0:
+            # Sin canciones no se sabe el tipo de las columnas de texto y el almacén no serviría
+            raise ValueError(f"El fichero {entrada} no tiene canciones")
+    except BaseException:
+        for temporal in (temporal_parquet, temporal_csv):
+            if temporal is not None and os.path.exists(temporal):
+                os.remove(temporal)
+        raise
+    os.replace(temporal_parquet, ruta_parquet)
+    if ruta_csv:
+        os.replace(temporal_csv, ruta_csv)
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entrada", nargs="?", default=RUTA_ENTRADA, help="CSV original de Spotify")
+    parser.add_argument("--parquet", default=RUTA_PARQUET, help="almacén Parquet de salida")
+    parser.add_argument("--csv", help="CSV comprimido de salida, como el que generaba el notebook")
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE, help="filas de cada bloque")
+    parser.add_argument("--procesos", type=int, help="procesos del pool, todos los núcleos por defecto")
+    args = parser.parse_args()
+    filas = preprocesar(args.entrada, args.parquet, args.csv, args.bloque, args.procesos)
+    print(f"{filas} canciones escritas en {args.parquet}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+
+
+TAMANO_BLOQUE = 65_536
+COLUMNAS_FILTROS = ("genre", "year", "key", "mode") # Columnas con índice de filas por valor
+
+
+def indice_popularidad(df:pd.DataFrame, columna:str='popularity')->np.ndarray:
+    """
+    Función para calcular el índice de filas ordenado de mayor a menor popularidad.
+    Se calcula una vez por versión de los datos y sirve para cualquier top k.
+
+    Args:
+    - df (pd.Dataframe): dataframe
+    - columna (str): columna por la que se ordena
+
+    Returns:
+    - indice (np.ndarray): posiciones de las filas en orden descendente
+    """
+    return np.argsort(-df[columna].to_numpy(dtype=np.float64), kind='stable')
+
+
+def mascara_filtros(df:pd.DataFrame, filtros:dict, filas:np.ndarray=None)->np.ndarray:
+    """
+    Función para calcular la máscara de filas que cumplen todos los filtros.
+
+    Args:
+    - df (pd.Dataframe): dataframe
+    - filtros (dict): columna -> lista de valores permitidos o tupla (mínimo, máximo)
+    - filas (np.ndarray): posiciones a evaluar, todas si es None
+
+    Returns:
+    - mascara (np.ndarray): array booleano con las filas que cumplen los filtros
+    """
+    mascara = np.ones(len(df) if filas is None else len(filas), dtype=bool)
+    for columna, valores in filtros.items():
+        serie = df[columna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # Tabla de códigos permitidos, el código -1 de los nulos cae en la última posición
+            permitidos = np.zeros(len(serie.cat.categories) + 1, dtype=bool)
+            codigos = serie.cat.categories.get_indexer(list(valores))
+            permitidos[codigos[codigos >= 0]] = True
+            codigos_filas = serie.cat.codes.to_numpy()
+            mascara &= permitidos[codigos_filas if filas is None else codigos_filas[filas]]
+            continue
+        valores_columna = serie.to_numpy() if filas is None else serie.to_numpy()[filas]
+        if isinstance(valores, tuple):
+            mascara &= (valores_columna >= valores[0]) & (valores_columna <= valores[1])
+        else:
+            mascara &= np.isin(valores_columna, list(valores))
+    return mascara
+
+
+def construir_indice_filtros(df:pd.DataFrame, columnas:tuple=COLUMNAS_FILTROS)->dict:
+    """
+    Función para construir el índice de filtros: para cada valor de cada columna, un bitmap
+    empaquetado (un bit por fila) con las filas que tienen ese valor. Se calcula una vez por
+    versión de los datos y combinar filtros es un OR/AND de unos pocos arrays de bytes.
+
+    Args:
+    - df (pd.Dataframe): dataframe con las columnas a indexar
+    - columnas (tuple): columnas a indexar, categóricas o con pocos valores distintos
+
+    Returns:
+    - indice (dict): número de "filas" y, por columna, sus "valores", la "posicion" de cada valor y la matriz de "bitmaps" (valor x bytes)
+    """
+    indice = {"filas": len(df)}
+    for columna in columnas:
+        serie = df[columna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            valores, codigos = np.asarray(serie.cat.categories), serie.cat.codes.to_numpy()
+        else:
+            valores, codigos = np.unique(serie.to_numpy(), return_inverse=True)
+        # Cada bitmap ocupa un número de bytes múltiplo de 8 para combinarlos como uint64
+        bitmaps = np.zeros((len(valores), (len(df) + 63) // 64 * 8), dtype=np.uint8)
+        for posicion in range(len(valores)):
+            bitmaps[posicion, :(len(df) + 7) // 8] = np.packbits(codigos == posicion)
+        indice[columna] = {"valores": valores, "posicion": {valor: posicion for posicion, valor in enumerate(valores.tolist())}, "bitmaps": bitmaps}
+    return indice
+
+
+def bitmap_filtros(indice:dict, filtros:dict, combinar:str="y")->np.ndarray:
+    """
+    Función para combinar los bitmaps de los filtros: los valores de una misma columna se unen con OR
+    y las columnas se combinan con AND ("y") u OR ("o").
+
+    Args:
+    - indice (dict): índice de construir_indice_filtros
+    - filtros (dict): columna -> lista de valores permitidos o tupla (mínimo, máximo)
+    - combinar (str): "y" para que se cumplan todos los filtros, "o" para que se cumpla alguno
+
+    Returns:
+    - bitmap (np.ndarray): bitmap empaquetado de las filas que cumplen los filtros, None si no hay filtros
+    """
+    resultado = None
+    for columna, seleccion in filtros.items():
+        valores = indice[columna]["valores"]
+        if isinstance(seleccion, tuple):
+            posiciones = np.flatnonzero((valores >= seleccion[0]) & (valores <= seleccion[1]))
+        else:
+            posiciones = [indice[columna]["posicion"][valor] for valor in seleccion if valor in indice[columna]["posicion"]]
+        bloques = indice[columna]["bitmaps"].view(np.uint64)
+        bitmap = np.zeros(bloques.shape[1], dtype=np.uint64)
+        for posicion in posiciones:
+            np.bitwise_or(bitmap, bloques[posicion], out=bitmap)
+        if resultado is None:
+            resultado = bitmap
+        elif combinar == "y":
+            np.bitwise_and(resultado, bitmap, out=resultado)
+        else:
+            np.bitwise_or(resultado, bitmap, out=resultado)
+    return resultado.view(np.uint8) if resultado is not None else None
+
+
+def mascara_bitmap(indice:dict, bitmap:np.ndarray)->np.ndarray:
+    """
+    Función para desempaquetar un bitmap de filtros en una máscara con una posición por fila.
+
+    Args:
+    - indice (dict): índice de construir_indice_filtros
+    - bitmap (np.ndarray): bitmap empaquetado
+
+    Returns:
+    - mascara (np.ndarray): array booleano con las filas que cumplen los filtros
+    """
+    return np.unpackbits(bitmap, count=indice["filas"]).view(bool)
+
+
+def top_k(df:pd.DataFrame, k:int, filtros:dict=None, indice:np.ndarray=None, columna:str='popularity', mascara:np.ndarray=None)->pd.DataFrame:
+    """
+    Función para obtener las k filas con mayor valor de una columna sin ordenar el dataframe completo.
+    Con un índice ordenado se recorre por bloques hasta encontrar k filas que cumplan los filtros,
+    sin índice se hace una selección parcial con argpartition.
+
+    Args:
+    - df (pd.Dataframe): dataframe
+    - k (int): número de filas a devolver
+    - filtros (dict): filtros a aplicar, ver mascara_filtros
+    - indice (np.ndarray): índice ordenado de indice_popularidad
+    - columna (str): columna por la que se ordena
+    - mascara (np.ndarray): filas permitidas ya calculadas, por ejemplo con el índice de filtros
+
+    Returns:
+    - df_top (pd.Dataframe): las k filas ordenadas de mayor a menor
+    """
+    if indice is not None:
+        if not filtros and mascara is None:
+            filas = indice[:k]
+        else:
+            # Sólo se evalúan los filtros en los bloques del índice que hace falta recorrer
+            encontradas = []
+            total = 0
+            for inicio in range(0, len(indice), TAMANO_BLOQUE):
+                bloque = indice[inicio:inicio + TAMANO_BLOQUE]
+                if mascara is not None:
+                    bloque = bloque[mascara[bloque]]
+                if filtros:
+                    bloque = bloque[mascara_filtros(df, filtros, bloque)]
+                encontradas.append(bloque)
+                total += len(bloque)
+                if total >= k:
+                    break
+            filas = np.concatenate(encontradas)[:k] if encontradas else indice[:0]
+    else:
+        valores = df[columna].to_numpy(dtype=np.float64)
+        permitidas = np.ones(len(valores), dtype=bool) if mascara is None else mascara
+        candidatas = np.flatnonzero(permitidas & mascara_filtros(df, filtros) if filtros else permitidas)
+        if len(candidatas) > k:
+            candidatas = candidatas[np.argpartition(-valores[candidatas], k - 1)[:k]]
+        filas = candidatas[np.argsort(-valores[candidatas], kind='stable')]
+    return df.iloc[filas]
@@ -0,0 +1,117 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from datos import COLUMNAS_MODELO, leer_datos, version_datos
+
+
+DIRECTORIO_INDICE = "indice_similares"
+
+
+def construir_indice(df:pd.DataFrame)->dict:
+    """
+    Función para construir el índice de canciones similares: las características de audio
+    estandarizadas en float32 y las canciones ordenadas por género, de forma que las de cada
+    género ocupan un tramo contiguo del índice.
+
+    Las canciones sin género no se pueden buscar, así que no entran en el índice.
+
+    Args:
+    - df (pd.Dataframe): dataframe con track_id, genre y las columnas de COLUMNAS_MODELO
+
+    Returns:
+    - indice (dict): matriz "X", ids "track_id", "generos", "inicios" de cada género, "media" y "desviacion"
+    """
+    df = df[df['genre'].notna()]
+    generos = df['genre'].astype('category')
+    orden = np.argsort(generos.cat.codes.to_numpy(), kind='stable')
+    X = df[COLUMNAS_MODELO].to_numpy(dtype=np.float64)
+    media = np.nanmean(X, axis=0)
+    desviacion = np.nanstd(X, axis=0)
+    desviacion[desviacion == 0] = 1
+    X = np.nan_to_num((X[orden] - media) / desviacion).astype(np.float32)
+    conteos = np.bincount(generos.cat.codes.to_numpy()[orden], minlength=len(generos.cat.categories))
+    return {
+        "X": X,
+        "track_id": df['track_id'].to_numpy()[orden].astype('S'),
+        "generos": [str(genero) for genero in generos.cat.categories],
+        "inicios": np.concatenate([[0], np.cumsum(conteos)]),
+        "media": media,
+        "desviacion": desviacion,
+    }
+
+
+def guardar_indice(indice:dict, version:str, directorio:str=DIRECTORIO_INDICE)->None:
+    """
+    Función para guardar el índice en ficheros .npy, que se pueden mapear en memoria al cargarlos.
+
+    Args:
+    - indice (dict): índice de canciones similares
+    - version (str): versión de los datos de los que sale el índice
+    - directorio (str): carpeta donde se guardan los índices
+    """
+    ruta = os.path.join(directorio, version)
+    os.makedirs(ruta, exist_ok=True)
+    for nombre in ["X", "track_id", "inicios", "media", "desviacion"]:
+        np.save(os.path.join(ruta, f"{nombre}.npy"), indice[nombre])
+    with open(os.path.join(ruta, "generos.json"), "w", encoding="utf-8") as f:
+        json.dump(indice["generos"], f)
+
+
+def cargar_indice(version:str=None, directorio:str=DIRECTORIO_INDICE)->dict:
+    """
+    Función para cargar el índice de canciones similares de una versión de los datos, mapeado
+    en memoria. Si no está guardado se construye a partir de los datos y se guarda.
+
+    Args:
+    - version (str): versión de los datos, la actual si es None
+    - directorio (str): carpeta donde se guardan los índices
+
+    Returns:
+    - indice (dict): índice de canciones similares
+    """
+    version = version or version_datos()
+    ruta = os.path.join(directorio, version)
+    if not os.path.exists(os.path.join(ruta, "generos.json")):
+        guardar_indice(construir_indice(leer_datos(["track_id", "genre"] + COLUMNAS_MODELO)), version, directorio)
+    indice = {nombre: np.load(os.path.join(ruta, f"{nombre}.npy"), mmap_mode="r")
+              for nombre in ["X", "track_id", "inicios", "media", "desviacion"]}
+    with open(os.path.join(ruta, "generos.json"), encoding="utf-8") as f:
+        indice["generos"] = json.load(f)
+    return indice
+
+
+def buscar_similares(indice:dict, valores:dict, generos:list, k:int=4, parametros:list=None)->list:
+    """
+    Función para buscar las k canciones de unos géneros más parecidas a unos valores de las
+    características de audio, por distancia euclídea sobre las características estandarizadas.
+
+    Args:
+    - indice (dict): índice de canciones similares
+    - valores (dict): valor de cada característica de COLUMNAS_MODELO
+    - generos (list): géneros en los que se busca
+    - k (int): número de canciones a devolver
+    - parametros (list): características que se comparan, todas si es None o está vacía
+
+    Returns:
+    - track_ids (list): ids de las canciones más parecidas, de más a menos parecida
+    """
+    columnas = [COLUMNAS_MODELO.index(parametro) for parametro in (parametros or COLUMNAS_MODELO)]
+    consulta = ((np.array([valores[columna] for columna in COLUMNAS_MODELO]) - indice["media"]) / indice["desviacion"])[columnas]
+    posiciones = [indice["generos"].index(genero) for genero in generos if genero in indice["generos"]]
+    tramos = [np.arange(indice["inicios"][posicion], indice["inicios"][posicion + 1]) for posicion in posiciones]
+    if not tramos:
+        return []
+    filas = np.concatenate(tramos)
+    distancias = ((indice["X"][filas][:, columnas] - consulta.astype(np.float32)) ** 2).sum(axis=1)
+    # Una canción puede estar en varios géneros, así que pedimos candidatos de sobra y quitamos repetidas
+    candidatos = min(k * len(tramos), len(filas))
+    mejores = np.argpartition(distancias, candidatos - 1)[:candidatos] if candidatos < len(filas) else np.arange(len(filas))
+    mejores = mejores[np.argsort(distancias[mejores], kind='stable')]
+    track_ids = list(dict.fromkeys(track_id.decode() for track_id in indice["track_id"][filas[mejores]]))
+    return track_ids[:k]
+
+
+if __name__ == "__main__":
+    cargar_indice()
@@ -0,0 +1,154 @@
+"""
+Pruebas del cliente de la API de Spotify y de la caché de respuestas contra un servidor local
+que simula el token y los endpoints de géneros y recomendaciones.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import cliente_spotify
+from cliente_spotify import CacheRespuestas, crear_cliente, generos_disponibles, normalizar_argumentos, recomendaciones
+
+
+class ManejadorStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def responder(self, codigo:int, contenido:dict, cabeceras:dict=None)->None:
+        cuerpo = json.dumps(contenido).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.tokens += 1
+        self.responder(200, {"access_token": "token", "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        self.server.peticiones.append(self.path)
+        self.server.conexiones.add(self.client_address)
+        if self.server.fallos:
+            # Respuestas de error programadas antes de la buena
+            codigo = self.server.fallos.pop(0)
+            return self.responder(codigo, {"error": {"status": codigo, "message": "error"}}, {"Retry-After": "0"})
+        if "available-genre-seeds" in self.path:
+            return self.responder(200, {"genres": ["pop", "rock"]})
+        if "/recommendations" in self.path:
+            return self.responder(200, {"tracks": [{"id": "t0"}]})
+        self.responder(404, {"error": {"status": 404, "message": "no"}})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor():
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), ManejadorStub)
+    servidor.daemon_threads = True
+    servidor.tokens = 0
+    servidor.peticiones = []
+    servidor.conexiones = set()
+    servidor.fallos = []
+    servidor.url = f"http://127.0.0.1:{servidor.server_address[1]}/"
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def cliente(servidor):
+    return crear_cliente("id", "secreto", url_api=servidor.url + "v1/", url_token=servidor.url + "api/token")
+
+
+class Reloj:
+    """
+    Reloj falso para controlar la caducidad y el orden de uso de la caché.
+    """
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(cliente_spotify.time, "time", reloj)
+    return reloj
+
+
+def test_reutiliza_token_y_sesion(servidor, cliente):
+    for _ in range(3):
+        assert cliente.recommendation_genre_seeds()["genres"] == ["pop", "rock"]
+    assert servidor.tokens == 1
+    assert len(servidor.peticiones) == 3
+    # Todas las peticiones van por la misma conexión de la sesión compartida
+    assert len(servidor.conexiones) == 1
+    assert cliente._session is cliente.auth_manager._session
+
+
+@pytest.mark.parametrize("codigo", [429, 500, 503])
+def test_reintenta_errores_temporales(servidor, cliente, codigo):
+    servidor.fallos = [codigo, codigo]
+    assert cliente.recommendation_genre_seeds()["genres"] == ["pop", "rock"]
+    assert len(servidor.peticiones) == 3
+
+
+def test_cache_evita_peticiones(servidor, cliente):
+    cache = CacheRespuestas(":memory:")
+    for _ in range(3):
+        assert generos_disponibles(cliente, cache) == ["pop", "rock"]
+        recomendaciones(cliente, cache, seed_genres=["rock", "pop"], limit=4)
+    assert len(servidor.peticiones) == 2
+    assert cache.estadisticas() == {"aciertos": 4, "fallos": 2, "entradas": 2}
+
+
+def test_cache_caduca(reloj):
+    cache = CacheRespuestas(":memory:", ttl=10)
+    cache.guardar("a", {"valor": 1})
+    reloj.ahora += 5
+    assert cache.obtener("a") == {"valor": 1}
+    reloj.ahora += 6
+    assert cache.obtener("a") is None
+    assert cache.estadisticas() == {"aciertos": 1, "fallos": 1, "entradas": 0}
+
+
+def test_cache_expulsa_menos_usadas(reloj):
+    cache = CacheRespuestas(":memory:", maximo_entradas=2)
+    cache.guardar("a", 1)
+    reloj.ahora += 1
+    cache.guardar("b", 2)
+    reloj.ahora += 1
+    assert cache.obtener("a") == 1 # "a" pasa a ser la usada más recientemente
+    reloj.ahora += 1
+    cache.guardar("c", 3)
+    assert cache.obtener("b") is None
+    assert cache.obtener("a") == 1
+    assert cache.obtener("c") == 3
+    assert cache.estadisticas()["entradas"] == 2
+
+
+def test_cache_cuenta_aciertos_y_fallos():
+    cache = CacheRespuestas(":memory:")
+    pedidas = []
+    for _ in range(3):
+        cache.obtener_o_pedir("endpoint", {"x": 1}, lambda: pedidas.append(1) or {"ok": True})
+    assert len(pedidas) == 1
+    assert (cache.aciertos, cache.fallos) == (2, 1)
+
+
+def test_normalizar_argumentos():
+    assert normalizar_argumentos({"seed_genres": ["rock", "pop"], "target_energy": 0.500001, "market": None}) == \
+        {"seed_genres": ["pop", "rock"], "target_energy": 0.5}
+    clave = CacheRespuestas.clave("recommendations", {"limit": 4, "seed_genres": ["rock", "pop"], "target_energy": 0.5})
+    reordenada = CacheRespuestas.clave("recommendations", {"target_energy": 0.50001, "seed_genres": ("pop", "rock"), "limit": 4, "market": None})
+    assert clave == reordenada
+    assert clave != CacheRespuestas.clave("recommendations", {"limit": 5, "seed_genres": ["rock", "pop"], "target_energy": 0.5})
@@ -0,0 +1,157 @@
+"""
+Pruebas del trabajo de enriquecimiento contra la API simulada de benchmarks/spotify_simulado.py:
+ritmo del cubo de tokens, pausa tras un 429, esperas tras los 5xx, renovación del token tras un
+401 y continuación desde un punto de control con la última línea incompleta. También de la
+escritura de las columnas en un almacén vacío y cuando falla.
+"""
+import os
+import json
+import time
+import asyncio
+
+import pytest
+import pyarrow.parquet as pq
+
+import enriquecimiento
+from benchmarks.benchmark_escalado import generar_almacen
+from benchmarks.spotify_simulado import TOKEN, arrancar, cancion_simulada
+from cliente_spotify import crear_sesion
+from enriquecimiento import (COLUMNAS_ENRIQUECIDAS, CuboTokens, ErrorEnriquecimiento, crear_credenciales,
+                             enriquecer_canciones, escribir_columnas, extraer_campos, leer_punto_control, pedir_lote)
+
+
+IDS = [f"cancion{i:04d}" for i in range(120)]
+
+
+@pytest.fixture
+def servidor():
+    servidor = arrancar(tasa=1000, rafaga=100)
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def credenciales(servidor):
+    return crear_credenciales("id", "secreto", servidor.url + "api/token")
+
+
+def pedir(servidor, credenciales, ids, cubo=None, estadisticas=None):
+    cubo = cubo or CuboTokens(1000, 100)
+    with crear_sesion(1, reintentos=0) as sesion:
+        return asyncio.run(pedir_lote(sesion, credenciales, cubo, ids, servidor.url + "v1/", estadisticas))
+
+
+def test_cubo_tokens_ritmo():
+    async def gastar(cubo, veces):
+        for _ in range(veces):
+            await cubo.esperar()
+
+    cubo = CuboTokens(tasa=50, capacidad=2)
+    inicio = time.monotonic()
+    asyncio.run(gastar(cubo, 12))
+    # Las 2 primeras salen del cubo lleno y las otras 10 a 50 por segundo
+    assert 0.18 <= time.monotonic() - inicio < 0.5
+
+
+def test_429_pausa_el_cubo(credenciales):
+    servidor = arrancar(tasa=2, rafaga=1)
+    try:
+        cubo = CuboTokens(1000, 100)
+        estadisticas = {}
+        pedir(servidor, credenciales, IDS[:1], cubo, estadisticas)
+        inicio = time.monotonic()
+        canciones = pedir(servidor, credenciales, IDS[1:2], cubo, estadisticas)
+        # La API pide esperar 1 s y el cubo no da tokens hasta entonces
+        assert time.monotonic() - inicio >= 0.9
+        assert cubo.pausa_hasta > 0
+        assert canciones == [cancion_simulada(IDS[1])]
+        assert estadisticas["limitadas"] == servidor.contadores["limitadas"] == 1
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def test_5xx_espera_exponencial(servidor, credenciales, monkeypatch):
+    esperas = []
+    original = enriquecimiento.tiempo_espera
+
+    def tiempo_espera(intento, retry_after=None):
+        esperas.append(original(intento, retry_after))
+        if len(esperas) == 3:
+            servidor.fallos = 0.0
+        return esperas[-1]
+
+    monkeypatch.setattr(enriquecimiento, "ESPERA_BASE", 0.01)
+    monkeypatch.setattr(enriquecimiento.random, "uniform", lambda a, b: b)
+    monkeypatch.setattr(enriquecimiento, "tiempo_espera", tiempo_espera)
+    servidor.fallos = 1.0
+    estadisticas = {}
+    canciones = pedir(servidor, credenciales, IDS[:3], estadisticas=estadisticas)
+    assert esperas == [0.01, 0.02, 0.04]
+    assert canciones == [cancion_simulada(track_id) for track_id in IDS[:3]]
+    assert estadisticas["errores"] == servidor.contadores["fallos"] == 3
+    assert servidor.contadores["peticiones"] == 1
+
+
+def test_5xx_sin_respuesta(servidor, credenciales, monkeypatch):
+    monkeypatch.setattr(enriquecimiento, "ESPERA_BASE", 0.001)
+    monkeypatch.setattr(enriquecimiento, "MAXIMO_REINTENTOS", 2)
+    servidor.fallos = 1.0
+    with pytest.raises(ErrorEnriquecimiento, match="503"):
+        pedir(servidor, credenciales, IDS[:1])
+    assert servidor.contadores["fallos"] == 3
+
+
+def test_401_renueva_el_token(servidor, credenciales):
+    credenciales.cache_handler.save_token_to_cache({"access_token": "revocado", "token_type": "Bearer",
+                                                    "expires_in": 3600, "expires_at": int(time.time()) + 3600})
+    canciones = pedir(servidor, credenciales, IDS[:2])
+    assert canciones == [cancion_simulada(track_id) for track_id in IDS[:2]]
+    assert servidor.contadores["token"] == 1
+    assert credenciales.cache_handler.get_cached_token()["access_token"] == TOKEN
+
+
+def test_continua_desde_punto_control_truncado(servidor, credenciales, tmp_path):
+    ruta = tmp_path / "enriquecimiento.jsonl"
+    hechas = {track_id: extraer_campos(cancion_simulada(track_id)) for track_id in IDS[:50]}
+    lineas = "".join(json.dumps({"track_id": track_id, **campos}) + "\n" for track_id, campos in hechas.items())
+    # Trabajo interrumpido mientras escribía la canción 51
+    ruta.write_text(lineas + json.dumps({"track_id": IDS[50], **hechas[IDS[0]]})[:30], encoding="utf-8")
+
+    resultados, estadisticas = asyncio.run(enriquecer_canciones(IDS, credenciales, servidor.url + "v1/", str(ruta)))
+    assert estadisticas["pendientes"] == servidor.contadores["canciones"] == 70
+    assert resultados == {track_id: extraer_campos(cancion_simulada(track_id)) for track_id in IDS}
+    assert leer_punto_control(str(ruta)) == resultados
+
+    # Con el punto de control completo no se vuelve a pedir nada
+    _, estadisticas = asyncio.run(enriquecer_canciones(IDS, credenciales, servidor.url + "v1/", str(ruta)))
+    assert estadisticas["pendientes"] == 0
+    assert servidor.contadores["canciones"] == 70
+
+
+def test_escribir_columnas_almacen_vacio(tmp_path):
+    ruta = str(tmp_path / "almacen.parquet")
+    generar_almacen(ruta, 100)
+    pq.write_table(pq.read_table(ruta).slice(0, 0), ruta)
+    escribir_columnas({}, ruta, str(tmp_path / "agregados"))
+    esquema = pq.read_schema(ruta)
+    assert pq.ParquetFile(ruta).metadata.num_rows == 0
+    assert [esquema.field(columna).type for columna in COLUMNAS_ENRIQUECIDAS] == list(COLUMNAS_ENRIQUECIDAS.values())
+
+
+def test_escribir_columnas_fallo_no_deja_temporal(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "almacen.parquet")
+    generar_almacen(ruta, 100)
+    # Una primera escritura deja los agregados guardados, así que el fallo es al reescribir el almacén
+    escribir_columnas({}, ruta, str(tmp_path / "agregados"))
+    original = open(ruta, "rb").read()
+
+    def fallar(*args, **kwargs):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(enriquecimiento.pq.ParquetWriter, "write_table", fallar)
+    with pytest.raises(OSError, match="disco lleno"):
+        escribir_columnas({}, ruta, str(tmp_path / "agregados"))
+    assert not os.path.exists(ruta + ".tmp")
+    assert open(ruta, "rb").read() == original
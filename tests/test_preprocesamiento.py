@@ -0,0 +1,23 @@
+"""
+Pruebas del preprocesamiento por bloques.
+"""
+import os
+
+import pytest
+
+from preprocesamiento import preprocesar
+
+
+COLUMNAS = ["Unnamed: 0", "artist_name", "track_name", "track_id", "popularity", "year", "genre", "danceability",
+            "energy", "key", "loudness", "mode", "speechiness", "acousticness", "instrumentalness", "liveness",
+            "valence", "tempo", "duration_ms", "time_signature"]
+
+
+def test_entrada_sin_canciones(tmp_path):
+    entrada = tmp_path / "spotify_data.csv"
+    entrada.write_text(",".join(COLUMNAS) + "\n", encoding="utf-8")
+    ruta_parquet = tmp_path / "almacen.parquet"
+    ruta_csv = tmp_path / "limpio.zip"
+    with pytest.raises(ValueError, match="no tiene canciones"):
+        preprocesar(str(entrada), str(ruta_parquet), str(ruta_csv), procesos=1)
+    assert sorted(os.listdir(tmp_path)) == ["spotify_data.csv"]
@@ -0,0 +1,20 @@
+"""
+Pruebas del índice de canciones similares.
+"""
+import numpy as np
+import pandas as pd
+
+from datos import COLUMNAS_MODELO
+from similares import buscar_similares, construir_indice
+
+
+def test_indice_sin_generos_nulos():
+    df = pd.DataFrame({columna: np.arange(6, dtype=float) for columna in COLUMNAS_MODELO})
+    df["track_id"] = [f"t{i}" for i in range(6)]
+    df["genre"] = pd.Categorical(["pop", None, "rock", "pop", None, "rock"])
+    indice = construir_indice(df)
+    assert indice["generos"] == ["pop", "rock"]
+    assert indice["inicios"].tolist() == [0, 2, 4]
+    assert sorted(indice["track_id"].astype(str)) == ["t0", "t2", "t3", "t5"]
+    valores = {columna: 3.0 for columna in COLUMNAS_MODELO}
+    assert buscar_similares(indice, valores, ["pop"], 1) == ["t3"]